@@ -0,0 +1,272 @@
+"""
+API Tackle - Benchmark of the request path (flask callbacks, controller_decorator, lock_decorator & auth_decorator).
+
+Measures the requests/sec, the p50/p95/p99 latencies and the DB queries per request of /health and /dashboard at
+several concurrency levels. Served in-process via the Flask test client and/or by a local gunicorn server, against a
+SQLite DB and (optionally) a local Postgres DB e.g. the one created by the 'local_postgress_db' make target:
+
+    python benchmarks/bench_request_path.py --concurrency 1,4,16 --requests 1000 \
+        --postgres-url "postgresql://127.0.0.1:5432/tackle?user=tackle&password=tackle" \
+        --output bench_output.json --compare previous_bench_output.json
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+import subprocess
+import tempfile
+import threading
+import time
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Callable, Tuple  # noqa # pylint: disable=unused-import
+
+# NOTE: The below import is useful to bring tackle into the Python path!
+module_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from sqlalchemy import event  # noqa
+from flask import g, has_request_context  # noqa
+
+from tackle.flask_utils import create_flask_app, db, reset_logging  # noqa
+from tackle.rest_api import get_path  # noqa
+from tackle.rest_api import wrapper_util  # noqa
+
+BENCH_AUTH_TOKEN = "The_api_key_for_benchmarking."
+DB_QUERIES_HEADER = "X-Bench-DB-Queries"
+
+
+def install_query_counter(flask_app) -> None:
+    """ Count the DB queries of each request and return the count in the DB_QUERIES_HEADER response header. """
+
+    def cllbck_before_cursor_execute(*args, **kwargs):
+        if has_request_context():
+            g.bench_db_queries = g.get('bench_db_queries', 0) + 1
+
+    def cllbck_after_request(response):
+        response.headers[DB_QUERIES_HEADER] = str(g.get('bench_db_queries', 0))
+        return response
+
+    event.listen(db.engine, 'before_cursor_execute', cllbck_before_cursor_execute)
+    flask_app.after_request(cllbck_after_request)
+
+
+def create_bench_app(database_url: str, prepare_db: bool = True):
+    """
+    Create the app under test. Logging is limited to WARNINGS+ to not dominate the measurements.
+
+    :param prepare_db: Create the tables and add the benchmark auth token. Done once before the gunicorn workers start.
+    """
+    reset_logging()
+    logging.basicConfig(level=logging.WARNING)
+
+    flask_app = create_flask_app(specification_dir=get_path() + '/flask_server/swagger/',
+                                 add_api=True, swagger_ui=False,
+                                 database_url=database_url,
+                                 database_create_tables=prepare_db,
+                                 debug=False)
+
+    if prepare_db:
+        wrapper_util.add_auth_token(BENCH_AUTH_TOKEN, "Benchmark token.")
+
+    install_query_counter(flask_app.app)
+
+    return flask_app
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """ Nearest-rank percentile of sorted values. """
+    if not sorted_values:
+        return None
+
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_load(send: Callable[[], Tuple[int, int]],
+             concurrency: int,
+             num_requests: int) -> Dict:
+    """
+    Send num_requests requests from concurrency threads.
+
+    :param send: Sends one request and returns (status code, number of DB queries).
+    :return: The throughput, latency and DB query stats.
+    """
+    latencies = []  # type: List[float]
+    db_queries = []  # type: List[int]
+    errors = [0]
+    results_lock = threading.Lock()
+
+    def worker(worker_num_requests: int):
+        for _ in range(worker_num_requests):
+            request_start_time = time.perf_counter()
+            status_code, request_db_queries = send()
+            latency = time.perf_counter() - request_start_time
+
+            with results_lock:
+                latencies.append(latency)
+                db_queries.append(request_db_queries)
+                if status_code != 200:
+                    errors[0] += 1
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        shares = [num_requests // concurrency + (1 if i < num_requests % concurrency else 0) for i in range(concurrency)]
+        list(executor.map(worker, shares))
+    duration = time.perf_counter() - start_time
+
+    latencies.sort()
+
+    return {"requests": len(latencies),
+            "errors": errors[0],
+            "duration_s": round(duration, 4),
+            "requests_per_sec": round(len(latencies) / duration, 2),
+            "latency_p50_ms": round(percentile(latencies, 0.50) * 1000.0, 3),
+            "latency_p95_ms": round(percentile(latencies, 0.95) * 1000.0, 3),
+            "latency_p99_ms": round(percentile(latencies, 0.99) * 1000.0, 3),
+            "db_queries_per_request": round(sum(db_queries) / max(len(db_queries), 1), 3)}
+
+
+def bench_flask_test_client(flask_app, endpoints: List[str], concurrency_levels: List[int],
+                            num_requests: int) -> List[Dict]:
+    local = threading.local()
+
+    results = []
+
+    for endpoint in endpoints:
+        def send() -> Tuple[int, int]:
+            if not hasattr(local, 'client'):
+                local.client = flask_app.app.test_client()
+
+            response = local.client.get(endpoint, headers={"X-Auth-Token": BENCH_AUTH_TOKEN})
+            return response.status_code, int(response.headers.get(DB_QUERIES_HEADER, 0))
+
+        for concurrency in concurrency_levels:
+            send()  # Warm up.
+            results.append(dict(endpoint=endpoint, concurrency=concurrency,
+                                **run_load(send, concurrency, num_requests)))
+
+    return results
+
+
+def bench_gunicorn(database_url: str, endpoints: List[str], concurrency_levels: List[int],
+                   num_requests: int, workers: int, threads: int, port: int) -> List[Dict]:
+    import requests
+
+    env = dict(os.environ, TACKLE_BENCH_DATABASE_URL=database_url,
+               PYTHONPATH=os.pathsep.join([module_path, os.environ.get('PYTHONPATH', '')]))
+
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn',
+                               '--bind', f'127.0.0.1:{port}', '-w', str(workers), '--threads', str(threads),
+                               '--chdir', os.path.dirname(os.path.abspath(__file__)),
+                               'bench_wsgi:application'], env=env)
+    base_url = f'http://127.0.0.1:{port}'
+
+    try:
+        for _ in range(100):  # Wait for the server to be up.
+            try:
+                requests.get(base_url + '/health', headers={"X-Auth-Token": BENCH_AUTH_TOKEN}, timeout=10.0)
+                break
+            except requests.RequestException:
+                time.sleep(0.2)
+
+        local = threading.local()
+        results = []
+
+        for endpoint in endpoints:
+            def send() -> Tuple[int, int]:
+                if not hasattr(local, 'session'):
+                    local.session = requests.Session()
+
+                response = local.session.get(base_url + endpoint, headers={"X-Auth-Token": BENCH_AUTH_TOKEN})
+                return response.status_code, int(response.headers.get(DB_QUERIES_HEADER, 0))
+
+            for concurrency in concurrency_levels:
+                results.append(dict(endpoint=endpoint, concurrency=concurrency,
+                                    **run_load(send, concurrency, num_requests)))
+
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(results: Dict, previous_results: Dict) -> None:
+    """ Print the change in throughput and p99 latency relative to a previous run. """
+    previous = {(r['mode'], r['db'], r['endpoint'], r['concurrency']): r for r in previous_results['results']}
+
+    print("mode, db, endpoint, concurrency: requests/sec (change), p99 ms (change)")
+    for r in results['results']:
+        p = previous.get((r['mode'], r['db'], r['endpoint'], r['concurrency']))
+
+        if p is None:
+            print(f"{r['mode']}, {r['db']}, {r['endpoint']}, {r['concurrency']}: no previous result.")
+        else:
+            rps_change = (r['requests_per_sec'] - p['requests_per_sec']) / p['requests_per_sec'] * 100.0
+            p99_change = (r['latency_p99_ms'] - p['latency_p99_ms']) / p['latency_p99_ms'] * 100.0
+            print(f"{r['mode']}, {r['db']}, {r['endpoint']}, {r['concurrency']}: "
+                  f"{r['requests_per_sec']} ({rps_change:+.1f}%), {r['latency_p99_ms']} ({p99_change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the tackle request path.")
+    parser.add_argument('--modes', default='flask,gunicorn', help="Comma separated: flask (test client), gunicorn.")
+    parser.add_argument('--endpoints', default='/health,/dashboard')
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma separated concurrency levels.")
+    parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint and concurrency level.")
+    parser.add_argument('--postgres-url', default=os.environ.get('TACKLE_BENCH_POSTGRES_URL'),
+                        help="Also benchmark against this (local) Postgres DB.")
+    parser.add_argument('--gunicorn-workers', type=int, default=2)
+    parser.add_argument('--gunicorn-threads', type=int, default=8)
+    parser.add_argument('--gunicorn-port', type=int, default=7199)
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', default=None, help="A previous output file to compare with.")
+    args = parser.parse_args()
+
+    modes = args.modes.split(',')
+    endpoints = args.endpoints.split(',')
+    concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+
+    database_urls = {'sqlite': 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')}
+    if args.postgres_url:
+        database_urls['postgres'] = args.postgres_url
+
+    try:
+        git_rev = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=module_path).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_rev = None
+
+    results = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "git_rev": git_rev,
+               "python": platform.python_version(),
+               "requests": args.requests,
+               "results": []}  # type: Dict
+
+    for db_name, database_url in database_urls.items():
+        flask_app = create_bench_app(database_url)
+
+        if 'flask' in modes:
+            for r in bench_flask_test_client(flask_app, endpoints, concurrency_levels, args.requests):
+                results['results'].append(dict(mode='flask', db=db_name, **r))
+                print(results['results'][-1], flush=True)
+
+        if 'gunicorn' in modes:
+            for r in bench_gunicorn(database_url, endpoints, concurrency_levels, args.requests,
+                                    args.gunicorn_workers, args.gunicorn_threads, args.gunicorn_port):
+                results['results'].append(dict(mode='gunicorn', db=db_name, **r))
+                print(results['results'][-1], flush=True)
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {args.output}.")
+
+    if args.compare:
+        with open(args.compare) as compare_file:
+            compare(results, json.load(compare_file))
+
+
+if __name__ == '__main__':
+    main()
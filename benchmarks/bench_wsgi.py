@@ -0,0 +1,6 @@
+""" WSGI app served by gunicorn for bench_request_path.py. """
+import os
+
+from bench_request_path import create_bench_app
+
+application = create_bench_app(os.environ['TACKLE_BENCH_DATABASE_URL'], prepare_db=False).app
@@ -0,0 +1,235 @@
+import io
+import sys
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional, Callable, Any  # noqa # pylint: disable=unused-import
+
+from tackle.flask_utils import create_flask_app
+from tackle.rest_api import wrapper_util
+from tackle.rest_api.flask_server.controllers.controller_util import usage_headers
+
+JSONType = wrapper_util.JSONType
+ASGIHeaders = List[Tuple[bytes, bytes]]
+
+
+class AsyncRequest(object):
+    """ The request passed to the handlers of the native async routes of an ASGIApp. """
+    __slots__ = ('method', 'path', 'query_string', 'headers', 'body')
+
+    def __init__(self, method: str, path: str, query_string: bytes, headers: Dict[str, str], body: bytes) -> None:
+        self.method = method
+        self.path = path
+        self.query_string = query_string
+        self.headers = headers  # Lower case header names.
+        self.body = body
+
+    @property
+    def auth_token(self) -> Optional[str]:
+        """ The auth token of the AUTH_TOKEN or X-Auth-Token header. See controller_util.get_auth_token(). """
+        auth_token = self.headers.get('auth_token')
+        return self.headers.get('x-auth-token') if auth_token is None else auth_token
+
+    @property
+    def caller_name(self) -> Optional[str]:
+        return self.headers.get('x-caller')
+
+    def json(self) -> JSONType:
+        """ The JSON decoded body. None if the body is empty. """
+        return json.loads(self.body) if self.body else None
+
+
+def _wsgi_environ(scope: Dict, body: bytes) -> Dict[str, Any]:
+    """ The PEP 3333 environ of an ASGI http request scope. """
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }  # type: Dict[str, Any]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = (environ[key] + ',' + value) if key in environ else value
+
+    return environ
+
+
+def _call_wsgi(wsgi_app: Callable, environ: Dict[str, Any]) -> Tuple[int, ASGIHeaders, bytes]:
+    """ Call a WSGI app and collect its (buffered) response. Blocking. """
+    response = {}  # type: Dict[str, Any]
+    chunks = []  # type: List[bytes]
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return chunks.append
+
+    result = wsgi_app(environ, start_response)
+
+    try:
+        for chunk in result:
+            chunks.append(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    return response['status'], response['headers'], b''.join(chunks)
+
+
+class ASGIApp(object):
+    """
+    ASGI app that serves the (connexion/Flask) WSGI app from a bounded thread pool and native async routes on the event
+    loop. A slow async wrapper (e.g. awaiting a downstream service) then doesn't hold a worker thread while it waits. The
+    WSGI responses are buffered i.e. not streamed. See create_asgi_app(...).
+    """
+
+    def __init__(self, wsgi_app: Callable, max_workers: int = 32) -> None:
+        """
+        :param wsgi_app: The WSGI app e.g. the flask app of create_flask_app(...).app.
+        :param max_workers: The max number of WSGI requests served concurrently; more are queued.
+        """
+        self.wsgi_app = wsgi_app
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tackle_wsgi')
+        self._async_routes = {}  # type: Dict[Tuple[str, str], Callable]  # (method, path) -> async handler
+
+    def add_async_route(self, path: str, handler: Callable, methods: Tuple[str, ...] = ('GET',)) -> None:
+        """
+        Serve requests of the path natively on the event loop.
+
+        :param handler: async handler(request: AsyncRequest) -> (response_code, response_json) e.g. calling an async
+                        wrapper function decorated with wrapper_util.async_auth_decorator.
+        """
+        for method in methods:
+            self._async_routes[(method.upper(), path)] = handler
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+        wrapper_util.shutdown_async_executor()
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'lifespan':
+            await self._serve_lifespan(receive, send)
+            return
+        elif scope['type'] != 'http':
+            raise ValueError(f"asgi_utils.ASGIApp: Unsupported scope type {scope['type']}!")
+
+        body = await self._read_body(receive)
+
+        if body is None:
+            return  # The client disconnected.
+
+        handler = self._async_routes.get((scope['method'], scope['path']))
+
+        if handler is not None:
+            status, headers, response_body = await self._serve_async(handler, scope, body)
+        else:
+            status, headers, response_body = await asyncio.get_running_loop().run_in_executor(self._executor, _call_wsgi,
+                                                                                              self.wsgi_app,
+                                                                                              _wsgi_environ(scope, body))
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': response_body})
+
+    async def _serve_lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive: Callable) -> Optional[bytes]:
+        """ The request body. None if the client disconnected. """
+        chunks = []  # type: List[bytes]
+        more_body = True
+
+        while more_body:
+            message = await receive()
+
+            if message['type'] == 'http.disconnect':
+                return None
+
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+
+        return b''.join(chunks)
+
+    @staticmethod
+    async def _serve_async(handler: Callable, scope: Dict, body: bytes) -> Tuple[int, ASGIHeaders, bytes]:
+        request = AsyncRequest(method=scope['method'],
+                               path=scope['path'],
+                               query_string=scope.get('query_string', b''),
+                               headers={name.decode('latin-1').lower(): value.decode('latin-1')
+                                        for name, value in scope.get('headers', [])},
+                               body=body)
+
+        try:
+            response_code, response_json = await handler(request)
+        except Exception as e:
+            logging.exception(f"asgi_utils.ASGIApp: Uncaught exception in async route {scope['path']}: {e}!")
+            response_code, response_json = 500, {"error_detail": "Internal server error!"}
+
+        headers = [(b'content-type', b'application/json')]  # type: ASGIHeaders
+        headers.extend((name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                       for name, value in usage_headers(request.auth_token, response_code).items())
+
+        return response_code, headers, json.dumps(response_json, separators=(',', ':')).encode('utf-8')
+
+
+def create_asgi_app(max_workers: int = 32,
+                    async_max_workers: int = 16,
+                    async_routes: Optional[Dict[str, Callable]] = None,
+                    **kwargs) -> ASGIApp:
+    """
+    Create the Flask/Connexion app (see flask_utils.create_flask_app) and an ASGI app serving it e.g. with
+    uvicorn --workers 4 'rest_asgi_app:application'.
+
+    :param max_workers: The max number of (sync) WSGI requests served concurrently.
+    :param async_max_workers: The max number of concurrent blocking calls (DB access) of the async wrappers. See
+                              wrapper_util.configure_async_executor(...).
+    :param async_routes: Optional path -> async handler(request: AsyncRequest) of GET routes served on the event loop.
+    :param kwargs: The arguments of create_flask_app(...).
+    """
+    connexion_app = create_flask_app(**kwargs)
+
+    wrapper_util.configure_async_executor(async_max_workers, app=connexion_app.app)
+    asgi_app = ASGIApp(connexion_app.app, max_workers=max_workers)
+
+    for path, handler in (async_routes or {}).items():
+        asgi_app.add_async_route(path, handler)
+
+    return asgi_app
@@ -0,0 +1,159 @@
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Hashable, Tuple, Dict, List  # noqa # pylint: disable=unused-import
+
+
+class TTLCache(object):
+    """
+    Thread-safe cache with size based (LRU) and time based (TTL) eviction. Supports the subset of the dict interface
+    used by the wrapper caches i.e. get, pop, [] and in.
+    """
+
+    def __init__(self,
+                 max_size: int = 10000,
+                 ttl: Optional[float] = None) -> None:
+        """
+        :param max_size: The max number of entries to keep. The least recently used entry is evicted first.
+        :param ttl: The time to live (in seconds) of an entry from when it was set. 'None' for no time based expiry.
+        """
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # type: OrderedDict  # key -> (value, set_time)
+        self.max_size = max_size
+        self.ttl = ttl
+
+    def configure(self,
+                  max_size: int,
+                  ttl: Optional[float]) -> None:
+        """ Change the size limit and TTL of the cache. Entries over the new size limit are evicted immediately. """
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._evict_lru()
+
+    def _is_expired(self, set_time: float, current_time: float) -> bool:
+        return (self.ttl is not None) and ((current_time - set_time) >= self.ttl)
+
+    def _evict_lru(self) -> None:
+        while len(self._entries) > max(self.max_size, 0):
+            self._entries.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Get the value of a key that has not expired yet. Expired entries are evicted. """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return default
+
+            if self._is_expired(entry[1], time.time()):
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def update_value(self, key: Hashable, value: Any) -> bool:
+        """
+        Update the value of an existing entry WITHOUT resetting its age i.e. the entry will still expire relative to when
+        it was originally set. Used for local updates of values that should still be refreshed from the source.
+
+        :return: True if the entry was present (and not expired) and has been updated.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if (entry is None) or self._is_expired(entry[1], time.time()):
+                return False
+
+            self._entries[key] = (value, entry[1])
+            self._entries.move_to_end(key)
+            return True
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            self._evict_lru()
+
+    def __getitem__(self, key: Hashable) -> Any:
+        sentinel = object()
+        value = self.get(key, sentinel)
+
+        if value is sentinel:
+            raise KeyError(key)
+
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class BloomFilter(object):
+    """
+    Bloom filter of byte strings (e.g. token digests): A membership test without false negatives and with a false
+    positive rate of about false_positive_rate while at most capacity items have been added. Adds are thread-safe.
+    """
+
+    def __init__(self,
+                 capacity: int,
+                 false_positive_rate: float = 0.001) -> None:
+        """
+        :param capacity: The number of items the filter is sized for.
+        :param false_positive_rate: The target false positive rate at capacity.
+        """
+        capacity = max(capacity, 1)
+        num_bits = max(int(math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))), 64)
+
+        self._lock = threading.Lock()
+        self._bits = bytearray((num_bits + 7) // 8)
+        self.num_bits = len(self._bits) * 8
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.count = 0
+
+    def _positions(self, item: bytes) -> List[int]:
+        """ The bit positions of an item by double hashing. """
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: bytes) -> None:
+        positions = self._positions(item)
+
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+
+            self.count += 1
+
+    def __contains__(self, item: bytes) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def false_positive_rate(self) -> float:
+        """ The expected false positive rate given the number of items added. """
+        return (1.0 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
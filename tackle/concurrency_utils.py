@@ -0,0 +1,284 @@
+import time
+import threading
+import itertools
+import logging
+from collections import deque
+from typing import Dict, Any, Tuple, List, Optional, Callable  # noqa # pylint: disable=unused-import
+
+
+class RWLock(object):
+    """ Writer preferring readers-writer lock. Many concurrent readers OR one writer. """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self, blocking: bool = True) -> bool:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                if not blocking:
+                    return False
+                self._cond.wait()
+            self._readers += 1
+            return True
+
+    def release_read(self) -> None:
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self, blocking: bool = True) -> bool:
+        with self._cond:
+            if (not blocking) and (self._writer or self._readers):
+                return False
+
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+            return True
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+# =============================
+# Registry of named synchronisation primitives so that policies with the same name share a primitive.
+_named_primitives = {}  # type: Dict[str, Any]
+_named_primitives_lock = threading.Lock()
+
+
+def _get_named_primitive(key: str, factory) -> Any:
+    with _named_primitives_lock:
+        primitive = _named_primitives.get(key)
+
+        if primitive is None:
+            primitive = factory()
+            _named_primitives[key] = primitive
+
+        return primitive
+
+
+class ConcurrencyPolicy(object):
+    """
+    A policy to control concurrent access to a resource. Policies with the same kind and name share the underlying lock.
+    This base policy applies no lock at all and is meant for re-entrant (thread safe) resources.
+    """
+    kind = 'none'
+
+    def __init__(self, name: str = 'none') -> None:
+        self.name = name
+
+    @property
+    def label(self) -> str:
+        """ Bounded label of the policy for use in metrics. """
+        return f"{self.kind}:{self.name}"
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """ Acquire the policy's lock. Returns False if not blocking and the lock isn't available right away. """
+        return True
+
+    def release(self) -> None:
+        pass
+
+
+class ExclusivePolicy(ConcurrencyPolicy):
+    """ One call at a time across all users of the named lock. """
+    kind = 'exclusive'
+
+    def __init__(self, name: str) -> None:
+        ConcurrencyPolicy.__init__(self, name)
+        self._lock = _get_named_primitive(f"exclusive:{name}", threading.Lock)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        return self._lock.acquire(blocking)
+
+    def release(self) -> None:
+        self._lock.release()
+
+
+class SemaphorePolicy(ConcurrencyPolicy):
+    """ At most 'limit' concurrent calls across all users of the named semaphore. """
+    kind = 'semaphore'
+
+    def __init__(self, name: str, limit: int) -> None:
+        ConcurrencyPolicy.__init__(self, name)
+        self.limit = limit
+        self._semaphore = _get_named_primitive(f"semaphore:{name}", lambda: threading.BoundedSemaphore(limit))
+
+        # pylint: disable=protected-access
+        if getattr(self._semaphore, '_initial_value', limit) != limit:
+            raise ValueError(f"SemaphorePolicy: Semaphore '{name}' already exists with a different limit!")
+
+    def acquire(self, blocking: bool = True) -> bool:
+        return self._semaphore.acquire(blocking)
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+
+class ReadPolicy(ConcurrencyPolicy):
+    """ Shared (read) access to the named readers-writer lock. """
+    kind = 'read'
+
+    def __init__(self, name: str) -> None:
+        ConcurrencyPolicy.__init__(self, name)
+        self._rw_lock = _get_named_primitive(f"rw:{name}", RWLock)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        return self._rw_lock.acquire_read(blocking)
+
+    def release(self) -> None:
+        self._rw_lock.release_read()
+
+
+class WritePolicy(ConcurrencyPolicy):
+    """ Exclusive (write) access to the named readers-writer lock. """
+    kind = 'write'
+
+    def __init__(self, name: str) -> None:
+        ConcurrencyPolicy.__init__(self, name)
+        self._rw_lock = _get_named_primitive(f"rw:{name}", RWLock)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        return self._rw_lock.acquire_write(blocking)
+
+    def release(self) -> None:
+        self._rw_lock.release_write()
+
+
+# No lock for re-entrant resources.
+NO_LOCK = ConcurrencyPolicy()
+
+
+class UtilisationTracker(object):
+    """
+    Tracks the in-flight requests of a worker and its busy time over a sliding window. Safe for concurrent threads and
+    for interleaved (async) requests on one thread. The hot path (start/end) takes no lock; it relies on the atomicity
+    of dict and deque operations. The aggregation is done when a snapshot is taken e.g. at metrics scrape time.
+    """
+
+    def __init__(self,
+                 window: float = 60.0,
+                 capacity: int = 1,
+                 max_intervals: int = 100000) -> None:
+        """
+        :param window: The length (in seconds) of the sliding window.
+        :param capacity: The number of requests the worker can serve concurrently e.g. its number of threads.
+        :param max_intervals: The max number of completed request intervals kept for the window.
+        """
+        self.window = window
+        self.capacity = capacity
+
+        self._span_ids = itertools.count()
+        self._active = {}  # type: Dict[int, float]  # span id -> start time
+        self._completed = deque(maxlen=max_intervals)  # type: deque  # (start time, end time) in order of end time
+        self._created_time = time.time()
+
+        self._snapshot_lock = threading.Lock()  # Serialises concurrent snapshots; not used on the hot path.
+
+    def configure(self, window: float, capacity: int) -> None:
+        self.window = window
+        self.capacity = capacity
+
+    def start(self) -> int:
+        """ Mark the start of a request. Returns the span id to pass to end(...). """
+        span_id = next(self._span_ids)
+        self._active[span_id] = time.time()
+        return span_id
+
+    def end(self, span_id: int) -> None:
+        """ Mark the end of the request started with span id. """
+        start_time = self._active.pop(span_id, None)
+
+        if start_time is not None:
+            self._completed.append((start_time, time.time()))
+
+    def record(self, start_time: float, end_time: float) -> None:
+        """ Record a completed request timed elsewhere e.g. by a worker process. """
+        self._completed.append((start_time, end_time))
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._active)
+
+    def snapshot(self) -> Tuple[int, float, float, float]:
+        """
+        :return: (in_flight, concurrency, saturation, idle_fraction) where concurrency is the average number of in-flight
+                 requests over the window, saturation is concurrency / capacity and idle_fraction is the fraction of the
+                 window during which no request was in flight.
+        """
+        with self._snapshot_lock:
+            current_time = time.time()
+            window_start = max(current_time - self.window, self._created_time)
+            window = current_time - window_start
+
+            active_start_times = list(self._active.copy().values())
+
+            while self._completed and self._completed[0][1] <= window_start:
+                self._completed.popleft()
+
+            intervals = [(max(start_time, window_start), end_time) for start_time, end_time in list(self._completed)]
+            intervals += [(max(start_time, window_start), current_time) for start_time in active_start_times]
+
+        if window <= 0.0:
+            return len(active_start_times), 0.0, 0.0, 0.0 if active_start_times else 1.0
+
+        busy_time = 0.0
+        union_time = 0.0
+        union_end = window_start
+
+        for start_time, end_time in sorted(intervals):
+            busy_time += end_time - start_time
+
+            if end_time > union_end:
+                union_time += end_time - max(start_time, union_end)
+                union_end = end_time
+
+        concurrency = busy_time / window
+
+        return len(active_start_times), concurrency, concurrency / max(self.capacity, 1), max(1.0 - union_time / window, 0.0)
+
+
+class PeriodicTask(object):
+    """ Calls fn every interval seconds on a daemon thread. Exceptions raised by fn are logged and the task carries on. """
+
+    def __init__(self,
+                 fn: Callable[[], Any],
+                 interval: float,
+                 name: str) -> None:
+        self._fn = fn
+        self.interval = interval
+        self.name = name
+
+        self._stop_event = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def run(self) -> Any:
+        """ Call fn now in the calling thread. """
+        return self._fn()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run()
+            except Exception:
+                logging.exception(f"PeriodicTask._run: Task {self.name} failed!")
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
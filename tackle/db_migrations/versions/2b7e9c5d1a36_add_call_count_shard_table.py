@@ -0,0 +1,34 @@
+"""Add the table of the sharded call count increments of wrapper_util.enable_sharded_call_counts.
+
+Revision ID: 2b7e9c5d1a36
+Revises: 8d3a6b2c4f10
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7e9c5d1a36'
+down_revision = '8d3a6b2c4f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may already have been created by db.create_all().
+    if 'api_callcount_shard_data' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('api_callcount_shard_data',
+                    sa.Column('token_id', sa.Integer(), nullable=False),
+                    sa.Column('endpoint', sa.String(), nullable=False),
+                    sa.Column('shard', sa.Integer(), nullable=False),
+                    sa.Column('call_count', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('token_id', 'endpoint', 'shard'))
+
+
+def downgrade():
+    # The pending increments of the shards are lost; run the compaction first.
+    op.drop_table('api_callcount_shard_data')
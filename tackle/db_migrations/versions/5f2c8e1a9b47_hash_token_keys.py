@@ -0,0 +1,173 @@
+"""Store the auth tokens by digest: Create the hashed-key tables, copy the tokens from the raw-token tables and drop them.
+
+Revision ID: 5f2c8e1a9b47
+Revises:
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+import time
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c8e1a9b47'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# The number of rows read and inserted per round trip.
+BATCH_SIZE = 1000
+
+TOKEN_DIGEST_SIZE = 32
+
+
+def _token_digest(auth_token):
+    """ See tackle.db_models.token_digest(...). Repeated here so that the revision doesn't change with the models. """
+    return hashlib.sha256(auth_token.encode('utf-8')).digest()
+
+
+def _stream_batches(bind, query):
+    """ The rows of the query in batches of BATCH_SIZE, read with a server side cursor where the DB supports it. """
+    result = bind.execution_options(stream_results=True).execute(query)
+
+    try:
+        while True:
+            rows = result.fetchmany(BATCH_SIZE)
+
+            if not rows:
+                return
+
+            yield rows
+    finally:
+        result.close()
+
+
+def _create_tables(bind, table_names):
+    if bind.dialect.name == 'postgresql':
+        op.execute("CREATE SEQUENCE IF NOT EXISTS api_key_token_id_seq")
+
+    if 'api_key_hashed_data' not in table_names:
+        op.create_table('api_key_hashed_data',
+                        sa.Column('key_digest', sa.LargeBinary(length=TOKEN_DIGEST_SIZE), nullable=False),
+                        sa.Column('token_id', sa.Integer(), nullable=False),
+                        sa.Column('desc', sa.String(length=1024), nullable=True),
+                        sa.Column('call_count', sa.Integer(), nullable=True),
+                        sa.Column('call_count_limit', sa.Integer(), nullable=True),
+                        sa.Column('rate_limit_per_sec', sa.Float(), nullable=True),
+                        sa.Column('units_limit_per_min', sa.Integer(), nullable=True),
+                        sa.Column('updated_at', sa.Float(), nullable=True),
+                        sa.PrimaryKeyConstraint('key_digest'),
+                        sa.UniqueConstraint('token_id'))
+        op.create_index(op.f('ix_api_key_hashed_data_updated_at'), 'api_key_hashed_data', ['updated_at'], unique=False)
+
+    if 'admin_api_key_hashed_data' not in table_names:
+        op.create_table('admin_api_key_hashed_data',
+                        sa.Column('key_digest', sa.LargeBinary(length=TOKEN_DIGEST_SIZE), nullable=False),
+                        sa.Column('desc', sa.String(length=1024), nullable=True),
+                        sa.PrimaryKeyConstraint('key_digest'))
+
+    if 'api_callcount_breakdown_hashed_data' not in table_names:
+        op.create_table('api_callcount_breakdown_hashed_data',
+                        sa.Column('token_id', sa.Integer(), nullable=False),
+                        sa.Column('endpoint', sa.String(), nullable=False),
+                        sa.Column('call_count', sa.Integer(), nullable=True),
+                        sa.PrimaryKeyConstraint('token_id', 'endpoint'))
+
+
+def _copy_tokens(bind, table_names):
+    """ Copy the tokens (and their call count breakdowns) of the raw-token tables. Tokens already copied are skipped. """
+    metadata = sa.MetaData()
+    key_table = sa.Table('api_key_hashed_data', metadata, autoload_with=bind)
+    breakdown_table = sa.Table('api_callcount_breakdown_hashed_data', metadata, autoload_with=bind)
+    admin_table = sa.Table('admin_api_key_hashed_data', metadata, autoload_with=bind)
+
+    token_ids = dict(bind.execute(sa.select([key_table.c.key_digest, key_table.c.token_id])).fetchall())
+    next_token_id = max(token_ids.values(), default=0) + 1
+    copied_digests = set()
+
+    if 'api_key_data' in table_names:
+        legacy_table = sa.Table('api_key_data', metadata, autoload_with=bind)
+        has_rate_limits = ('rate_limit_per_sec' in legacy_table.c) and ('units_limit_per_min' in legacy_table.c)
+        updated_at = time.time()
+
+        for legacy_rows in _stream_batches(bind, legacy_table.select()):
+            rows = []
+
+            for legacy_row in legacy_rows:
+                digest = _token_digest(legacy_row['auth_key'])
+
+                if digest in token_ids:
+                    continue
+
+                token_ids[digest] = next_token_id
+                copied_digests.add(digest)
+                next_token_id += 1
+
+                rows.append({'key_digest': digest,
+                             'token_id': token_ids[digest],
+                             'desc': legacy_row['desc'],
+                             'call_count': legacy_row['call_count'] or 0,
+                             'call_count_limit': legacy_row['call_count_limit'],
+                             'rate_limit_per_sec': legacy_row['rate_limit_per_sec'] if has_rate_limits else None,
+                             'units_limit_per_min': legacy_row['units_limit_per_min'] if has_rate_limits else None,
+                             'updated_at': updated_at})
+
+            if rows:
+                bind.execute(key_table.insert(), rows)
+
+    if 'api_callcount_breakdown_data' in table_names:
+        legacy_table = sa.Table('api_callcount_breakdown_data', metadata, autoload_with=bind)
+
+        for legacy_rows in _stream_batches(bind, legacy_table.select()):
+            rows = []
+
+            for legacy_row in legacy_rows:
+                digest = _token_digest(legacy_row['auth_key'])
+
+                if digest in copied_digests:  # Only the breakdowns of the tokens copied above.
+                    rows.append({'token_id': token_ids[digest], 'endpoint': legacy_row['endpoint'],
+                                 'call_count': legacy_row['call_count']})
+
+            if rows:
+                bind.execute(breakdown_table.insert(), rows)
+
+    if 'admin_api_key_data' in table_names:
+        legacy_table = sa.Table('admin_api_key_data', metadata, autoload_with=bind)
+        admin_digests = set(digest for digest, in bind.execute(sa.select([admin_table.c.key_digest])).fetchall())
+
+        for legacy_rows in _stream_batches(bind, legacy_table.select()):
+            rows = []
+
+            for legacy_row in legacy_rows:
+                digest = _token_digest(legacy_row['auth_key'])
+
+                if digest not in admin_digests:
+                    admin_digests.add(digest)
+                    rows.append({'key_digest': digest, 'desc': legacy_row['desc']})
+
+            if rows:
+                bind.execute(admin_table.insert(), rows)
+
+    if bind.dialect.name == 'postgresql':
+        # New tokens take their ids from the sequence; start it after the ids assigned above.
+        bind.execute(sa.text("SELECT setval('api_key_token_id_seq', :next_token_id, false)"),
+                     next_token_id=next_token_id)
+
+
+def upgrade():
+    bind = op.get_bind()
+    table_names = set(sa.inspect(bind).get_table_names())
+
+    _create_tables(bind, table_names)
+    _copy_tokens(bind, table_names)
+
+    for legacy_table_name in ('api_callcount_breakdown_data', 'api_key_data', 'admin_api_key_data'):
+        if legacy_table_name in table_names:
+            op.drop_table(legacy_table_name)
+
+
+def downgrade():
+    raise RuntimeError("The raw auth tokens can't be recovered from their digests!")
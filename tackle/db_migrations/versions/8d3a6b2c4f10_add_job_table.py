@@ -0,0 +1,44 @@
+"""Add the table of the jobs queued with wrapper_util.job_decorator.
+
+Revision ID: 8d3a6b2c4f10
+Revises: 5f2c8e1a9b47
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3a6b2c4f10'
+down_revision = '5f2c8e1a9b47'
+branch_labels = None
+depends_on = None
+
+TOKEN_DIGEST_SIZE = 32
+
+
+def upgrade():
+    # The table may already have been created by db.create_all().
+    if 'api_job_data' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('api_job_data',
+                    sa.Column('job_id', sa.String(length=32), nullable=False),
+                    sa.Column('key_digest', sa.LargeBinary(length=TOKEN_DIGEST_SIZE), nullable=False),
+                    sa.Column('endpoint', sa.String(length=256), nullable=True),
+                    sa.Column('status', sa.String(length=16), nullable=True),
+                    sa.Column('response_code', sa.Integer(), nullable=True),
+                    sa.Column('result', sa.Text(), nullable=True),
+                    sa.Column('created_at', sa.Float(), nullable=True),
+                    sa.Column('updated_at', sa.Float(), nullable=True),
+                    sa.Column('expires_at', sa.Float(), nullable=True),
+                    sa.PrimaryKeyConstraint('job_id'))
+    op.create_index(op.f('ix_api_job_data_key_digest'), 'api_job_data', ['key_digest'], unique=False)
+    op.create_index(op.f('ix_api_job_data_expires_at'), 'api_job_data', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_api_job_data_expires_at'), table_name='api_job_data')
+    op.drop_index(op.f('ix_api_job_data_key_digest'), table_name='api_job_data')
+    op.drop_table('api_job_data')
@@ -0,0 +1,31 @@
+"""Add the heartbeat table of wrapper_util.enable_rate_limit_reconciliation.
+
+Revision ID: c41f0e8a7d52
+Revises: 2b7e9c5d1a36
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f0e8a7d52'
+down_revision = '2b7e9c5d1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may already have been created by db.create_all().
+    if 'rate_limit_worker_data' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('rate_limit_worker_data',
+                    sa.Column('worker_id', sa.String(length=256), nullable=False),
+                    sa.Column('last_seen', sa.Float(), nullable=True),
+                    sa.PrimaryKeyConstraint('worker_id'))
+
+
+def downgrade():
+    op.drop_table('rate_limit_worker_data')
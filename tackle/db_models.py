@@ -1,51 +1,149 @@
+import time
+import hashlib
 from typing import Optional
 from tackle.flask_utils import db
 
+TOKEN_DIGEST_SIZE = 32
+
+
+def token_digest(auth_token: str) -> bytes:
+    """ The fixed width SHA-256 digest of an auth token. The tokens are stored and looked up by digest only. """
+    return hashlib.sha256(auth_token.encode('utf-8')).digest()
+
 
 class APIKeyData(db.Model):
-    __tablename__ = "api_key_data"
+    __tablename__ = "api_key_hashed_data"
 
-    auth_key = db.Column(db.String(1024), primary_key=True)
+    key_digest = db.Column(db.LargeBinary(TOKEN_DIGEST_SIZE), primary_key=True)
+    # Compact id to key the call count breakdown by. Taken from the sequence where the DB has sequences (PostgreSQL).
+    token_id = db.Column(db.Integer, db.Sequence('api_key_token_id_seq'), unique=True, nullable=False)
     desc = db.Column(db.String(1024), primary_key=False)
 
     call_count = db.Column(db.Integer, primary_key=False)
     call_count_limit = db.Column(db.Integer, primary_key=False)
 
+    rate_limit_per_sec = db.Column(db.Float, primary_key=False)  # Max requests per second. NULL for no limit.
+    units_limit_per_min = db.Column(db.Integer, primary_key=False)  # Max call units per minute. NULL for no limit.
+
+    # The time (time.time()) of the last change of the token's desc or limits; the delta refresh of the warm token
+    # records reads the rows changed since its last sync. Set explicitly by the writers of the desc and limits, so that
+    # the call count updates of the request path don't rewrite the index.
+    updated_at = db.Column(db.Float, index=True, default=time.time)
+
     def __init__(self,
-                 _auth_key: str,
+                 _key_digest: bytes,
+                 _token_id: int,
                  _desc: str,
                  _call_count: int,
-                 _call_count_limit: Optional[int]) -> None:
-        self.auth_key = _auth_key
+                 _call_count_limit: Optional[int],
+                 _rate_limit_per_sec: Optional[float] = None,
+                 _units_limit_per_min: Optional[int] = None) -> None:
+        self.key_digest = _key_digest
+        self.token_id = _token_id
         self.desc = _desc
         self.call_count = _call_count
         self.call_count_limit = _call_count_limit
+        self.rate_limit_per_sec = _rate_limit_per_sec
+        self.units_limit_per_min = _units_limit_per_min
 
 
 class AdminAPIKeyData(db.Model):
-    __tablename__ = "admin_api_key_data"
+    __tablename__ = "admin_api_key_hashed_data"
 
-    auth_key = db.Column(db.String(1024), primary_key=True)
+    key_digest = db.Column(db.LargeBinary(TOKEN_DIGEST_SIZE), primary_key=True)
     desc = db.Column(db.String(1024), primary_key=False)
 
     def __init__(self,
-                 _auth_key: str,
+                 _key_digest: bytes,
                  _desc: str) -> None:
-        self.auth_key = _auth_key
+        self.key_digest = _key_digest
         self.desc = _desc
 
 
 class APICallCountBreakdownData(db.Model):
-    __tablename__ = "api_callcount_breakdown_data"
+    __tablename__ = "api_callcount_breakdown_hashed_data"
+
+    token_id = db.Column(db.Integer, primary_key=True)  # APIKeyData.token_id
+    endpoint = db.Column(db.String, primary_key=True)
+    call_count = db.Column(db.Integer, primary_key=False)
+
+    def __init__(self,
+                 _token_id: int,
+                 _endpoint: str,
+                 _call_count: int) -> None:
+        self.token_id = _token_id
+        self.endpoint = _endpoint
+        self.call_count = _call_count
 
-    auth_key = db.Column(db.String(1024), primary_key=True)
+
+class APICallCountShardData(db.Model):
+    """
+    Call count increments of a token spread over shard rows to avoid row lock contention on hot tokens. An endpoint of ''
+    holds the increments without an endpoint. The shards are folded into APIKeyData and APICallCountBreakdownData by the
+    compaction.
+    """
+    __tablename__ = "api_callcount_shard_data"
+
+    token_id = db.Column(db.Integer, primary_key=True)  # APIKeyData.token_id
     endpoint = db.Column(db.String, primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
     call_count = db.Column(db.Integer, primary_key=False)
 
     def __init__(self,
-                 _auth_key: str,
+                 _token_id: int,
                  _endpoint: str,
+                 _shard: int,
                  _call_count: int) -> None:
-        self.auth_key = _auth_key
+        self.token_id = _token_id
         self.endpoint = _endpoint
+        self.shard = _shard
         self.call_count = _call_count
+
+
+class RateLimitWorkerData(db.Model):
+    """ Heartbeat of the processes that enforce the rate limits. Used to divide the limits between the live workers. """
+    __tablename__ = "rate_limit_worker_data"
+
+    worker_id = db.Column(db.String(256), primary_key=True)
+    last_seen = db.Column(db.Float, primary_key=False)
+
+    def __init__(self,
+                 _worker_id: str,
+                 _last_seen: float) -> None:
+        self.worker_id = _worker_id
+        self.last_seen = _last_seen
+
+
+class APIJobData(db.Model):
+    """
+    The state and result of a wrapper call queued as a job. Owned by (and only visible to) the auth token that queued it.
+    Rows are deleted once expired.
+    """
+    __tablename__ = "api_job_data"
+
+    job_id = db.Column(db.String(32), primary_key=True)
+    key_digest = db.Column(db.LargeBinary(TOKEN_DIGEST_SIZE), index=True, nullable=False)  # APIKeyData.key_digest
+    endpoint = db.Column(db.String(256), primary_key=False)
+    status = db.Column(db.String(16), primary_key=False)  # 'queued', 'running', 'succeeded' or 'failed'
+    response_code = db.Column(db.Integer, primary_key=False)  # The wrapper's response code once completed.
+    result = db.Column(db.Text, primary_key=False)  # The wrapper's JSON encoded response once completed.
+    created_at = db.Column(db.Float, primary_key=False)
+    updated_at = db.Column(db.Float, primary_key=False)
+    expires_at = db.Column(db.Float, index=True)
+
+    def __init__(self,
+                 _job_id: str,
+                 _key_digest: bytes,
+                 _endpoint: str,
+                 _status: str,
+                 _created_at: float,
+                 _expires_at: float) -> None:
+        self.job_id = _job_id
+        self.key_digest = _key_digest
+        self.endpoint = _endpoint
+        self.status = _status
+        self.response_code = None
+        self.result = None
+        self.created_at = _created_at
+        self.updated_at = _created_at
+        self.expires_at = _expires_at
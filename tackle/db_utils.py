@@ -0,0 +1,89 @@
+from itertools import islice
+from typing import List, Dict, Any, Sequence, Iterable, Iterator  # noqa # pylint: disable=unused-import
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+
+from tackle.flask_utils import db
+
+
+def chunked(items: Iterable, chunk_size: int) -> Iterator[List]:
+    """ Split an iterable (e.g. a generator of rows) into lists of up to chunk_size items without materialising it. """
+    iterator = iter(items)
+
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def _dialect_insert(table):
+    """ Get the dialect specific INSERT construct (which supports ON CONFLICT) for the current DB, else None. """
+    dialect_name = db.session.get_bind().dialect.name
+
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table)
+    elif dialect_name == 'sqlite' and hasattr(sqlite, 'insert'):  # SQLite ON CONFLICT support requires SQLAlchemy 1.4+
+        return sqlite.insert(table)
+    else:
+        return None
+
+
+def upsert_rows(model,
+                rows: List[Dict[str, Any]],
+                index_elements: Sequence[str],
+                increment_columns: Sequence[str] = (),
+                update_columns: Sequence[str] = ()) -> None:
+    """
+    Multi-row INSERT ... ON CONFLICT DO UPDATE of rows into the model's table. Executed within the current session, but
+    NOT committed; the caller owns the transaction. Falls back to an UPDATE (and INSERT if no row was updated) per row on
+    DBs without ON CONFLICT support.
+
+    :param model: The db.Model class of the table.
+    :param rows: The rows to insert as dicts of column name to value.
+    :param index_elements: The columns of the unique/primary key that may conflict.
+    :param increment_columns: On conflict these columns are incremented by the row's value.
+    :param update_columns: On conflict these columns are set to the row's value.
+                           Conflicting rows are left unchanged if neither increment_columns nor update_columns are given.
+    """
+    if not rows:
+        return
+
+    table = model.__table__
+    stmt = _dialect_insert(table)
+
+    if stmt is not None:
+        stmt = stmt.values(rows)
+
+        set_ = {}  # type: Dict[str, Any]
+        for column in increment_columns:
+            set_[column] = table.c[column] + getattr(stmt.excluded, column)
+        for column in update_columns:
+            set_[column] = getattr(stmt.excluded, column)
+
+        if set_:
+            stmt = stmt.on_conflict_do_update(index_elements=list(index_elements), set_=set_)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(index_elements))
+
+        db.session.execute(stmt)
+    else:
+        for row in rows:
+            key_filter = [table.c[column] == row[column] for column in index_elements]
+
+            values = {}  # type: Dict[str, Any]
+            for column in increment_columns:
+                values[column] = table.c[column] + row[column]
+            for column in update_columns:
+                values[column] = row[column]
+
+            if values:
+                row_count = db.session.execute(table.update().where(db.and_(*key_filter)).values(values)).rowcount
+            else:
+                row_count = db.session.query(table).filter(*key_filter).count()
+
+            if row_count == 0:
+                db.session.execute(table.insert().values(row))
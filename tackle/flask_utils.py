@@ -1,21 +1,33 @@
 #!/usr/bin/env python3
 
 import os
+import copy
 import logging
+import logging.handlers
+import queue
+import atexit
+import importlib
 import time
 
 import connexion
 # from connexion.resolver import RestyResolver
 
-from typing import List, Optional, Dict  # noqa # pylint: disable=unused-import
+from typing import List, Optional, Dict, Iterable  # noqa # pylint: disable=unused-import
 from flask_sqlalchemy import SQLAlchemy
 from flask_sqlalchemy import __version__ as __sqlalchemy_version__
 from flask_cors import CORS
-from flask import request
+from flask import request, g
 
-from tackle.prometheus_utils import promths_exec_id
 from tackle.prometheus_utils import PrometheusLoggingHandler
+from tackle.prometheus_utils import promths_exec_id
+from tackle.prometheus_utils import promths_logging_dropped_counter
 from tackle.prometheus_utils import promths_flask_idle_fraction_gauge
+from tackle.prometheus_utils import export_utilisation_tracker
+
+from tackle.concurrency_utils import UtilisationTracker
+
+from tackle.response_utils import configure_compression
+from tackle.response_utils import cllbck_compress_response
 
 LOGGERS_TO_IGNORE = [
     "connexion.operations.swagger2",
@@ -39,11 +51,69 @@ def get_log_filename() -> Optional[str]:
     return _logging_details.get("filename")
 
 
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks the logging thread: Records are dropped (and counted) when the bounded queue is full.
+    The message is rendered on the logging thread; the formatting and I/O are left to the handlers of the QueueListener's
+    thread.
+    """
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Like QueueHandler.prepare, render msg % args (and the exception) now so that the queued record doesn't refer to
+        args that the caller may still change. Unlike QueueHandler.prepare, the handlers' formatter isn't applied here.
+        """
+        message = record.getMessage()
+
+        record = copy.copy(record)
+        if record.args:
+            record.msg_template = record.msg  # Keeps the bounded identity of the record. See log_record_template(...).
+        record.msg = message
+        record.args = None
+
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            promths_logging_dropped_counter.labels(exec_id=promths_exec_id).inc()  # pylint: disable=no-member
+
+
+class LazyTruncatedStr(object):
+    """
+    Log record argument that defers str(value) and its truncation to when (and if) the record is emitted i.e. not done for
+    records filtered out by level: logging.info("... %s", LazyTruncatedStr(response_json, 300)).
+    """
+    __slots__ = ('value', 'max_len')
+
+    def __init__(self, value, max_len: int) -> None:
+        self.value = value
+        self.max_len = max_len
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        return text[:self.max_len - 3] + '...' if len(text) > self.max_len else text
+
+
 def reset_logging():
     """ Remove the handlers and filters from the logger to prevent, for example,
     handlers stacking up over multiple runs."""
     root = logging.getLogger()
 
+    queue_listener = _logging_details.pop("queue_listener", None)
+    if queue_listener is not None:
+        queue_listener.stop()  # Processes the records still queued.
+
+        for handler in queue_listener.handlers:
+            handler.close()
+
     for handler in list(root.handlers):  # list(...) makes a copy of the handlers list.
         root.removeHandler(handler)
         handler.close()
@@ -52,11 +122,22 @@ def reset_logging():
         root.removeFilter(filter)
 
 
+atexit.register(reset_logging)  # Flush the records still queued in the background logging mode.
+
+
 def setup_logging(requested_logging_path: Optional[str] = None,
-                  include_prometheus: bool = False):
-    """ Setup logging to file and stderr. """
-    global _logging_details
+                  include_prometheus: bool = False,
+                  use_queue: bool = False,
+                  queue_size: int = 10000):
+    """
+    Setup logging to file and stderr.
 
+    :param requested_logging_path: The path to log to file to. 'None' to not log to file.
+    :param include_prometheus: Send the number of WARNINGS+ to prometheus.
+    :param use_queue: Hand the log records to a bounded queue and do the formatting and I/O on a background thread.
+                      Records are dropped (and counted in tackle_logging_dropped) when the queue is full.
+    :param queue_size: The max number of queued log records when use_queue is True.
+    """
     reset_logging()
 
     # Set all loggers to 'ignore' to show only ERROR level logs or higher.
@@ -73,7 +154,8 @@ def setup_logging(requested_logging_path: Optional[str] = None,
     # DEBUG    10
     # NOTSET    0
 
-    logger.setLevel(logging.DEBUG)
+    # The root level is the lowest level of the handlers so that records no handler wants are never created.
+    logger.setLevel(logging.INFO if requested_logging_path is None else logging.DEBUG)
 
     _logging_details["filename"] = "tackle_" + str(time.strftime("%Y-%m-%d")) + "_" + \
                                    str(time.strftime("%Hh%Mm%Ss")) + ".log"
@@ -81,11 +163,13 @@ def setup_logging(requested_logging_path: Optional[str] = None,
     # Create formatter and add it to the handlers.
     formatter = logging.Formatter('%(asctime)s, %(name)s, %(levelname)s, %(message)s')
 
+    handlers = []  # type: List[logging.Handler]
+
     # Create console handler.
     ch = logging.StreamHandler()
     ch.setLevel(logging.INFO)
     ch.setFormatter(formatter)
-    logger.addHandler(ch)
+    handlers.append(ch)
 
     if requested_logging_path is not None:
         # Create the logging path if it doesn't already exist.
@@ -95,14 +179,25 @@ def setup_logging(requested_logging_path: Optional[str] = None,
         fh = logging.FileHandler(logging_path + "/" + _logging_details["filename"])
         fh.setLevel(logging.DEBUG)
         fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        handlers.append(fh)
 
     if include_prometheus:
         # Create Prometheus handler - sends number of WARNINGS+ to prometheus!
         ph = PrometheusLoggingHandler()
         ph.setLevel(logging.WARNING)
         ph.setFormatter(formatter)
-        logger.addHandler(ph)
+        handlers.append(ph)
+
+    if use_queue:
+        queue_listener = logging.handlers.QueueListener(queue.Queue(maxsize=queue_size), *handlers,
+                                                        respect_handler_level=True)
+        queue_listener.start()
+        _logging_details["queue_listener"] = queue_listener
+
+        logger.addHandler(DroppingQueueHandler(queue_listener.queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
 
     logging.info(f"flask_utils.setup_logging: Logging started!")
 
@@ -116,41 +211,128 @@ def _setup_db(connexion_app: connexion.FlaskApp):
 
 def _setup_api(connexion_app: connexion.FlaskApp, debug: bool, swagger_ui: bool):
     """Setup the rest API within the Flask app."""
-    connexion_app.add_api(specification='swagger.yaml',
-                          arguments={'title': 'This is the HTTP API for tackle.'},
-                          options={"debug": debug, "swagger_ui": swagger_ui})
+    api = connexion_app.add_api(specification='swagger.yaml',
+                                arguments={'title': 'This is the HTTP API for tackle.'},
+                                options={"debug": debug, "swagger_ui": swagger_ui})
 
+    # Imported here as the controllers depend on this module.
+    controller_util = importlib.import_module('tackle.rest_api.flask_server.controllers.controller_util')
+    controller_util.register_response_cache_extensions(api.specification.raw)
 
-last_operation_start_time = 0.0
-last_operation_end_time = 0.0
 
+# Utilisation (in-flight requests, concurrency, saturation & idle fraction) of the flask app. Configure the sliding window
+# and capacity (e.g. the number of worker threads) with flask_utilisation_tracker.configure(...).
+flask_utilisation_tracker = UtilisationTracker()
+export_utilisation_tracker(flask_utilisation_tracker, 'flask', promths_flask_idle_fraction_gauge)
 
-def cllbck_before_flask_request():
-    global last_operation_start_time
-    global last_operation_end_time
 
-    current_time = time.time()
+# Body preview logging: The max number of body bytes logged per request (0 to disable) and the URL rules (e.g.
+# '/dashboard') of the endpoints whose bodies are never previewed. See configure_body_preview(...).
+_body_preview_details = {"max_len": 50, "disabled_rules": set()}  # type: Dict
+
 
-    body_text = str(request.get_data())
+def configure_body_preview(max_len: int = 50,
+                           disabled_rules: Iterable[str] = ()) -> None:
+    """
+    Configure the request body preview logged at the start of each request.
 
-    logging.info("flask_utils.cllbck_before_flask_request: ")  # Indicate start of new request.
-    logging.info(f"flask_utils.cllbck_before_flask_request: "
-                 f"body = {body_text[:47] + '...' if len(body_text) > 50 else body_text} "
-                 f"auth header = {str(request.headers.get('X-Auth-Token'))}")
+    :param max_len: The max number of body bytes to read and log. 0 to disable the body preview.
+    :param disabled_rules: The URL rules (e.g. '/dashboard') of the endpoints whose request bodies aren't previewed.
+    """
+    _body_preview_details["max_len"] = max_len
+    _body_preview_details["disabled_rules"] = set(disabled_rules)
 
-    if last_operation_end_time != 0.0:
-        idle_time = round(current_time - last_operation_end_time, 4)
-        total_time = round(current_time - last_operation_start_time, 4)
-        promths_flask_idle_fraction_gauge.labels(exec_id=promths_exec_id).set(idle_time / total_time)
 
-    last_operation_start_time = current_time
+class _PeekedInput(object):
+    """ WSGI input stream that replays a peeked prefix of the body before reading on from the original input stream. """
 
+    def __init__(self, prefix: bytes, stream) -> None:
+        self._prefix = prefix
+        self._stream = stream
 
-def cllbck_after_flask_request(response):
-    global last_operation_end_time
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if not self._prefix:
+            return self._stream.read() if (size is None or size < 0) else self._stream.read(size)
 
-    last_operation_end_time = time.time()
-    return response
+        if size is None or size < 0:
+            data = self._prefix + self._stream.read()
+            self._prefix = b''
+        else:
+            data = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+
+            if len(data) < size:
+                data += self._stream.read(size - len(data))
+
+        return data
+
+    def readline(self, size: Optional[int] = -1) -> bytes:
+        if not self._prefix:
+            return self._stream.readline() if (size is None or size < 0) else self._stream.readline(size)
+
+        limit = -1 if size is None else size
+        unlimited = limit < 0
+        line_end = self._prefix.find(b'\n') + 1  # 0 if the prefix doesn't contain a newline.
+
+        if (line_end > 0) and (unlimited or line_end <= limit):
+            line, self._prefix = self._prefix[:line_end], self._prefix[line_end:]
+            return line
+
+        if (not unlimited) and (limit <= len(self._prefix)):
+            line, self._prefix = self._prefix[:limit], self._prefix[limit:]
+            return line
+
+        # The line continues past the prefix.
+        line, self._prefix = self._prefix, b''
+        return line + (self._stream.readline() if unlimited else self._stream.readline(limit - len(line)))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def _peek_request_body(max_len: int) -> Optional[bytes]:
+    """
+    Read up to max_len bytes of the request body without consuming them for the controller. Returns None (and leaves the
+    body untouched) for streamed bodies (no content length) and for bodies that have already been read.
+    """
+    content_length = request.content_length
+
+    if (not content_length) or ('stream' in request.__dict__) or (request.url_rule is None) or \
+            (request.url_rule.rule in _body_preview_details["disabled_rules"]):
+        return None
+
+    wsgi_input = request.environ['wsgi.input']
+    prefix = wsgi_input.read(min(max_len, content_length))
+    request.environ['wsgi.input'] = _PeekedInput(prefix, wsgi_input)
+
+    return prefix
+
+
+def cllbck_before_flask_request():
+    g.tackle_utilisation_span = flask_utilisation_tracker.start()
+
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        max_len = _body_preview_details["max_len"]
+        body_prefix = _peek_request_body(max_len) if max_len > 0 else None
+
+        if body_prefix is None:
+            body_preview = "[not previewed]"
+        elif (request.content_length or 0) > len(body_prefix):
+            body_preview = str(body_prefix) + "..."
+        else:
+            body_preview = str(body_prefix)
+
+        logging.info("flask_utils.cllbck_before_flask_request: ")  # Indicate start of new request.
+        logging.info("flask_utils.cllbck_before_flask_request: body = %s auth header = %s",
+                     body_preview, request.headers.get('X-Auth-Token'))
+
+
+def cllbck_teardown_flask_request(exception):
+    """ Called after every request, also when an exception was raised. """
+    span = g.pop('tackle_utilisation_span', None)
+
+    if span is not None:
+        flask_utilisation_tracker.end(span)
 
 
 def create_flask_app(specification_dir: str,
@@ -158,10 +340,26 @@ def create_flask_app(specification_dir: str,
                      swagger_ui: bool,
                      database_url: str,
                      database_create_tables: bool,
-                     debug: bool):
+                     debug: bool,
+                     preload_auth_tokens: bool = False,
+                     auth_token_refresh_interval: Optional[float] = None,
+                     json_provider_class: Optional[type] = None,
+                     compression_min_size: Optional[int] = None,
+                     compression_level: int = 6):
     """
     Create the  Flask/Connexion app and the Flask-SQLAlchemy DB interface.
     The swagger spec is used to build an API if add_api == True!
+
+    :param preload_auth_tokens: Load the records of all auth tokens at startup to avoid a DB round trip on the first
+                                request of each token. Used when validating from the cache; see
+                                wrapper_util.configure_auth_token_cache(...) and wrapper_util.preload_auth_token_cache().
+    :param auth_token_refresh_interval: The interval (in seconds) of the delta refresh of the preloaded auth token
+                                        records. 'None' to not refresh.
+    :param json_provider_class: The Flask JSON provider of the request and response bodies e.g.
+                                response_utils.FastJSONProvider. 'None' for Flask's default. Requires Flask 2.2+.
+    :param compression_min_size: The min size (in bytes) of a response body to gzip/brotli compress if the client accepts
+                                 it. 'None' to not compress.
+    :param compression_level: The compression level: 1 (fastest) to 9 (smallest).
     """
     print("Creating flask app...", flush=True)
     app = connexion.App(import_name=__name__,
@@ -175,6 +373,13 @@ def create_flask_app(specification_dir: str,
         app.app.config['TESTING'] = True
         # app.app.config["SQLALCHEMY_ECHO"] = True
 
+    if json_provider_class is not None:
+        if not hasattr(app.app, 'json_provider_class'):
+            raise ValueError("flask_utils.create_flask_app: json_provider_class requires Flask 2.2+.")
+
+        app.app.json_provider_class = json_provider_class
+        app.app.json = json_provider_class(app.app)
+
     print("  _setup_db...", flush=True)
     _setup_db(app)
 
@@ -186,7 +391,10 @@ def create_flask_app(specification_dir: str,
     print()
 
     app.app.before_request(cllbck_before_flask_request)
-    app.app.after_request(cllbck_after_flask_request)
+    app.app.teardown_request(cllbck_teardown_flask_request)
+
+    configure_compression(compression_min_size, compression_level)
+    app.app.after_request(cllbck_compress_response)
 
     # add CORS support
     CORS(app.app)
@@ -194,4 +402,13 @@ def create_flask_app(specification_dir: str,
     if database_create_tables:
         db.create_all()
 
+    if preload_auth_tokens:
+        # Imported here as wrapper_util depends on this module.
+        wrapper_util = importlib.import_module('tackle.rest_api.wrapper_util')
+
+        wrapper_util.preload_auth_token_cache()
+
+        if auth_token_refresh_interval is not None:
+            wrapper_util.enable_auth_token_cache_refresh(interval=auth_token_refresh_interval)
+
     return app
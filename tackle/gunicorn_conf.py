@@ -0,0 +1,35 @@
+"""
+Gunicorn config for hosting tackle with pre-forked workers and multi-process prometheus metrics e.g.:
+
+    TACKLE_PROMETHEUS_PORT=9100 gunicorn -c python:tackle.gunicorn_conf --bind 0.0.0.0:80 -w 8 -t 120 wsgi
+
+The workers write their metrics to shared (mmap'd) files in PROMETHEUS_MULTIPROC_DIR and the master exports the
+aggregate of all the workers on TACKLE_PROMETHEUS_PORT.
+"""
+
+import os
+import shutil
+import tempfile
+import uuid
+
+# NOTE: The multi-process env must be set before prometheus_client is imported anywhere!
+multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                      os.path.join(tempfile.gettempdir(), 'tackle_prometheus_multiproc'))
+os.environ.setdefault('prometheus_multiproc_dir', multiproc_dir)  # Name used by older prometheus_client versions.
+os.environ.setdefault('TACKLE_PROMETHEUS_EXEC_ID', str(uuid.uuid4()))
+
+from tackle import prometheus_utils  # noqa
+
+
+def on_starting(server):
+    """ Remove the metric files of previous runs. """
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    prometheus_utils.start_multiprocess_exporter(int(os.environ.get('TACKLE_PROMETHEUS_PORT', 9100)))
+
+
+def child_exit(server, worker):
+    prometheus_utils.mark_worker_dead(worker.pid)
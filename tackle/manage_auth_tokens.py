@@ -4,6 +4,9 @@ API Tackle - Example of how to manage auth token.
 
 import os
 import sys
+import csv
+import argparse
+from typing import Iterable, Iterator, Tuple, Optional  # noqa # pylint: disable=unused-import
 
 # NOTE: The below import is useful to bring tackle into the Python path!
 module_path = os.path.abspath(os.path.join('.'))
@@ -19,13 +22,60 @@ from tackle.rest_api import get_path  # noqa
 # from tackle.rest_api.wrapper_util import add_auth_token  # noqa
 # from tackle.rest_api.wrapper_util import remove_admin_auth_token  # noqa
 # from tackle.rest_api.wrapper_util import get_auth_token_details  # noqa
-from tackle.rest_api.wrapper_util import load_auth_token_list  # noqa
-from tackle.rest_api.wrapper_util import load_admin_auth_token_list  # noqa
+from tackle.rest_api.wrapper_util import iter_auth_token_list  # noqa
+from tackle.rest_api.wrapper_util import iter_admin_auth_token_list  # noqa
+from tackle.rest_api.wrapper_util import add_auth_tokens_bulk  # noqa
+from tackle.rest_api.wrapper_util import remove_auth_tokens_bulk  # noqa
 
 # from tackle.rest_api.wrapper_util import start_wrapper_engine  # noqa
 
 
+def _read_token_rows(token_file: Iterable[str]) -> Iterator[Tuple[str, Optional[str]]]:
+    for row in csv.reader(token_file):
+        if row and row[0].strip():
+            yield row[0].strip(), (row[1].strip() if len(row) > 1 else None)
+
+
+def _read_token_file(filename: str) -> Iterator[Tuple[str, Optional[str]]]:
+    """ Stream the (auth_token, desc) rows of a CSV file (desc is optional). '-' to read from stdin (left open). """
+    if filename == '-':
+        yield from _read_token_rows(sys.stdin)
+    else:
+        with open(filename, newline='') as token_file:
+            yield from _read_token_rows(token_file)
+
+
+def _print_progress(num_processed: int):
+    print(f"  {num_processed} auth tokens processed...", flush=True)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Manage the auth tokens of the TACKLE_DATABASE_URL DB.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    list_parser = subparsers.add_parser('list', help="List the (hex digests of the) admin and auth tokens. The default command.")
+    list_parser.add_argument('--batch-size', type=int, default=1000, help="The number of rows read from the DB at a time.")
+
+    add_parser = subparsers.add_parser('add_bulk',
+                                       help="Add or update the auth tokens of a CSV file of 'auth_token[,desc]' rows.")
+    add_parser.add_argument('filename', help="The CSV file. '-' for stdin.")
+    add_parser.add_argument('--call-count-limit', type=int, default=None)
+    add_parser.add_argument('--rate-limit-per-sec', type=float, default=None)
+    add_parser.add_argument('--units-limit-per-min', type=int, default=None)
+    add_parser.add_argument('--keep-existing', action='store_true',
+                            help="Leave the desc and limits of tokens that already exist unchanged.")
+    add_parser.add_argument('--chunk-size', type=int, default=1000)
+
+    remove_parser = subparsers.add_parser('remove_bulk', help="Remove the auth tokens of a CSV file (first column).")
+    remove_parser.add_argument('filename', help="The CSV file. '-' for stdin.")
+    remove_parser.add_argument('--chunk-size', type=int, default=1000)
+
+    return parser.parse_args()
+
+
 def main():
+    args = _parse_args()
+
     setup_logging(requested_logging_path="~/.tackle/logs")
 
     # Get the production or local URL from the OS env variable.
@@ -47,13 +97,37 @@ def main():
                      database_create_tables=False,
                      debug=True)
 
-    print("Admin auth token list...")
-    print(load_admin_auth_token_list())
-    print()
-
-    print("Auth token list...")
-    print(load_auth_token_list())
-    print()
+    if args.command == 'add_bulk':
+        print("Adding auth tokens...")
+        num_added = add_auth_tokens_bulk(_read_token_file(args.filename),
+                                         call_count_limit=args.call_count_limit,
+                                         rate_limit_per_sec=args.rate_limit_per_sec,
+                                         units_limit_per_min=args.units_limit_per_min,
+                                         update_existing=not args.keep_existing,
+                                         chunk_size=args.chunk_size,
+                                         progress_callback=_print_progress)
+        print(f"Added or updated {num_added} auth tokens.")
+        print()
+    elif args.command == 'remove_bulk':
+        print("Removing auth tokens...")
+        num_removed = remove_auth_tokens_bulk((auth_token for auth_token, _ in _read_token_file(args.filename)),
+                                              chunk_size=args.chunk_size,
+                                              progress_callback=_print_progress)
+        print(f"Removed {num_removed} auth tokens.")
+        print()
+    else:
+        batch_size = getattr(args, 'batch_size', 1000)
+
+        # The tokens are streamed from the DB, so the memory use doesn't grow with the number of tokens.
+        print("Admin auth token list (key_digest, desc)...")
+        for admin_row in iter_admin_auth_token_list(batch_size):
+            print(*admin_row, sep=', ')
+        print()
+
+        print("Auth token list (key_digest, token_id, desc, call_count, call_count_limit)...")
+        for row in iter_auth_token_list(batch_size):
+            print(*row, sep=', ')
+        print()
 
     # print("Removing & Adding auth tokens...")
     #
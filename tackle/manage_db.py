@@ -17,6 +17,9 @@ from tackle.rest_api import get_path  # noqa
 from tackle.db_models import APIKeyData  # noqa
 from tackle.db_models import AdminAPIKeyData  # noqa
 from tackle.db_models import APICallCountBreakdownData  # noqa
+from tackle.db_models import APICallCountShardData  # noqa
+from tackle.db_models import RateLimitWorkerData  # noqa
+from tackle.db_models import APIJobData  # noqa
 
 # Get the production or local DB URL from the OS env variable.
 database_url = os.environ.get("TACKLE_DATABASE_URL",
@@ -40,5 +43,6 @@ migrate = Migrate(flask_app.app, db)
 manager = Manager(flask_app.app)
 manager.add_command("db", MigrateCommand)
 
+
 if __name__ == "__main__":
     manager.run()
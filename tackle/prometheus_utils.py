@@ -1,18 +1,62 @@
 from prometheus_client import Gauge
+from prometheus_client import Counter
+from prometheus_client import Histogram
+from prometheus_client import CollectorRegistry
 from prometheus_client import start_http_server
+from prometheus_client import multiprocess
 
+import os
 import logging
 import uuid
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Sequence, Set, Tuple, Any, List, Callable, Optional  # noqa # pylint: disable=unused-import
 
 # RED:
 # Rate - the number of requests, per second, you services are serving.
 # Errors - the number of failed requests per second.
 # Duration distribution - distributions of the amount of time each request takes.
 
-promths_exec_id = uuid.uuid4()  # Unique ID for this Python kernel.
+# Unique ID for this Python kernel. In multi-process mode the pre-forked workers share the ID set by their master (see
+# tackle.gunicorn_conf) so that their metrics aggregate instead of creating series per worker.
+promths_exec_id = os.environ.get('TACKLE_PROMETHEUS_EXEC_ID') or uuid.uuid4()
+
+
+def get_multiprocess_dir() -> Optional[str]:
+    """ The directory of the shared (mmap'd) metric files if prometheus_client runs in multi-process mode, else None. """
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def is_multiprocess_mode() -> bool:
+    return get_multiprocess_dir() is not None
+
+
+def start_multiprocess_exporter(prometheus_port: int):
+    """
+    Start the single metrics endpoint of a pre-forked server (e.g. from the gunicorn master) that aggregates the shared
+    metric files of all the workers at scrape time.
+    """
+    logging.info(f"prometheus_utils.start_multiprocess_exporter: Exporting metrics of {get_multiprocess_dir()} "
+                 f"on port {prometheus_port}.")
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(prometheus_port, registry=registry)
+
+
+def mark_worker_dead(pid: int):
+    """ Clean up the metric files of a dead worker's live gauges e.g. from the gunicorn child_exit hook. """
+    if is_multiprocess_mode():
+        multiprocess.mark_process_dead(pid)
 
 
 def create_prometheus_server(prometheus_port: int):
+    if is_multiprocess_mode():
+        # One exporter per worker would clash on the port; the master exports the aggregate of all the workers.
+        logging.info(f"prometheus_utils.create_prometheus_server: Multi-process mode; "
+                     f"metrics exported by start_multiprocess_exporter.")
+        return
+
     print("Creating promethius server...", flush=True)
     logging.info(f"prometheus_utils.create_prometheus_server: Creating promethius server... ")
     start_http_server(prometheus_port)
@@ -21,70 +65,428 @@ def create_prometheus_server(prometheus_port: int):
     print()
 
 
-class PrometheusLoggingHandler(logging.Handler):
-    """ Custom logging handler to send error events to Prometheus. Meant to be used at log level of error."""
+# =============================
+# Label normalisation: Bounds the number of distinct label values (and thus series) that free-form values like log
+# messages, exception text, auth token descriptions and caller names may create in the registry.
+OVERFLOW_LABEL_VALUE = '[other]'
+
+# The number of series dropped by the label limiters, by reason 'evicted' (removed from the registry to make room for a
+# new value) or 'overflow' (a new value recorded under OVERFLOW_LABEL_VALUE).
+promths_dropped_series_counter = Counter('tackle_metric_series_dropped',
+                                         'tackle - Number of metric series dropped by the label limiters.',
+                                         ['exec_id', 'limiter', 'reason'])
+
+
+class LabelLimiter(object):
+    """
+    Thread-safe LRU cap on the distinct values of a metric label. When the cap is reached the least recently used value
+    is evicted (and its series removed from the metrics) if it has been idle for at least min_idle seconds, otherwise the
+    new value is recorded under OVERFLOW_LABEL_VALUE.
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_values: int = 100,
+                 min_idle: float = 600.0,
+                 max_rejected: int = 10000) -> None:
+        """
+        :param name: The name of the limiter as reported in tackle_metric_series_dropped.
+        :param max_values: The max number of distinct label values.
+        :param min_idle: The min time (in seconds) that a value must have been unused before it may be evicted.
+        :param max_rejected: The max number of rejected values remembered so that each is counted as dropped once.
+        """
+        self.name = name
+        self.max_values = max_values
+        self.min_idle = min_idle
+        self.max_rejected = max_rejected
+
+        self._lock = threading.Lock()
+        self._last_used = OrderedDict()  # type: OrderedDict  # value -> last use time
+        self._series = {}  # type: Dict[str, Set[Tuple[Any, Tuple[str, ...]]]]  # value -> {(metric, label values)}
+        self._rejected = OrderedDict()  # type: OrderedDict  # value -> None; the LRU of the values recorded as overflow
+
+    def limit(self, value: Any) -> str:
+        """ Get the label value to use for value: The value itself or OVERFLOW_LABEL_VALUE. """
+        value = str(value)
+        current_time = time.time()
+        evicted_series = set()  # type: Set[Tuple[Any, Tuple[str, ...]]]
+
+        with self._lock:
+            if value not in self._last_used and len(self._last_used) >= self.max_values:
+                lru_value, lru_time = next(iter(self._last_used.items()))
+
+                if (current_time - lru_time) < self.min_idle:
+                    if value in self._rejected:
+                        self._rejected.move_to_end(value)
+                    else:
+                        # Count the value when it's first rejected, not on every observation.
+                        promths_dropped_series_counter.labels(exec_id=promths_exec_id, limiter=self.name,
+                                                              reason='overflow').inc()  # pylint: disable=no-member
+                        self._rejected[value] = None
+
+                        if len(self._rejected) > self.max_rejected:
+                            self._rejected.popitem(last=False)
+
+                    return OVERFLOW_LABEL_VALUE
+
+                del self._last_used[lru_value]
+                evicted_series = self._series.pop(lru_value, set())
+
+            self._rejected.pop(value, None)
+            self._last_used[value] = current_time
+            self._last_used.move_to_end(value)
+
+        for metric, label_values in evicted_series:
+            try:
+                metric.remove(*label_values)
+                promths_dropped_series_counter.labels(exec_id=promths_exec_id, limiter=self.name,
+                                                      reason='evicted').inc()  # pylint: disable=no-member
+            except KeyError:
+                pass  # Already removed via another of its limited labels.
+
+        return value
+
+    def track(self, value: str, metric, label_values: Tuple[str, ...]) -> None:
+        """ Record that a series of the metric uses the (limited) value so that the series is removed on eviction. """
+        if value != OVERFLOW_LABEL_VALUE:
+            with self._lock:
+                if value in self._last_used:
+                    self._series.setdefault(value, set()).add((metric, label_values))
 
-    def __init__(self):
-        logging.Handler.__init__(self)
 
-        # Counter of number of emitted events.
-        self.promths_emit_count_gauge = Gauge('tackle_logging_emit_count',
-                                              'tackle - Number of logging errors emitted.',
-                                              ['exec_id', 'desc', 'msg'])
+def bounded_labels(metric, limiters: Dict[str, LabelLimiter], **labels):
+    """
+    Get the child of a labelled metric with the values of the limited labels bounded by their label limiters e.g.
+    bounded_labels(promths_http_response_counter, {'auth_desc': auth_desc_limiter}, exec_id=..., auth_desc=..., ...).
+    """
+    for label_name, limiter in limiters.items():
+        labels[label_name] = limiter.limit(labels[label_name])
+
+    label_values = tuple(str(labels[label_name]) for label_name in metric._labelnames)  # pylint: disable=protected-access
+
+    for label_name, limiter in limiters.items():
+        limiter.track(labels[label_name], metric, label_values)
+
+    return metric.labels(*label_values)
+
+
+def log_record_template(record: logging.LogRecord) -> str:
+    """
+    The bounded identity of a log record: Its message template if it was logged with args, else (e.g. for f-string
+    messages) its call site.
+    """
+    msg_template = getattr(record, 'msg_template', None)  # Set if the message was rendered by DroppingQueueHandler.
+
+    if msg_template is not None:
+        return str(msg_template)[:100]
+    elif record.args:
+        return str(record.msg)[:100]
+    else:
+        return f"{record.module}.{record.funcName}:{record.lineno}"
+
+
+def exception_label(e: BaseException) -> str:
+    """ The bounded label of an exception: Its class name instead of its (unbounded) text. """
+    return f"[Uncaught exception: {type(e).__name__}]"
+
+
+promths_log_msg_limiter = LabelLimiter('log_msg')
+promths_auth_desc_limiter = LabelLimiter('auth_desc', max_values=1000)
+promths_caller_name_limiter = LabelLimiter('caller_name')
+
+# Counter of number of emitted logging events.
+promths_emit_count_counter = Counter('tackle_logging_emit_count',
+                                     'tackle - Number of logging errors emitted.',
+                                     ['exec_id', 'desc', 'msg'])
+
+
+# Counter of the number of logging events dropped because the logging queue was full. See flask_utils.setup_logging.
+promths_logging_dropped_counter = Counter('tackle_logging_dropped',
+                                          'tackle - Number of logging events dropped.',
+                                          ['exec_id'])
+
+
+class PrometheusLoggingHandler(logging.Handler):
+    """
+    Custom logging handler to send error events to Prometheus. Meant to be used at log level of error. The events are
+    counted per message template (see log_record_template) to bound the number of series.
+    """
 
     def emit(self, record):
-        try:
-            if record.levelno >= logging.CRITICAL:
-                self.promths_emit_count_gauge.labels(exec_id=promths_exec_id,
-                                                     desc='critical',  # pylint: disable=no-member
-                                                     msg=str(record.getMessage())).inc()  # pylint: disable=no-member
-            elif record.levelno >= logging.ERROR:
-                self.promths_emit_count_gauge.labels(exec_id=promths_exec_id,
-                                                     desc='error',  # pylint: disable=no-member
-                                                     msg=str(record.getMessage())).inc()  # pylint: disable=no-member
-            elif record.levelno >= logging.WARNING:
-                self.promths_emit_count_gauge.labels(exec_id=promths_exec_id,
-                                                     desc='warning',  # pylint: disable=no-member
-                                                     msg=str(record.getMessage())).inc()  # pylint: disable=no-member
-            elif record.levelno >= logging.INFO:
-                self.promths_emit_count_gauge.labels(exec_id=promths_exec_id,
-                                                     desc='info',  # pylint: disable=no-member
-                                                     msg=str(record.getMessage())).inc()  # pylint: disable=no-member
-            elif record.levelno >= logging.DEBUG:
-                self.promths_emit_count_gauge.labels(exec_id=promths_exec_id,
-                                                     desc='debug',  # pylint: disable=no-member
-                                                     msg=str(record.getMessage())).inc()  # pylint: disable=no-member
-        except Exception:
-            raise
+        if record.levelno >= logging.CRITICAL:
+            desc = 'critical'
+        elif record.levelno >= logging.ERROR:
+            desc = 'error'
+        elif record.levelno >= logging.WARNING:
+            desc = 'warning'
+        elif record.levelno >= logging.INFO:
+            desc = 'info'
+        elif record.levelno >= logging.DEBUG:
+            desc = 'debug'
+        else:
+            return
+
+        bounded_labels(promths_emit_count_counter, {'msg': promths_log_msg_limiter},
+                       exec_id=promths_exec_id, desc=desc, msg=log_record_template(record)).inc()
 
 
 # How much of the flask app's time is spent idle.
 promths_flask_idle_fraction_gauge = Gauge('tackle_flask_idle_fraction',
                                           'tackle - Flask Idle Fraction',
-                                          ['exec_id'])
+                                          ['exec_id'],
+                                          multiprocess_mode='liveall')
 
 # How much of the service wrapper's (and deeper) time is spent idle.
 promths_wrapper_idle_fraction_gauge = Gauge('tackle_wrapper_idle_fraction',
                                             'tackle - Wrapper Idle Fraction',
-                                            ['exec_id'])
+                                            ['exec_id'],
+                                            multiprocess_mode='liveall')
+
+# The number of in-flight requests, the average concurrency and the saturation (concurrency / capacity) over a sliding
+# window per layer ('flask' or 'wrapper') of the instance.
+promths_in_flight_gauge = Gauge('tackle_in_flight_requests',
+                                'tackle - In-flight Requests',
+                                ['exec_id', 'layer'],
+                                multiprocess_mode='liveall')
+
+promths_concurrency_gauge = Gauge('tackle_concurrency',
+                                  'tackle - Average Concurrency',
+                                  ['exec_id', 'layer'],
+                                  multiprocess_mode='liveall')
+
+promths_saturation_gauge = Gauge('tackle_saturation',
+                                 'tackle - Saturation',
+                                 ['exec_id', 'layer'],
+                                 multiprocess_mode='liveall')
+
+
+# =============================
+# Gauges whose values are computed by a function. In multi-process mode the scrape reads the shared metric files, so
+# these are refreshed periodically by a thread in each worker instead of at scrape time.
+GAUGE_REFRESH_INTERVAL = 5.0
 
-# The instance's request latencies.
-promths_request_latency_gauge = Gauge('tackle_request_latency_seconds',
-                                      'tackle - Request Latency',
-                                      ['exec_id', 'auth_desc', 'caller_name', 'endpoint'])
+_function_gauges = []  # type: List[Tuple[Any, Callable[[], float]]]
+_function_gauges_refresher_pid = None  # type: Optional[int]
+_function_gauges_lock = threading.Lock()
+
+
+def _refresh_function_gauges() -> None:
+    while True:
+        with _function_gauges_lock:
+            function_gauges = list(_function_gauges)
+
+        for gauge_child, fn in function_gauges:
+            try:
+                gauge_child.set(fn())
+            except Exception as e:
+                logging.exception(f"prometheus_utils._refresh_function_gauges: {e}")
+
+        time.sleep(GAUGE_REFRESH_INTERVAL)
+
+
+def _ensure_function_gauges_refresher() -> None:
+    """ Start the refresher thread in this process if needed. Threads don't survive a fork; also called after fork. """
+    global _function_gauges_refresher_pid
+
+    with _function_gauges_lock:
+        if (not _function_gauges) or (_function_gauges_refresher_pid == os.getpid()):
+            return
+
+        _function_gauges_refresher_pid = os.getpid()
+
+    threading.Thread(target=_refresh_function_gauges, name="tackle_gauge_refresher", daemon=True).start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_ensure_function_gauges_refresher)
+
+
+def set_gauge_function(gauge_child, fn: Callable[[], float]) -> None:
+    """ Like Gauge.set_function(fn), but also supported in multi-process mode. """
+    if is_multiprocess_mode():
+        with _function_gauges_lock:
+            _function_gauges.append((gauge_child, fn))
+        _ensure_function_gauges_refresher()
+    else:
+        gauge_child.set_function(fn)
+
+
+class _ScrapeSnapshot(object):
+    """
+    Shares one UtilisationTracker snapshot between the gauges collected in the same scrape. A snapshot is reused for
+    max_age seconds; much longer than the collection of a scrape and much shorter than the scrape interval.
+    """
+
+    def __init__(self, tracker, max_age: float = 0.5) -> None:
+        self._tracker = tracker
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._snapshot = (0, 0.0, 0.0, 1.0)  # type: Tuple[int, float, float, float]
+        self._snapshot_time = 0.0
+
+    def get(self, index: int) -> float:
+        with self._lock:
+            current_time = time.time()
+
+            if (current_time - self._snapshot_time) > self._max_age:
+                self._snapshot = self._tracker.snapshot()
+                self._snapshot_time = current_time
+
+            return self._snapshot[index]
+
+
+def export_utilisation_tracker(tracker, layer: str, idle_fraction_gauge: Gauge) -> None:
+    """
+    Report the in-flight count, concurrency, saturation and idle fraction of a UtilisationTracker at scrape time. The
+    gauges of a scrape share one snapshot of the tracker.
+    """
+    snapshot = _ScrapeSnapshot(tracker)
+
+    set_gauge_function(promths_in_flight_gauge.labels(exec_id=promths_exec_id, layer=layer), lambda: tracker.in_flight)
+    set_gauge_function(promths_concurrency_gauge.labels(exec_id=promths_exec_id, layer=layer), lambda: snapshot.get(1))
+    set_gauge_function(promths_saturation_gauge.labels(exec_id=promths_exec_id, layer=layer), lambda: snapshot.get(2))
+    set_gauge_function(idle_fraction_gauge.labels(exec_id=promths_exec_id), lambda: snapshot.get(3))
+
+
+# The time that wrapper calls wait in the queue of their concurrency policy (lock contention).
+promths_lock_wait_histogrm = Histogram('tackle_lock_wait_seconds',
+                                       'tackle - Wrapper Lock Queue Wait Time',
+                                       ['exec_id', 'policy', 'endpoint'],
+                                       buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0,
+                                                float("inf")))
+
+# The calls waiting for a worker process, the average fraction of the workers busy over a sliding window and the time
+# that calls wait for a worker, per worker pool. See wrapper_util.create_worker_pool(...).
+promths_worker_pool_queue_depth_gauge = Gauge('tackle_worker_pool_queue_depth',
+                                              'tackle - Worker Pool Queue Depth',
+                                              ['exec_id', 'pool'],
+                                              multiprocess_mode='liveall')
+
+promths_worker_pool_utilisation_gauge = Gauge('tackle_worker_pool_utilisation',
+                                              'tackle - Worker Pool Utilisation',
+                                              ['exec_id', 'pool'],
+                                              multiprocess_mode='liveall')
+
+promths_worker_pool_wait_histogrm = Histogram('tackle_worker_pool_wait_seconds',
+                                              'tackle - Worker Pool Queue Wait Time',
+                                              ['exec_id', 'pool'],
+                                              buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0,
+                                                       float("inf")))
 
 # The instance's number of unauthorised denied calls.
-promths_call_count_gauge_unauthrsd = Gauge('tackle_unauthrsd_call_count',
-                                           'tackle - Number of unauthorised & denied calls.',
-                                           ['exec_id', 'auth_desc', 'caller_name'])
+promths_call_count_counter_unauthrsd = Counter('tackle_unauthrsd_call_count',
+                                               'tackle - Number of unauthorised & denied calls.',
+                                               ['exec_id', 'auth_desc'])
 
 # The call count across all servers (cached locally, but updated regularly from the DB).
 # May be used for billing!
 promths_call_count_gauge_authrsd = Gauge('tackle_api_call_count',
                                          'tackle - API Call Count',
-                                         ['exec_id', 'auth_desc', 'caller_name'])
+                                         ['exec_id', 'auth_desc', 'caller_name'],
+                                         multiprocess_mode='max')
+
+# The lookups of the auth token cache (when validating from the cache) by result: 'hit' (cached token record), 'warm_hit'
+# (preloaded record; see wrapper_util.preload_auth_token_cache) or 'miss' (DB round trip).
+promths_auth_token_cache_counter = Counter('tackle_auth_token_cache_lookups',
+                                           'tackle - Auth Token Cache Lookups',
+                                           ['exec_id', 'result'])
+
+# The fraction of the instance's auth token cache lookups served without a DB round trip.
+promths_auth_token_cache_hit_ratio_gauge = Gauge('tackle_auth_token_cache_hit_ratio',
+                                                 'tackle - Auth Token Cache Hit Ratio',
+                                                 ['exec_id'],
+                                                 multiprocess_mode='liveall')
+
+# The time since the preloaded auth token records were last synced with the DB.
+promths_auth_token_cache_staleness_gauge = Gauge('tackle_auth_token_cache_staleness_seconds',
+                                                 'tackle - Auth Token Cache Staleness',
+                                                 ['exec_id'],
+                                                 multiprocess_mode='liveall')
+
+# The requests rejected without a DB round trip by reason: 'negative_cache' (a token recently found invalid) or 'filter'
+# (not in the filter of the valid tokens). See wrapper_util.configure_negative_auth_token_cache(...).
+promths_early_rejection_counter = Counter('tackle_auth_token_early_rejections',
+                                          'tackle - Auth Tokens Rejected Without DB Lookup',
+                                          ['exec_id', 'reason'])
+
+# The size and the expected false positive rate of the filter of the valid auth tokens.
+promths_token_filter_size_gauge = Gauge('tackle_auth_token_filter_size_bytes',
+                                        'tackle - Valid Auth Token Filter Size',
+                                        ['exec_id'],
+                                        multiprocess_mode='liveall')
+
+promths_token_filter_fp_rate_gauge = Gauge('tackle_auth_token_filter_false_positive_rate',
+                                           'tackle - Valid Auth Token Filter False Positive Rate',
+                                           ['exec_id'],
+                                           multiprocess_mode='liveall')
 
 # The instance's http responses
-promths_http_response_gauge = Gauge('tackle_http_responses',
-                                    'tackle - HTTP Responses.',
-                                    ['exec_id', 'auth_desc', 'caller_name', 'endpoint', 'status'])
+promths_http_response_counter = Counter('tackle_http_responses',
+                                        'tackle - HTTP Responses.',
+                                        ['exec_id', 'auth_desc', 'endpoint', 'status'])
+
+# The instance's call units charged.
+promths_call_units_counter = Counter('tackle_call_units',
+                                     'tackle - Call Units Charged.',
+                                     ['exec_id', 'auth_desc', 'endpoint'])
+
+# The distribution of the call units per request.
+promths_call_units_histogrm = Histogram('tackle_call_units_per_request',
+                                        'tackle - Call Units per Request',
+                                        ['exec_id', 'endpoint'],
+                                        buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float("inf")))
+
+# The time spent serialising the JSON bodies and the compression ratio (compressed / original size) of the compressed
+# responses per endpoint (URL rule). See response_utils.
+promths_serialisation_histogrm = Histogram('tackle_serialisation_seconds',
+                                           'tackle - JSON Serialisation Time',
+                                           ['exec_id', 'endpoint'],
+                                           buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, float("inf")))
+
+promths_compression_ratio_histogrm = Histogram('tackle_compression_ratio',
+                                               'tackle - Response Compression Ratio',
+                                               ['exec_id', 'endpoint', 'encoding'],
+                                               buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, float("inf")))
+
+# =============================
+# The instance's request latency distribution. The labels are limited to the endpoint to bound the number of series.
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float("inf"))
+SLOW_LATENCY_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, float("inf"))
+
+promths_request_histogrm = Histogram('tackle_request_latency_seconds',
+                                     'tackle - Request Latency',
+                                     ['exec_id', 'endpoint'],
+                                     buckets=DEFAULT_LATENCY_BUCKETS)
+
+promths_slow_request_histogrm = Histogram('tackle_slow_request_latency_seconds',
+                                          'tackle - Request Latency of the slow endpoints',
+                                          ['exec_id', 'endpoint'],
+                                          buckets=SLOW_LATENCY_BUCKETS)
+
+# The fixed set of latency bucket profiles. Each profile is one histogram shared by its endpoints.
+LATENCY_BUCKET_PROFILES = {'default': promths_request_histogrm,
+                           'slow': promths_slow_request_histogrm}  # type: Dict[str, Histogram]
+
+# The bucket profile of the endpoints configured with a non-default profile. See configure_latency_buckets(...).
+_endpoint_latency_profiles = {}  # type: Dict[str, str]
+
+
+def configure_latency_buckets(endpoint: str, profile: str) -> None:
+    """
+    Use another latency bucket profile for an endpoint whose latencies don't suit DEFAULT_LATENCY_BUCKETS e.g. use
+    'slow' for a slow NLP endpoint. The endpoint's latencies are then exported in the profile's histogram e.g.
+    tackle_slow_request_latency_seconds{endpoint="<endpoint>"}.
+
+    :param endpoint: The endpoint (wrapper function) name.
+    :param profile: One of LATENCY_BUCKET_PROFILES.
+    """
+    if profile not in LATENCY_BUCKET_PROFILES:
+        raise ValueError(f"Unknown latency bucket profile {profile!r}. Use one of {sorted(LATENCY_BUCKET_PROFILES)}.")
+
+    _endpoint_latency_profiles[endpoint] = profile
+
+
+def observe_request_latency(endpoint: str, duration: float) -> None:
+    """ Record the latency of a request to an endpoint in the histogram of the endpoint's bucket profile. """
+    histogrm = LATENCY_BUCKET_PROFILES[_endpoint_latency_profiles.get(endpoint, 'default')]
+    histogrm.labels(exec_id=promths_exec_id, endpoint=endpoint).observe(duration)  # pylint: disable=no-member
@@ -0,0 +1,162 @@
+import gzip
+import time
+import importlib
+from types import ModuleType
+from typing import Dict, Optional, Any, TYPE_CHECKING  # noqa # pylint: disable=unused-import
+
+from flask import request, has_request_context
+
+if TYPE_CHECKING:
+    from flask.json.provider import DefaultJSONProvider
+else:
+    try:
+        from flask.json.provider import DefaultJSONProvider
+    except ImportError:  # Flask < 2.2 has no pluggable JSON providers.
+        DefaultJSONProvider = object
+
+from tackle.prometheus_utils import promths_exec_id
+from tackle.prometheus_utils import promths_serialisation_histogrm
+from tackle.prometheus_utils import promths_compression_ratio_histogrm
+
+
+def _optional_module(name: str) -> Optional[ModuleType]:
+    """ The module of the name or None if it isn't installed. """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+orjson = _optional_module('orjson')  # Optional fast path; the stdlib json is used without it.
+brotli = _optional_module('brotli')  # Optional; responses are then only gzip compressed.
+
+
+def _endpoint_label() -> str:
+    """ The URL rule (e.g. '/dashboard') of the current request; bounds the number of metric series. """
+    if has_request_context() and (request.url_rule is not None):
+        return request.url_rule.rule
+
+    return 'none'
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider with an orjson fast path (if installed) and Flask's stdlib json provider as fallback e.g. for
+    arguments or values orjson doesn't support (like ints wider than 64 bits). Note that orjson serialises datetimes in
+    ISO 8601 instead of the HTTP date format of the stdlib provider. The serialisation time is sent to prometheus per
+    endpoint. Pass to create_flask_app(..., json_provider_class=FastJSONProvider).
+    """
+    compact = False  # If True the indent connexion asks for is ignored, which saves bytes and time.
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        start_time = time.perf_counter()
+
+        try:
+            return self._dumps(obj, **kwargs)
+        finally:
+            duration = time.perf_counter() - start_time
+            promths_serialisation_histogrm.labels(exec_id=promths_exec_id,
+                                                  endpoint=_endpoint_label()).observe(duration)  # pylint: disable=no-member
+
+    def _dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is not None:
+            orjson_kwargs = dict(kwargs)
+            indent = orjson_kwargs.pop('indent', None)
+            sort_keys = orjson_kwargs.pop('sort_keys', self.sort_keys)
+            orjson_kwargs.pop('separators', None)  # orjson output is always compact unless indented.
+
+            if (not orjson_kwargs) and (indent in (None, 2)):
+                option = orjson.OPT_NON_STR_KEYS
+
+                if (indent == 2) and (not self.compact):
+                    option |= orjson.OPT_INDENT_2
+                if sort_keys:
+                    option |= orjson.OPT_SORT_KEYS
+
+                try:
+                    return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+                except TypeError:
+                    pass  # Not supported by orjson; fall back to the stdlib json.
+
+        if self.compact:
+            kwargs.pop('indent', None)
+
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if (orjson is not None) and (not kwargs):
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass  # Let the stdlib json raise its usual error.
+
+        return super().loads(s, **kwargs)
+
+
+# =============================
+# Response compression: Bodies of at least min_size bytes are compressed with the best encoding accepted by the client.
+# min_size None disables the compression. See configure_compression(...).
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/problem+json', 'text/plain', 'text/html', 'text/csv'}
+
+_compression_details = {"min_size": None, "level": 6}  # type: Dict
+
+
+def configure_compression(min_size: Optional[int] = 1024,
+                          level: int = 6) -> None:
+    """
+    Configure the Accept-Encoding negotiated compression (brotli if installed and accepted, else gzip) of the responses.
+
+    :param min_size: The min size (in bytes) of a response body to compress. 'None' to disable the compression.
+    :param level: The compression level: 1 (fastest) to 9 (smallest). Mapped to brotli's 0 to 11 quality range.
+    """
+    _compression_details["min_size"] = min_size
+    _compression_details["level"] = level
+
+
+def _negotiate_encoding() -> Optional[str]:
+    accept_encodings = request.accept_encodings
+
+    if (brotli is not None) and accept_encodings['br']:
+        return 'br'
+    elif accept_encodings['gzip']:
+        return 'gzip'
+
+    return None
+
+
+def cllbck_compress_response(response):
+    """ Flask after_request callback that compresses the response body if the client accepts it. """
+    min_size = _compression_details["min_size"]
+
+    if (min_size is None) or response.direct_passthrough or (response.mimetype not in COMPRESSIBLE_MIMETYPES) or \
+            ('Content-Encoding' in response.headers) or not (200 <= response.status_code < 300):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = _negotiate_encoding()
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    level = _compression_details["level"]
+
+    if (encoding == 'br') and (brotli is not None):
+        compressed_body = brotli.compress(body, quality=min(max(round(level * 11 / 9), 0), 11))
+    else:
+        compressed_body = gzip.compress(body, compresslevel=level)
+
+    response.set_data(compressed_body)
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed body isn't byte-identical to the one the (strong) ETag was computed over.
+    etag, weak = response.get_etag()
+    if (etag is not None) and (not weak):
+        response.set_etag(etag, weak=True)
+
+    promths_compression_ratio_histogrm.labels(exec_id=promths_exec_id, endpoint=_endpoint_label(),
+                                              encoding=encoding).observe(len(compressed_body) / len(body))  # pylint: disable=no-member
+    return response
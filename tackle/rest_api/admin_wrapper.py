@@ -0,0 +1,41 @@
+"""
+EXAMPLE - Wrapper of tackle's auth token admin Python API in HTTP API.
+"""
+
+from typing import List, Tuple, Optional  # noqa # pylint: disable=unused-import
+
+from tackle.rest_api import wrapper_util
+
+
+@wrapper_util.lock_decorator(policy=wrapper_util.NO_LOCK)  # Re-entrant; no need to queue behind the engine.
+@wrapper_util.admin_auth_decorator
+def list_auth_tokens(auth_token: str,
+                     caller_name: Optional[str],
+                     page_size: int,
+                     after: Optional[str]) -> Tuple[int, wrapper_util.JSONType]:
+    """ A keyset page of the auth tokens. The returned next_after is the 'after' cursor of the next page. """
+    try:
+        if after is not None:
+            bytes.fromhex(after)
+    except ValueError:
+        return 400, {"error_detail": "The 'after' cursor must be a hex token digest!"}
+
+    rows, next_after = wrapper_util.load_auth_token_page(page_size, after)
+
+    auth_tokens = [{'key_digest': key_digest,
+                    'token_id': token_id,
+                    'desc': desc,
+                    'call_count': call_count,
+                    'call_count_limit': call_count_limit}
+                   for key_digest, token_id, desc, call_count, call_count_limit in rows]
+
+    return 200, {'auth_tokens': auth_tokens, 'next_after': next_after}
+
+
+@wrapper_util.lock_decorator(policy=wrapper_util.NO_LOCK)  # Re-entrant; no need to queue behind the engine.
+@wrapper_util.admin_auth_decorator
+def get_auth_token_details(auth_token: str,
+                           caller_name: Optional[str],
+                           auth_tokens: List[str]) -> Tuple[int, wrapper_util.JSONType]:
+    """ The details of many auth tokens keyed by token. A token's details are null if the token wasn't found. """
+    return 200, {'auth_tokens': wrapper_util.get_auth_token_details_many(auth_tokens)}
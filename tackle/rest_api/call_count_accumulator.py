@@ -0,0 +1,136 @@
+import time
+import threading
+import logging
+from typing import Dict, Tuple, Optional, Callable  # noqa # pylint: disable=unused-import
+
+CallCountKey = Tuple[str, Optional[str]]  # (auth_token, endpoint)
+
+
+class CallCountAccumulator(object):
+    """
+    Thread-safe write-behind accumulator of API call counts. Aggregates (auth_token, endpoint) -> units in memory and
+    hands the aggregate to flush_fn on a background thread (see start()) when max_pending keys are pending or max_delay
+    seconds have passed since the last flush. The accumulated units remain visible through pending_units(...) until they
+    have been flushed.
+    """
+
+    def __init__(self,
+                 flush_fn: Callable[[Dict[CallCountKey, int]], None],
+                 max_pending: int = 1000,
+                 max_delay: float = 5.0) -> None:
+        """
+        :param flush_fn: Writes an aggregate of (auth_token, endpoint) -> units to the DB in one transaction.
+        :param max_pending: The number of pending (auth_token, endpoint) keys that triggers a flush.
+        :param max_delay: The max time (in seconds) that units are held before being flushed.
+        """
+        self._flush_fn = flush_fn
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()  # Protects the pending and in-flight state below.
+        self._flush_lock = threading.Lock()  # Serialises the flushes.
+
+        self._pending = {}  # type: Dict[CallCountKey, int]
+        self._pending_token_units = {}  # type: Dict[str, int]
+        self._in_flight_token_units = {}  # type: Dict[str, int]  # Units being flushed, but not yet committed.
+        self._last_flush_time = time.time()
+
+        self._flush_event = threading.Event()  # Wakes the flush thread before max_delay has passed.
+        self._stop_event = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def add(self, auth_token: str, endpoint: Optional[str], units: int) -> None:
+        """
+        Accumulate units for the auth token and endpoint. Only signals the flush thread if a threshold is reached; never
+        blocks on or raises from a flush.
+        """
+        with self._lock:
+            key = (auth_token, endpoint)
+            self._pending[key] = self._pending.get(key, 0) + units
+            self._pending_token_units[auth_token] = self._pending_token_units.get(auth_token, 0) + units
+
+            flush_due = (len(self._pending) >= self.max_pending) or \
+                        ((time.time() - self._last_flush_time) >= self.max_delay)
+
+        if flush_due:
+            self._flush_event.set()
+
+    def pending_units(self, auth_token: str) -> int:
+        """ The units accumulated for the auth token (over all endpoints) that have not been committed to the DB yet. """
+        with self._lock:
+            return self._pending_token_units.get(auth_token, 0) + self._in_flight_token_units.get(auth_token, 0)
+
+    def discard(self, auth_token: str) -> None:
+        """ Drop the pending and in-flight units of an auth token e.g. when the token is removed. """
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == auth_token]:
+                del self._pending[key]
+            self._pending_token_units.pop(auth_token, None)
+            self._in_flight_token_units.pop(auth_token, None)  # Also not returned to pending if the flush fails.
+
+    def flush(self) -> int:
+        """
+        Hand the pending aggregate to flush_fn. If flush_fn raises then the units are returned to the pending state.
+
+        :return: The number of (auth_token, endpoint) keys flushed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                self._in_flight_token_units = self._pending_token_units
+                self._pending_token_units = {}
+                self._last_flush_time = time.time()
+
+            if not pending:
+                return 0
+
+            try:
+                self._flush_fn(pending)
+            except Exception:
+                with self._lock:
+                    for key, units in pending.items():
+                        if key[0] not in self._in_flight_token_units:
+                            continue  # Discarded during the flush.
+                        self._pending[key] = self._pending.get(key, 0) + units
+                    for auth_token, units in self._in_flight_token_units.items():
+                        self._pending_token_units[auth_token] = self._pending_token_units.get(auth_token, 0) + units
+                    self._in_flight_token_units = {}
+                raise
+            else:
+                with self._lock:
+                    self._in_flight_token_units = {}
+
+            return len(pending)
+
+    def _run(self) -> None:
+        while True:
+            self._flush_event.wait(self.max_delay)
+            self._flush_event.clear()
+
+            if self._stop_event.is_set():
+                return
+
+            try:
+                self.flush()
+            except Exception as e:
+                logging.exception(f"CallCountAccumulator._run: Flush failed: {e}! Will retry.")
+
+    def start(self) -> None:
+        """
+        Start the daemon thread that flushes when signalled by add(...) and every max_delay seconds, also when no new
+        calls arrive. Without it the units are only written by explicit flush() calls.
+        """
+        if self._thread is None:
+            self._stop_event.clear()
+            self._flush_event.clear()
+            self._thread = threading.Thread(target=self._run, name="tackle_call_count_flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """ Stop the flush thread. Note: Doesn't flush; call flush() after stop() to write the remaining units. """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._flush_event.set()
+            self._thread.join()
+            self._thread = None
@@ -8,14 +8,31 @@ from tackle.rest_api import wrapper_util
 from tackle import __version__ as tackle_version
 
 
-@wrapper_util.lock_decorator
-@wrapper_util.auth_decorator
-def get_details(auth_token: str,
-                caller_name: Optional[str]) -> Tuple[int, wrapper_util.JSONType]:
-    dash_content = {
+def _dash_content() -> wrapper_util.JSONType:
+    return {
         'api_version': tackle_version,
         'service_name': 'tackle Service',
         'log_file': wrapper_util.get_log_filename()
     }
 
-    return 200, dash_content
+
+@wrapper_util.lock_decorator(policy=wrapper_util.NO_LOCK)  # Re-entrant; no need to queue behind the engine.
+@wrapper_util.auth_decorator
+def get_details(auth_token: str,
+                caller_name: Optional[str]) -> Tuple[int, wrapper_util.JSONType]:
+    return 200, _dash_content()
+
+
+@wrapper_util.async_lock_decorator(policy=wrapper_util.NO_LOCK)
+@wrapper_util.async_auth_decorator
+async def get_details_async(auth_token: str,
+                            caller_name: Optional[str]) -> Tuple[int, wrapper_util.JSONType]:
+    """ Async version of get_details e.g. for a native async route of asgi_utils.ASGIApp. """
+    return 200, _dash_content()
+
+
+@wrapper_util.job_decorator(policy=wrapper_util.NO_LOCK)
+def get_details_job(auth_token: str,
+                    caller_name: Optional[str]) -> Tuple[int, wrapper_util.JSONType]:
+    """ Job version of get_details e.g. for a long running call. Returns 202 and the job id; see wrapper_util.get_job. """
+    return 200, _dash_content()
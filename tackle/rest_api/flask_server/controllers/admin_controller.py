@@ -0,0 +1,27 @@
+from tackle.rest_api.flask_server.controllers import controller_util
+from tackle.rest_api import admin_wrapper
+
+
+@controller_util.controller_decorator
+def list_auth_tokens(user, token_info, page_size=1000, after=None):
+    """ Lists a page of the auth tokens. Requires an admin auth token. """
+    auth_token = controller_util.get_auth_token()
+    caller_name = controller_util.get_caller_name()
+
+    response_code, response_json = admin_wrapper.list_auth_tokens(auth_token=auth_token,
+                                                                  caller_name=caller_name,
+                                                                  page_size=page_size,
+                                                                  after=after)
+    return response_json, response_code
+
+
+@controller_util.controller_decorator
+def get_auth_token_details(user, token_info, params):
+    """ Gets the details of many auth tokens. Requires an admin auth token. """
+    auth_token = controller_util.get_auth_token()
+    caller_name = controller_util.get_caller_name()
+
+    response_code, response_json = admin_wrapper.get_auth_token_details(auth_token=auth_token,
+                                                                        caller_name=caller_name,
+                                                                        auth_tokens=params.get("auth_tokens"))
+    return response_json, response_code
@@ -8,8 +8,13 @@ from typing import Union, Dict, List, Tuple, Optional, Any  # noqa # pylint: dis
 from functools import wraps
 import threading
 import copy
+import math
+import time
+import hashlib
 
 from tackle.rest_api import wrapper_util
+from tackle.flask_utils import LazyTruncatedStr
+from tackle.cache_utils import TTLCache
 
 JSONIterableType = Union[Dict[str, Any], List[Any]]
 JSONType = Union[str, int, float, bool, None, JSONIterableType]
@@ -51,6 +56,175 @@ controller_decorator_call_count = 0
 controller_decorator_call_count_lock = threading.Lock()
 
 
+# =============================
+# Response cache of the endpoints that opt in with the swagger extension, e.g.:
+#     x-tackle-response-cache:
+#       ttl: 30                     # Seconds a response is cached for.
+#       charge-not-modified: false  # Whether a 304 served from the cache consumes call units.
+# The serialised 200 responses are cached per auth token and request (LRU bounded). A cached response is served after
+# charging it like the call it was cached from i.e. the same call units to the same wrapper endpoints (which also
+# validates the token and applies the rate limits) and, if the request's If-None-Match (weakly, as the ETag of a
+# compressed response is weak) matches the response's ETag, as a 304 without a body. A 304 that isn't charged still
+# validates the token and applies its rate limits.
+RESPONSE_CACHE_EXTENSION = 'x-tackle-response-cache'
+
+response_cache = TTLCache(max_size=1000)  # type: TTLCache  # request key -> (expiry time, body, etag, charges)
+_response_cache_details = {"max_body_size": 65536}  # type: Dict
+_response_cache_configs = {}  # type: Dict[str, Dict]  # controller function ('module.name') -> {ttl, charge_not_modified}
+_charge_fns = {}  # type: Dict[str, Any]
+
+
+def configure_response_cache(max_size: int = 1000,
+                             max_body_size: int = 65536) -> None:
+    """
+    Configure the response cache of the endpoints with the x-tackle-response-cache swagger extension.
+
+    :param max_size: The max number of cached responses. The least recently used responses are evicted first.
+    :param max_body_size: The max size (in bytes) of a serialised response body to cache.
+    """
+    response_cache.configure(max_size, None)
+    _response_cache_details["max_body_size"] = max_body_size
+
+
+def register_response_cache_extensions(spec: Dict) -> None:
+    """ Register the operations of a swagger spec that opt into the response cache with the x-tackle-response-cache extension. """
+    for path_item in spec.get('paths', {}).values():
+        for operation in path_item.values():
+            if (not isinstance(operation, dict)) or (RESPONSE_CACHE_EXTENSION not in operation):
+                continue
+
+            cache_extension = operation[RESPONSE_CACHE_EXTENSION] or {}
+            controller = operation.get('x-swagger-router-controller')
+            function_name = operation['operationId'] if controller is None else controller + '.' + operation['operationId']
+
+            _response_cache_configs[function_name] = {'ttl': float(cache_extension.get('ttl', 60.0)),
+                                                      'charge_not_modified': bool(cache_extension.get('charge-not-modified',
+                                                                                                      False))}
+
+
+def _charge_cached_call(charges: List[Tuple[str, int]], auth_token: str, caller_name: Optional[str]) -> Tuple[int, JSONType]:
+    """
+    Validate the auth token and charge a response served from the cache like the call it was cached from.
+
+    :param charges: The (wrapper endpoint, call units) charged by the call the response was cached from. See
+                    wrapper_util.request_charges().
+    """
+    if not charges:  # The call didn't charge any units.
+        rejection = _validate_cached_call(auth_token)
+        return (200, None) if rejection is None else rejection
+
+    for name, call_units in charges:
+        charge_fn = _charge_fns.get(name)
+
+        if charge_fn is None:
+            def charge(auth_token: str, caller_name: Optional[str], call_units: int) -> Tuple[int, JSONType]:
+                return 200, None
+
+            charge.__name__ = name  # The endpoint the call units are allocated to.
+            charge_fn = _charge_fns.setdefault(name, wrapper_util.auth_decorator(charge))
+
+        response_code, response_json = charge_fn(auth_token=auth_token, caller_name=caller_name, call_units=call_units)
+
+        if not (200 <= response_code <= 299):
+            return response_code, response_json
+
+    return 200, None
+
+
+def _validate_cached_call(auth_token: str) -> Optional[Tuple[int, JSONType]]:
+    """
+    Validate the auth token and apply its rate limits to a 304 served from the cache without charging its call units.
+
+    :return: The (response_code, response_json) if the call is rejected, else None.
+    """
+    retry_after = wrapper_util.rate_limiter.acquire(auth_token, 1)
+
+    if retry_after > 0.0:
+        return 429, {"error_detail": "API rate limit exceeded!", "retry_after": retry_after}
+
+    if not wrapper_util.is_auth_token_valid(auth_token):
+        wrapper_util.rate_limiter.refund(auth_token, 1)
+        return 403, {"error_detail": "Invalid authorisation token provided or API rate limit exceeded!"}
+
+    return None
+
+
+def _cached_call(f, cache_config: Dict, auth_token: str, args, kwargs) -> Tuple[JSONType, int, Optional[bytes], Optional[str]]:
+    """
+    Serve a call of a controller function with a response cache.
+
+    :return: (response_json, response_code, the cached response body or None, the ETag or None)
+    """
+    request = flask.request
+    body_digest = None if request.method in ('GET', 'HEAD') else hashlib.sha1(request.get_data()).digest()
+    key = (auth_token, request.method, request.full_path, body_digest)
+
+    entry = response_cache.get(key)
+
+    if (entry is not None) and (entry[0] > time.time()):
+        _, body, etag, charges = entry
+        not_modified = request.if_none_match.contains_weak(etag)
+
+        if (not not_modified) or cache_config['charge_not_modified']:
+            response_code, response_json = _charge_cached_call(charges, auth_token, get_caller_name())
+
+            if not (200 <= response_code <= 299):
+                return response_json, response_code, None, None
+        else:
+            rejection = _validate_cached_call(auth_token)
+
+            if rejection is not None:
+                return rejection[1], rejection[0], None, None
+
+        return None, (304 if not_modified else 200), (None if not_modified else body), etag
+
+    response_json, response_code = f(*args, **kwargs)
+
+    if response_code != 200:
+        return response_json, response_code, None, None
+
+    body = flask.json.dumps(response_json, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+
+    if len(body) <= _response_cache_details["max_body_size"]:
+        response_cache[key] = (time.time() + cache_config['ttl'], body, etag, wrapper_util.request_charges())
+
+    if request.if_none_match.contains_weak(etag):
+        return None, 304, None, etag
+
+    return response_json, response_code, None, etag
+
+
+def usage_headers(auth_token: Optional[str], response_code: int) -> Dict[str, Any]:
+    """ The usage (call count & rate limit) headers of a response to a call with the auth token. """
+    call_count_tuple = wrapper_util.auth_token_call_cache.get(auth_token)  # count, limit
+
+    if call_count_tuple is not None:
+        if call_count_tuple[1] is None:
+            call_count_remaining = -1  # Implies unlimited remaining.
+        else:
+            call_count_remaining = max(call_count_tuple[1] - call_count_tuple[0], 0)  # Don't return a value <0
+    else:
+        call_count_remaining = 0  # Zero remaining; auth token not found?
+
+    headers = {"X-RateLimit-Remaining": call_count_remaining}  # type: Dict[str, Any]
+
+    # The rate limits (requests/sec & units/min), if any. The headers describe the most depleted of the token's limits.
+    rate_limit_status = wrapper_util.rate_limiter.status(auth_token) if auth_token is not None else None
+
+    if rate_limit_status is not None:
+        headers["X-RateLimit-Limit"] = rate_limit_status.limit
+        headers["X-RateLimit-Reset"] = math.ceil(rate_limit_status.reset)
+
+        if (call_count_remaining == -1) or (rate_limit_status.remaining < call_count_remaining):
+            headers["X-RateLimit-Remaining"] = rate_limit_status.remaining
+
+        if response_code == 429:
+            headers["Retry-After"] = max(math.ceil(rate_limit_status.retry_after), 1)
+
+    return headers
+
+
 def controller_decorator(f):
     """
     Decorator to add usage header to response and to log info on the controller.
@@ -64,31 +238,37 @@ def controller_decorator(f):
             controller_decorator_call_count += 1
             local_controller_decorator_call_count = copy.deepcopy(controller_decorator_call_count)
 
-        logging.info(f"flask_controller_request: ({local_controller_decorator_call_count}) {f.__name__} <- {str(args)} {str(kwargs)}")
+        logging.info("flask_controller_request: (%d) %s <- %s %s", local_controller_decorator_call_count, f.__name__, args, kwargs)
 
         # request_data = flask.request.data
         # remote_addr = flask.request.remote_addr
         # logging.info(f'flask_controller_request (raw data): "{request_data}" from {remote_addr}')
 
-        response_json, response_code = f(*args, **kwargs)
+        auth_token = get_auth_token()
+        cache_config = _response_cache_configs.get(f.__module__ + '.' + f.__name__)
 
-        call_count_tuple = wrapper_util.auth_token_call_cache.get(get_auth_token())  # count, limit
-
-        if call_count_tuple is not None:
-            if call_count_tuple[1] is None:
-                call_count_remaining = -1  # Implies unlimited remaining.
-            else:
-                call_count_remaining = max(call_count_tuple[1] - call_count_tuple[0], 0)  # Don't return a value <0
+        if (cache_config is not None) and (auth_token is not None):
+            response_json, response_code, cached_body, etag = _cached_call(f, cache_config, auth_token, args, kwargs)
         else:
-            call_count_remaining = 0  # Zero remaining; auth token not found?
+            response_json, response_code = f(*args, **kwargs)
+            cached_body, etag = None, None
+
+        headers = usage_headers(auth_token, response_code)
+
+        if etag is not None:
+            headers["ETag"] = '"' + etag + '"'
+
+        if (response_code == 202) and isinstance(response_json, dict) and ('job_id' in response_json):
+            headers["Location"] = flask.request.script_root + '/jobs/' + response_json['job_id']  # The job status URL.
 
-        response_json_str = str(response_json)
-        if len(response_json_str) > 300:
-            response_json_str = response_json_str[:297] + '...'
+        logging.info("flask_controller_response: (%d) %s -> (%s, %s, %s)\n", local_controller_decorator_call_count, f.__name__,
+                     LazyTruncatedStr(response_json if cached_body is None else cached_body, 300), response_code, headers)
 
-        logging.info(f"flask_controller_response: ({local_controller_decorator_call_count}) {f.__name__} -> "
-                     f"{str((response_json_str, response_code, {'X-RateLimit-Remaining': call_count_remaining}))}\n")
+        if response_code == 304:
+            return flask.Response(status=304, headers=headers)
+        elif cached_body is not None:
+            return flask.Response(cached_body, status=response_code, headers=headers, mimetype='application/json')
 
-        return response_json, response_code, {"X-RateLimit-Remaining": call_count_remaining}
+        return response_json, response_code, headers
 
     return decorated_f
@@ -17,6 +17,16 @@ def get_details_with_params(user, token_info,
     return get_details_with_params_impl(user, token_info, params)
 
 
+@controller_util.controller_decorator
+def submit_details_job(user, token_info):
+    auth_token = controller_util.get_auth_token()
+    caller_name = controller_util.get_caller_name()
+
+    response_code, response_json = dashboard_wrapper.get_details_job(auth_token=auth_token,
+                                                                     caller_name=caller_name)
+    return response_json, response_code
+
+
 def get_details_impl(user, token_info):
     auth_token = controller_util.get_auth_token()
     caller_name = controller_util.get_caller_name()
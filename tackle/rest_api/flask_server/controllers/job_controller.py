@@ -0,0 +1,14 @@
+from tackle.rest_api.flask_server.controllers import controller_util
+from tackle.rest_api import job_wrapper
+
+
+@controller_util.controller_decorator
+def get_job(user, token_info, job_id):
+    """ Gets the status and result of a job queued by the auth token. """
+    auth_token = controller_util.get_auth_token()
+    caller_name = controller_util.get_caller_name()
+
+    response_code, response_json = job_wrapper.get_job(auth_token=auth_token,
+                                                       caller_name=caller_name,
+                                                       job_id=job_id)
+    return response_json, response_code
@@ -11,6 +11,7 @@ from tackle.flask_utils import db, create_flask_app
 from tackle.flask_utils import setup_logging, reset_logging
 # from tackle.rest_api.wrapper_util import start_tackle_engine as wrapper_start_tackle_engine
 from tackle.rest_api import wrapper_util
+from tackle.rest_api.flask_server.controllers import controller_util
 
 
 if "PYCHARM_HOSTED" in os.environ:
@@ -24,6 +25,13 @@ if "PYCHARM_HOSTED" in os.environ:
 testing_api_key = "The_api_key_for_testing."
 
 
+def auth_token_details(auth_token: str = testing_api_key) -> dict:
+    """ The details of an existing auth token. See wrapper_util.get_auth_token_details(...). """
+    details = wrapper_util.get_auth_token_details(auth_token)
+    assert details is not None, f"Auth token {auth_token} not found!"
+    return details
+
+
 class BaseTestCase(TestCase):
     def __init__(self,
                  *args,
@@ -63,6 +71,7 @@ class BaseTestCase(TestCase):
         # Add the auth token used for testing.
         wrapper_util.add_auth_token(testing_api_key, "Test API key.")
         wrapper_util.add_admin_auth_token(testing_api_key, "Test API key.")
+        controller_util.response_cache.clear()  # The responses cached by a previous test's token.
         print("done.", flush=True)
 
     def tearDown(self):
@@ -0,0 +1,167 @@
+# import unittest
+import time
+import json
+import asyncio
+import threading
+from typing import List  # noqa # pylint: disable=unused-import
+
+from tackle.rest_api.flask_server.tests import BaseTestCase, testing_api_key, auth_token_details
+from tackle.rest_api import wrapper_util
+from tackle.rest_api import dashboard_wrapper
+from tackle.rest_api import get_path
+from tackle.asgi_utils import ASGIApp
+from tackle.concurrency_utils import ExclusivePolicy
+from tackle import __version__ as tackle_version
+
+
+async def _asgi_request(asgi_app, method: str, path: str, body: bytes = b'', auth_token: str = testing_api_key):
+    """ Send a request to an ASGI app and return (status, headers, body). """
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'root_path': '', 'query_string': b'',
+             'headers': [(b'x-auth-token', auth_token.encode('latin-1')), (b'content-type', b'application/json')],
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 50000)}
+
+    await asgi_app(scope, receive, send)
+
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+# @unittest.skip("skipping during dev")
+class TestASGIMode(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        BaseTestCase.__init__(self,
+                              *args,
+                              specification_dir=get_path() + '/flask_server/swagger/',
+                              requested_logging_path="~/.tackle/logs",
+                              **kwargs)
+
+    def setUp(self):
+        BaseTestCase.setUp(self)
+        # One executor thread: The in-memory sqlite test DB shares a single connection between the threads.
+        wrapper_util.configure_async_executor(max_workers=1, app=self.app)
+        self.asgi_app = ASGIApp(self.app, max_workers=4)
+
+    def tearDown(self):
+        self.asgi_app.shutdown()
+        BaseTestCase.tearDown(self)
+
+    def test_asgi_wsgi_routes(self):
+        print("Rest HTTP test_asgi_wsgi_routes:")
+        start_time = time.time()
+
+        status, headers, body = asyncio.run(_asgi_request(self.asgi_app, 'POST', '/dashboard',
+                                                          json.dumps({'history_size': 10}).encode('utf-8')))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['api_version'], tackle_version)
+        self.assertIn(b'x-ratelimit-remaining', headers)
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], 1)
+
+        status, _, _ = asyncio.run(_asgi_request(self.asgi_app, 'GET', '/dashboard', auth_token='not_a_token'))
+        self.assertEqual(status, 403)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_asgi_async_routes(self):
+        print("Rest HTTP test_asgi_async_routes:")
+        start_time = time.time()
+
+        @wrapper_util.async_lock_decorator(policy=wrapper_util.NO_LOCK)
+        @wrapper_util.async_auth_decorator
+        async def slow_details(auth_token, caller_name):
+            await asyncio.sleep(0.2)  # e.g. awaiting a downstream service; mustn't hold an executor thread.
+            return 200, {'slow': True}
+
+        async def handle_slow(request):
+            return await slow_details(auth_token=request.auth_token, caller_name=request.caller_name)
+
+        async def handle_dashboard(request):
+            return await dashboard_wrapper.get_details_async(auth_token=request.auth_token, caller_name=request.caller_name)
+
+        self.asgi_app.add_async_route('/async/slow', handle_slow)
+        self.asgi_app.add_async_route('/async/dashboard', handle_dashboard)
+
+        status, headers, body = asyncio.run(_asgi_request(self.asgi_app, 'GET', '/async/dashboard'))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['api_version'], tackle_version)
+        self.assertIn(b'x-ratelimit-remaining', headers)
+
+        async def send_concurrently(num_requests):
+            return await asyncio.gather(*[_asgi_request(self.asgi_app, 'GET', '/async/slow') for _ in range(num_requests)])
+
+        # 20 slow calls with 1 executor thread complete in about the time of one.
+        slow_start_time = time.time()
+        responses = asyncio.run(send_concurrently(20))
+
+        self.assertEqual([status for status, _, _ in responses], [200] * 20)
+        self.assertLess(time.time() - slow_start_time, 2.0)
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], 21)
+
+        status, _, body = asyncio.run(_asgi_request(self.asgi_app, 'GET', '/async/slow', auth_token='not_a_token'))
+        self.assertEqual(status, 403)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_async_call_cancelled(self):
+        print("Rest HTTP test_async_call_cancelled:")
+        start_time = time.time()
+
+        @wrapper_util.async_auth_decorator
+        async def hanging_call(auth_token, caller_name):
+            await asyncio.sleep(10.0)
+            return 200, None
+
+        async def cancel_call():
+            task = asyncio.ensure_future(hanging_call(auth_token=testing_api_key, caller_name=None))
+            await asyncio.sleep(0.2)
+            task.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        # The call units reserved for a cancelled call (e.g. the client disconnected) are released.
+        call_count = auth_token_details(testing_api_key)['call_count']
+        asyncio.run(cancel_call())
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], call_count)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_async_lock_decorator(self):
+        print("Rest HTTP test_async_lock_decorator:")
+        start_time = time.time()
+
+        policy = ExclusivePolicy('test_async')
+        active = []  # type: List[int]
+        overlaps = []
+
+        @wrapper_util.async_lock_decorator(policy=policy)
+        async def exclusive_call():
+            overlaps.append(len(active))
+            active.append(1)
+            await asyncio.sleep(0.01)
+            active.pop()
+            return 200, None
+
+        # A sync holder of the policy (e.g. a WSGI request thread) also holds the async callers back.
+        policy.acquire()
+        threading.Timer(0.1, policy.release).start()
+
+        async def call_concurrently():
+            return await asyncio.gather(*[exclusive_call() for _ in range(5)])
+
+        call_start_time = time.time()
+        responses = asyncio.run(call_concurrently())
+
+        self.assertEqual(responses, [(200, None)] * 5)
+        self.assertEqual(overlaps, [0] * 5)
+        self.assertGreaterEqual(time.time() - call_start_time, 0.1)
+
+        print('time = ' + str(time.time() - start_time))
@@ -0,0 +1,242 @@
+# import unittest
+import time
+from typing import List  # noqa # pylint: disable=unused-import
+
+from tackle.rest_api.flask_server.tests import BaseTestCase, send_request, testing_api_key, auth_token_details
+from tackle.rest_api import get_path
+from tackle.rest_api import wrapper_util
+from tackle.db_models import token_digest, APIKeyData
+from tackle.flask_utils import db
+
+
+def _updated_at(auth_token: str) -> float:
+    try:
+        return db.session.query(APIKeyData.updated_at).filter_by(key_digest=token_digest(auth_token)).scalar()
+    finally:
+        db.session.close()
+
+
+# @unittest.skip("skipping during dev")
+class TestRestAuthTokenAdmin(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        BaseTestCase.__init__(self,
+                              *args,
+                              specification_dir=get_path() + '/flask_server/swagger/',
+                              requested_logging_path="~/.tackle/logs",
+                              **kwargs)
+
+    def test_bulk_add_and_remove(self):
+        print("Rest HTTP test_bulk_add_and_remove:")
+        start_time = time.time()
+
+        progress = []  # type: List[int]
+        auth_tokens = [(f"bulk_token_{i}", f"Bulk token {i}.") for i in range(25)]
+
+        num_added = wrapper_util.add_auth_tokens_bulk(auth_tokens + [(testing_api_key, "Updated.")],
+                                                      call_count_limit=5, chunk_size=10,
+                                                      progress_callback=progress.append)
+        self.assertEqual(num_added, 26)
+        self.assertEqual(progress, [10, 20, 26])
+        self.assertEqual(len(wrapper_util.load_auth_token_list()), 26)
+
+        # The added tokens have distinct token ids and are usable.
+        response = send_request(self.client, "/health", "get", {}, request_token="bulk_token_3")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('X-RateLimit-Remaining'), '4')
+
+        details = auth_token_details(testing_api_key)
+        self.assertEqual(details['desc'], "Updated.")
+        self.assertEqual(details['call_count_limit'], 5)
+
+        token_ids = {auth_token_details(auth_token)['token_id'] for auth_token, _ in auth_tokens}
+        self.assertEqual(len(token_ids), 25)
+
+        # Existing tokens are left unchanged unless update_existing.
+        wrapper_util.add_auth_tokens_bulk([("bulk_token_3", "Changed.")], update_existing=False)
+        self.assertEqual(auth_token_details("bulk_token_3")['desc'], "Bulk token 3.")
+        self.assertEqual(auth_token_details("bulk_token_3")['call_count'], 1)
+
+        # A desc of None is stored as NULL for a new token and leaves the desc of an existing token unchanged.
+        wrapper_util.add_auth_tokens_bulk([("bulk_token_3", None), ("bulk_token_new", None)], call_count_limit=7)
+        self.assertEqual(auth_token_details("bulk_token_3")['desc'], "Bulk token 3.")
+        self.assertEqual(auth_token_details("bulk_token_3")['call_count_limit'], 7)
+        self.assertIsNone(auth_token_details("bulk_token_new")['desc'])
+        wrapper_util.remove_auth_token("bulk_token_new")
+
+        num_removed = wrapper_util.remove_auth_tokens_bulk([auth_token for auth_token, _ in auth_tokens] + ["no_such_token"],
+                                                           chunk_size=7)
+        self.assertEqual(num_removed, 25)
+        self.assertEqual(wrapper_util.load_auth_token_list(), [token_digest(testing_api_key).hex()])
+
+        response = send_request(self.client, "/health", "get", {}, request_token="bulk_token_3")
+        self.assertEqual(response.status_code, 403)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_paginated_listing(self):
+        print("Rest HTTP test_paginated_listing:")
+        start_time = time.time()
+
+        wrapper_util.add_auth_tokens_bulk([(f"page_token_{i}", f"Page token {i}.") for i in range(9)])
+
+        all_digests = sorted(row[0] for row in wrapper_util.iter_auth_token_list(batch_size=4))
+        self.assertEqual(len(all_digests), 10)
+
+        # The stream reads on its own connection, so it outlives the session of the thread.
+        token_rows = wrapper_util.iter_auth_token_list(batch_size=4)
+        first_row = next(token_rows)
+        wrapper_util.get_auth_token_details(testing_api_key)  # Uses and closes the session.
+        self.assertEqual(sorted([first_row[0]] + [row[0] for row in token_rows]), all_digests)
+        self.assertEqual(sorted(wrapper_util.load_auth_token_list()), all_digests)
+
+        # Walk the keyset pages through the admin endpoint.
+        page_digests = []  # type: List[str]
+        after = None
+
+        while True:
+            url = "/admin/auth_tokens?page_size=4" + ("" if after is None else f"&after={after}")
+            response = send_request(self.client, url, "get", {})
+            self.assertEqual(response.status_code, 200)
+
+            page = response.json
+            self.assertLessEqual(len(page['auth_tokens']), 4)
+            page_digests.extend(auth_token['key_digest'] for auth_token in page['auth_tokens'])
+
+            after = page.get('next_after')
+            if after is None:
+                break
+
+        self.assertEqual(page_digests, all_digests)
+
+        response = send_request(self.client, "/admin/auth_tokens?after=not_hex", "get", {})
+        self.assertEqual(response.status_code, 400)
+
+        # Only admin auth tokens may list the auth tokens.
+        response = send_request(self.client, "/admin/auth_tokens", "get", {}, request_token="page_token_1")
+        self.assertEqual(response.status_code, 403)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_auth_token_details_many(self):
+        print("Rest HTTP test_auth_token_details_many:")
+        start_time = time.time()
+
+        wrapper_util.add_auth_tokens_bulk([(f"details_token_{i}", f"Details token {i}.") for i in range(3)],
+                                          call_count_limit=10)
+
+        response = send_request(self.client, "/health", "get", {}, request_token="details_token_1")
+        self.assertEqual(response.status_code, 200)
+
+        response = send_request(self.client, "/admin/auth_tokens/details", "post",
+                                {'auth_tokens': ["details_token_0", "details_token_1", "no_such_token"]})
+        self.assertEqual(response.status_code, 200)
+
+        details = response.json['auth_tokens']
+        self.assertIsNone(details["no_such_token"])
+        self.assertEqual(details["details_token_0"]['call_count'], 0)
+        self.assertNotIn('call_count_breakdown', details["details_token_0"])
+        self.assertEqual(details["details_token_1"]['desc'], "Details token 1.")
+        self.assertEqual(details["details_token_1"]['call_count'], 1)
+        self.assertEqual(details["details_token_1"]['call_count_limit'], 10)
+        self.assertEqual(details["details_token_1"]['call_count_breakdown'], {'get_status': 1})
+
+        self.assertEqual(wrapper_util.get_auth_token_details_many(["details_token_1"], chunk_size=1)["details_token_1"],
+                         wrapper_util.get_auth_token_details("details_token_1"))
+
+        response = send_request(self.client, "/admin/auth_tokens/details", "post", {'auth_tokens': []},
+                                request_token="details_token_1")
+        self.assertEqual(response.status_code, 403)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_auth_token_cache_preload(self):
+        print("Rest HTTP test_auth_token_cache_preload:")
+        start_time = time.time()
+
+        wrapper_util.add_auth_tokens_bulk([("warm_token_0", "Warm token 0."), ("warm_token_1", "Warm token 1.")],
+                                          call_count_limit=1)
+        wrapper_util.configure_auth_token_cache(ttl=60.0)
+
+        try:
+            self.assertEqual(wrapper_util.preload_auth_token_cache(), 3)
+            lookups = dict(wrapper_util._auth_token_cache_lookups)
+
+            # The first request of a token is validated from its preloaded record.
+            response = send_request(self.client, "/health", "get", {}, request_token="warm_token_0")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(wrapper_util._auth_token_cache_lookups["warm_hit"], lookups["warm_hit"] + 1)
+            self.assertEqual(wrapper_util._auth_token_cache_lookups["miss"], lookups["miss"])
+
+            response = send_request(self.client, "/health", "get", {}, request_token="warm_token_0")
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(wrapper_util._auth_token_cache_lookups["hit"], lookups["hit"] + 1)
+
+            # The delta refresh pulls the changed rows. (The local change also dropped the token's warm record.)
+            wrapper_util.add_auth_tokens_bulk([("warm_token_0", "Warm token 0.")], call_count_limit=5)
+            self.assertNotIn(token_digest("warm_token_0"), wrapper_util._warm_token_records)
+            self.assertGreaterEqual(wrapper_util.refresh_auth_token_cache(), 1)
+            self.assertEqual(wrapper_util._warm_token_records[token_digest("warm_token_0")][:2], (1, 5))
+            updated_at = _updated_at("warm_token_0")
+
+            response = send_request(self.client, "/health", "get", {}, request_token="warm_token_0")
+            self.assertEqual(response.status_code, 200)
+
+            # Only the changes of the desc and limits mark a row as changed, not the call counts.
+            self.assertEqual(_updated_at("warm_token_0"), updated_at)
+
+            change_time = time.time()
+            wrapper_util.add_auth_token("warm_token_0", None, call_count_limit=6)
+            self.assertGreaterEqual(_updated_at("warm_token_0"), change_time)
+
+            # Removed tokens are dropped from the warm records.
+            wrapper_util.remove_auth_token("warm_token_1")
+            response = send_request(self.client, "/health", "get", {}, request_token="warm_token_1")
+            self.assertEqual(response.status_code, 403)
+
+            self.assertGreater(wrapper_util._auth_token_cache_hit_ratio(), 0.0)
+        finally:
+            wrapper_util.configure_auth_token_cache(ttl=None)
+            wrapper_util.invalidate_auth_token_cache()
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_early_rejection(self):
+        print("Rest HTTP test_early_rejection:")
+        start_time = time.time()
+
+        wrapper_util.configure_negative_auth_token_cache(ttl=60.0)
+        wrapper_util.enable_valid_token_filter(refresh_interval=3600.0)
+
+        try:
+            # Unknown tokens are rejected by the filter.
+            response = send_request(self.client, "/health", "get", {}, request_token="garbage_token")
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(wrapper_util._early_rejection_reason("garbage_token"), 'filter')
+
+            # Tokens added by this process pass the filter immediately.
+            wrapper_util.add_auth_token("new_token", "New token.")
+            response = send_request(self.client, "/health", "get", {}, request_token="new_token")
+            self.assertEqual(response.status_code, 200)
+
+            wrapper_util.disable_valid_token_filter()
+
+            # A token found invalid in the DB is remembered by the negative cache ...
+            response = send_request(self.client, "/health", "get", {}, request_token="garbage_token")
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(wrapper_util._early_rejection_reason("garbage_token"), 'negative_cache')
+
+            # ... but not a token that only exceeded its limit.
+            wrapper_util.add_auth_token("limited_token", "Limited token.", call_count_limit=0)
+            response = send_request(self.client, "/health", "get", {}, request_token="limited_token")
+            self.assertEqual(response.status_code, 403)
+            self.assertIsNone(wrapper_util._early_rejection_reason("limited_token"))
+
+            # Adding the token clears it from the negative cache.
+            wrapper_util.add_auth_token("garbage_token", "No longer garbage.")
+            response = send_request(self.client, "/health", "get", {}, request_token="garbage_token")
+            self.assertEqual(response.status_code, 200)
+        finally:
+            wrapper_util.disable_valid_token_filter()
+            wrapper_util.configure_negative_auth_token_cache(ttl=None)
+
+        print('time = ' + str(time.time() - start_time))
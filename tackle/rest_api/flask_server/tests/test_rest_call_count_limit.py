@@ -0,0 +1,206 @@
+# import unittest
+import os
+import time
+import tempfile
+from unittest import mock
+
+from tackle.rest_api.flask_server.tests import BaseTestCase, send_request, testing_api_key, auth_token_details
+from tackle.rest_api import get_path
+from tackle.rest_api import wrapper_util
+
+
+@wrapper_util.lock_decorator(policy=wrapper_util.NO_LOCK)
+@wrapper_util.auth_decorator
+@wrapper_util.offload_decorator(pool='test')
+def offloaded_call(auth_token: str, caller_name, text: str, fail: bool = False):
+    if fail:
+        raise ValueError("Failed in the worker!")
+
+    return 200, {'length': len(text), 'pid': os.getpid()}
+
+
+# @unittest.skip("skipping during dev")
+class TestRestCallCountLimit(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        BaseTestCase.__init__(self,
+                              *args,
+                              specification_dir=get_path() + '/flask_server/swagger/',
+                              requested_logging_path="~/.tackle/logs",
+                              **kwargs)
+
+    def test_call_count_limit(self):
+        print("Rest HTTP test_call_count_limit:")
+        start_time = time.time()
+
+        wrapper_util.add_auth_token(testing_api_key, "Test API key.", call_count_limit=2)
+
+        response = send_request(self.client, "/health", "get", {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('X-RateLimit-Remaining'), '1')
+
+        response = send_request(self.client, "/health", "get", {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('X-RateLimit-Remaining'), '0')
+
+        # The limit is reached; the call is refused and not charged.
+        response = send_request(self.client, "/health", "get", {})
+        self.assertEqual(response.status_code, 403)
+
+        details = auth_token_details(testing_api_key)
+        self.assertEqual(details['call_count'], 2)
+        self.assertEqual(details['call_count_breakdown'], {'get_status': 2})
+
+        response = send_request(self.client, "/health", "get", {}, request_token="not_a_valid_token")
+        self.assertEqual(response.status_code, 403)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_failed_call_releases_units(self):
+        print("Rest HTTP test_failed_call_releases_units:")
+        start_time = time.time()
+
+        @wrapper_util.auth_decorator
+        def failing_call(auth_token: str, caller_name=None):
+            return 500, {"error_detail": "Failed!"}
+
+        self.assertEqual(failing_call(auth_token=testing_api_key)[0], 500)
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], 0)
+
+        @wrapper_util.auth_decorator
+        def raising_call(auth_token: str, caller_name=None):
+            raise ValueError("Failed in the call!")
+
+        # A failure to release the units doesn't mask the exception of the call.
+        with mock.patch.object(wrapper_util, 'release_auth_token_units', side_effect=RuntimeError("DB down!")):
+            with self.assertRaises(ValueError):
+                raising_call(auth_token=testing_api_key)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_rate_limit(self):
+        print("Rest HTTP test_rate_limit:")
+        start_time = time.time()
+
+        wrapper_util.add_auth_token(testing_api_key, "Test API key.", rate_limit_per_sec=2.0)
+
+        for _ in range(2):
+            response = send_request(self.client, "/health", "get", {})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers.get('X-RateLimit-Limit'), '2')
+
+        # The rate limit is reached; the call is refused without charging call units.
+        response = send_request(self.client, "/health", "get", {})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers.get('X-RateLimit-Remaining'), '0')
+        self.assertEqual(response.headers.get('Retry-After'), '1')
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], 2)
+
+        # A limit of 0 blocks the token's calls.
+        wrapper_util.add_auth_token(testing_api_key, "Test API key.", units_limit_per_min=0)
+        response = send_request(self.client, "/health", "get", {})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers.get('X-RateLimit-Limit'), '0')
+        self.assertEqual(response.headers.get('Retry-After'), '60')
+
+        # The limits are kept unless passed.
+        wrapper_util.add_auth_token(testing_api_key, "Updated desc.")
+        self.assertEqual(auth_token_details(testing_api_key)['units_limit_per_min'], 0)
+        self.assertEqual(send_request(self.client, "/health", "get", {}).status_code, 429)
+
+        wrapper_util.add_auth_token(testing_api_key, None, rate_limit_per_sec=None, units_limit_per_min=None)
+        self.assertIsNone(auth_token_details(testing_api_key)['units_limit_per_min'])
+        self.assertEqual(send_request(self.client, "/health", "get", {}).status_code, 200)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_shared_counter_store(self):
+        print("Rest HTTP test_shared_counter_store:")
+        start_time = time.time()
+
+        wrapper_util.add_auth_token(testing_api_key, "Test API key.", call_count_limit=2)
+        wrapper_util.enable_shared_counter_store(path=os.path.join(tempfile.mkdtemp(), 'shared_counters'),
+                                                 flush_interval=3600.0)
+
+        try:
+            for _ in range(2):
+                response = send_request(self.client, "/health", "get", {})
+                self.assertEqual(response.status_code, 200)
+
+            response = send_request(self.client, "/health", "get", {})
+            self.assertEqual(response.status_code, 403)
+        finally:
+            wrapper_util.disable_shared_counter_store()  # Flushes the units to the DB.
+
+        self.assertEqual(auth_token_details(testing_api_key)['call_count_breakdown'], {'get_status': 2})
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_sharded_call_counts(self):
+        print("Rest HTTP test_sharded_call_counts:")
+        start_time = time.time()
+
+        wrapper_util.add_auth_token(testing_api_key, "Test API key.", call_count_limit=3)
+        wrapper_util.enable_sharded_call_counts(num_shards=4, compaction_interval=3600.0)
+
+        try:
+            # The sharded reservation also configures the default tokens first.
+            setattr(wrapper_util, '__default_auth_tokens_configured', False)
+
+            with mock.patch.object(wrapper_util, 'add_default_auth_tokens') as add_default_auth_tokens:
+                self.assertTrue(wrapper_util.reserve_auth_token_units(testing_api_key, 0))
+                add_default_auth_tokens.assert_called_once_with()
+
+            for _ in range(3):
+                response = send_request(self.client, "/health", "get", {})
+                self.assertEqual(response.status_code, 200)
+
+            # The limit check sums the shards.
+            response = send_request(self.client, "/health", "get", {})
+            self.assertEqual(response.status_code, 403)
+
+            details = auth_token_details(testing_api_key)
+            self.assertEqual(details['call_count'], 3)
+            self.assertEqual(details['call_count_breakdown'], {'get_status': 3})
+
+            self.assertGreater(wrapper_util.compact_call_count_shards(), 0)
+            self.assertEqual(wrapper_util.compact_call_count_shards(), 0)
+        finally:
+            wrapper_util.disable_sharded_call_counts()
+
+        # The compaction folded the shards into the token and breakdown rows.
+        details = auth_token_details(testing_api_key)
+        self.assertEqual(details['call_count'], 3)
+        self.assertEqual(details['call_count_breakdown'], {'get_status': 3})
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_offloaded_call_count(self):
+        print("Rest HTTP test_offloaded_call_count:")
+        start_time = time.time()
+
+        wrapper_util.create_worker_pool('test', max_workers=1)
+
+        try:
+            # Runs in the worker process; charged (one unit per 100 chars of text) in the web process.
+            response_code, response_json = offloaded_call(auth_token=testing_api_key, caller_name=None, text='x' * 250)
+            self.assertEqual(response_code, 200)
+            self.assertEqual(response_json['length'], 250)
+            self.assertNotEqual(response_json['pid'], os.getpid())
+            self.assertEqual(auth_token_details(testing_api_key)['call_count'], 3)
+
+            # The units reserved for a call that raises in the worker are released.
+            with self.assertRaises(ValueError):
+                offloaded_call(auth_token=testing_api_key, caller_name=None, text='x', fail=True)
+
+            self.assertEqual(auth_token_details(testing_api_key)['call_count'], 3)
+
+            response_code, _ = offloaded_call(auth_token="not_a_valid_token", caller_name=None, text='x')
+            self.assertEqual(response_code, 403)
+        finally:
+            wrapper_util.shutdown_worker_pools()
+
+        # Without the pool the function runs in-process.
+        response_code, response_json = offloaded_call(auth_token=testing_api_key, caller_name=None, text='x')
+        self.assertEqual(response_json['pid'], os.getpid())
+
+        print('time = ' + str(time.time() - start_time))
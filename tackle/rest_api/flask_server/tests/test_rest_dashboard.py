@@ -1,7 +1,10 @@
 # import unittest
 import time
 
-from tackle.rest_api.flask_server.tests import BaseTestCase, send_request_check_response
+from tackle.rest_api.flask_server.tests import BaseTestCase, send_request_check_response, send_request, testing_api_key, \
+    auth_token_details
+from tackle.rest_api import wrapper_util
+from tackle.rest_api.flask_server.controllers import controller_util
 from tackle import __version__ as tackle_version
 from tackle.rest_api import get_path
 
@@ -32,3 +35,75 @@ class TestRestDashboard(BaseTestCase):
         self.assertTrue(response_check)
 
         print('time = ' + str(time.time() - start_time))
+
+    def test_dashboard_with_params(self):
+        print("Rest HTTP test_dashboard_with_params:")
+        start_time = time.time()
+
+        # The body preview logged before the request mustn't consume the body for the controller.
+        response_check = send_request_check_response(self.client, "/dashboard", "post",
+                                                     {'show_data_objects': False, 'history_size': 10,
+                                                      'padding': 'x' * 200},
+                                                     200,
+                                                     {
+                                                         'api_version': tackle_version,
+                                                         'service_name': 'tackle Service'
+                                                     },
+                                                     treat_list_as_set=True)
+
+        self.assertTrue(response_check)
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_dashboard_response_cache(self):
+        print("Rest HTTP test_dashboard_response_cache:")
+        start_time = time.time()
+
+        response = send_request(self.client, "/dashboard", "get", {})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers.get('ETag')
+        self.assertIsNotNone(etag)
+
+        # Served from the response cache; still charged.
+        response = send_request(self.client, "/dashboard", "get", {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('ETag'), etag)
+        self.assertEqual(response.json['service_name'], 'tackle Service')
+        self.assertEqual(auth_token_details(testing_api_key)['call_count_breakdown'], {'get_details': 2})
+
+        # Conditional GET; by default a 304 doesn't consume call units.
+        def conditional_get():
+            return self.client.open("/dashboard", method="GET",
+                                    headers={"X-Auth-Token": testing_api_key, "If-None-Match": etag})
+
+        response = conditional_get()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], 2)
+
+        # ... but still validates the token and applies its rate limits.
+        wrapper_util.add_auth_token(testing_api_key, None, call_count_limit=None, rate_limit_per_sec=1.0)
+        self.assertEqual(conditional_get().status_code, 304)
+        self.assertEqual(conditional_get().status_code, 429)
+
+        wrapper_util.add_auth_token(testing_api_key, None, call_count_limit=2, rate_limit_per_sec=None)
+        self.assertEqual(conditional_get().status_code, 403)
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], 2)
+
+        # A cached response is charged like the call it was cached from: its call units, to the wrapper's endpoint.
+        wrapper_util.add_auth_token(testing_api_key, None, call_count_limit=None)
+
+        with self.app.test_request_context():
+            call_count = auth_token_details(testing_api_key)['call_count']
+            response_code, _ = controller_util._charge_cached_call([('summarise', 3)], testing_api_key, None)
+            self.assertEqual(response_code, 200)
+
+        details = auth_token_details(testing_api_key)
+        self.assertEqual(details['call_count'], call_count + 3)
+        self.assertEqual(details['call_count_breakdown']['summarise'], 3)
+
+        # The cached responses are per auth token.
+        response = send_request(self.client, "/dashboard", "get", {}, request_token="not_a_valid_token")
+        self.assertEqual(response.status_code, 403)
+
+        print('time = ' + str(time.time() - start_time))
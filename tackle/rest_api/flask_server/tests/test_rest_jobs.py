@@ -0,0 +1,125 @@
+# import unittest
+import time
+import json
+from typing import Optional
+
+from tackle.rest_api.flask_server.tests import BaseTestCase, send_request, testing_api_key, auth_token_details
+from tackle.rest_api import wrapper_util
+from tackle.rest_api import get_path
+from tackle import __version__ as tackle_version
+
+
+@wrapper_util.job_decorator(policy=wrapper_util.NO_LOCK)
+def failing_job(auth_token: str, caller_name: Optional[str]):
+    raise ValueError("Failed in the job!")
+
+
+@wrapper_util.job_decorator(policy=wrapper_util.NO_LOCK)
+def unencodable_job(auth_token: str, caller_name: Optional[str]):
+    return 200, {'value': object()}
+
+
+def _wait_for_jobs(timeout: float = 5.0):
+    """ Wait for the queued jobs to complete. Avoids polling the in-memory test DB while a job thread uses it. """
+    end_time = time.time() + timeout
+
+    while wrapper_util._job_details["pending"] > 0 and time.time() < end_time:
+        time.sleep(0.01)
+
+
+# @unittest.skip("skipping during dev")
+class TestRestJobs(BaseTestCase):
+    def __init__(self, *args, **kwargs):
+        BaseTestCase.__init__(self,
+                              *args,
+                              specification_dir=get_path() + '/flask_server/swagger/',
+                              requested_logging_path="~/.tackle/logs",
+                              **kwargs)
+
+    def tearDown(self):
+        _wait_for_jobs()
+        wrapper_util.configure_jobs()
+        BaseTestCase.tearDown(self)
+
+    def test_job(self):
+        print("Rest HTTP test_job:")
+        start_time = time.time()
+
+        response = send_request(self.client, "/dashboard/jobs", "post", {})
+        self.assertEqual(response.status_code, 202)
+
+        job_id = json.loads(response.data)['job_id']
+        self.assertEqual(response.headers.get('Location'), '/jobs/' + job_id)
+
+        _wait_for_jobs()
+
+        response = send_request(self.client, "/jobs/" + job_id, "get", {})
+        self.assertEqual(response.status_code, 200)
+
+        job = json.loads(response.data)
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['response_code'], 200)
+        self.assertEqual(job['result']['api_version'], tackle_version)
+
+        # Charged once the job succeeded; the submission and the polls aren't charged.
+        details = auth_token_details(testing_api_key)
+        self.assertEqual(details['call_count'], 1)
+        self.assertEqual(details['call_count_breakdown'], {'get_details_job': 1})
+
+        # Only visible to the token that queued it.
+        wrapper_util.add_auth_token("another_token", "Another token.")
+        response = send_request(self.client, "/jobs/" + job_id, "get", {}, request_token="another_token")
+        self.assertEqual(response.status_code, 404)
+
+        response = send_request(self.client, "/dashboard/jobs", "post", {}, request_token="not_a_valid_token")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(wrapper_util._job_details["pending"], 0)  # The rejected job's pending slot is freed.
+
+        print('time = ' + str(time.time() - start_time))
+
+    def test_failed_and_expired_jobs(self):
+        print("Rest HTTP test_failed_and_expired_jobs:")
+        start_time = time.time()
+
+        wrapper_util.configure_jobs(result_ttl=60.0)
+
+        response_code, response_json = failing_job(auth_token=testing_api_key, caller_name=None)
+        self.assertEqual(response_code, 202)
+
+        _wait_for_jobs()
+
+        job = wrapper_util.get_job(testing_api_key, response_json['job_id'])
+        assert job is not None
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['response_code'], 500)
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], 0)
+
+        # A result that can't be stored fails the job and isn't charged.
+        response_code, response_json = unencodable_job(auth_token=testing_api_key, caller_name=None)
+        self.assertEqual(response_code, 202)
+
+        _wait_for_jobs()
+
+        job = wrapper_util.get_job(testing_api_key, response_json['job_id'])
+        assert job is not None
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['response_code'], 500)
+        self.assertEqual(auth_token_details(testing_api_key)['call_count'], 0)
+
+        # The completed jobs are deleted once their result TTL has passed.
+        self.assertEqual(wrapper_util.delete_expired_jobs(), 0)
+
+        wrapper_util.configure_jobs(result_ttl=0.0)
+        response_code, response_json = failing_job(auth_token=testing_api_key, caller_name=None)
+        _wait_for_jobs()
+
+        self.assertIsNone(wrapper_util.get_job(testing_api_key, response_json['job_id']))
+        self.assertEqual(wrapper_util.delete_expired_jobs(), 1)
+
+        # Jobs beyond the max pending jobs are rejected.
+        wrapper_util.configure_jobs(max_pending=0)
+        response = send_request(self.client, "/dashboard/jobs", "post", {})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(wrapper_util._job_details["pending"], 0)
+
+        print('time = ' + str(time.time() - start_time))
@@ -8,7 +8,7 @@ import logging
 from tackle.rest_api import wrapper_util
 
 
-@wrapper_util.lock_decorator
+@wrapper_util.lock_decorator(policy=wrapper_util.NO_LOCK)  # Re-entrant; no need to queue behind the engine.
 @wrapper_util.auth_decorator
 def get_status(auth_token: str, caller_name: Optional[str]) -> Tuple[int, wrapper_util.JSONType]:
     logging.info(f"health_wrapper.health_get_status: Checking ...")
@@ -0,0 +1,20 @@
+"""
+Wrapper of tackle's job Python API in HTTP API.
+"""
+
+from typing import Tuple, Optional  # noqa # pylint: disable=unused-import
+
+from tackle.rest_api import wrapper_util
+
+
+@wrapper_util.lock_decorator(policy=wrapper_util.NO_LOCK)  # Re-entrant; no need to queue behind the engine.
+def get_job(auth_token: str,
+            caller_name: Optional[str],
+            job_id: str) -> Tuple[int, wrapper_util.JSONType]:
+    """ The status and, once completed, the result of a job queued with the auth token. Polls aren't charged. """
+    job = None if auth_token is None else wrapper_util.get_job(auth_token, job_id)
+
+    if job is None:
+        return 404, {"error_detail": "Job not found!"}
+
+    return 200, job
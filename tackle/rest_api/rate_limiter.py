@@ -0,0 +1,192 @@
+import time
+import threading
+from typing import Dict, List, Optional, NamedTuple  # noqa # pylint: disable=unused-import
+
+# The retry-after (in seconds) of the calls rejected by a limit of 0 i.e. a bucket that's never refilled.
+BLOCKED_RETRY_AFTER = 60.0
+
+
+class TokenBucket(object):
+    """
+    Token bucket of 'capacity' tokens refilled at 'rate' tokens per second. An amount larger than the capacity is admitted
+    when the bucket is full and then leaves the bucket in debt. A bucket with a rate of 0 admits nothing. Not thread-safe;
+    see RateLimiter.
+    """
+    __slots__ = ('capacity', 'rate', 'tokens', 'last_time')
+
+    def __init__(self, capacity: float, rate: float, now: float) -> None:
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.last_time = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def wait_time(self, amount: float) -> float:
+        """ The time (in seconds) until amount can be consumed. 0.0 if it can be consumed now. Call refill(...) first. """
+        if self.rate <= 0.0:
+            return BLOCKED_RETRY_AFTER
+
+        required = min(amount, self.capacity)
+        return 0.0 if self.tokens >= required else (required - self.tokens) / self.rate
+
+    def reset_time(self) -> float:
+        """ The time (in seconds) until the bucket is full again. Call refill(...) first. """
+        return 0.0 if self.tokens >= self.capacity else (self.capacity - self.tokens) / self.rate
+
+    def fill(self) -> float:
+        """ The fraction of the capacity left. Call refill(...) first. """
+        return self.tokens / self.capacity if self.capacity > 0.0 else 0.0
+
+
+RateLimitStatus = NamedTuple('RateLimitStatus', [('limit', int),  # The capacity of the most depleted bucket.
+                                                 ('remaining', int),  # The tokens remaining in that bucket.
+                                                 ('reset', float),  # Seconds until that bucket is full again.
+                                                 ('retry_after', float)])  # Seconds until the last rejected call may be retried.
+
+
+class RateLimiter(object):
+    """
+    Thread-safe in-process rate limiter of auth tokens. Each token may have a requests/sec and a units/min limit which are
+    enforced with token buckets without any DB access. In a multi-process deployment each process enforces its
+    worker_share of the limits; see wrapper_util.enable_rate_limit_reconciliation(...).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._limits = {}  # type: Dict[str, tuple]  # auth_token -> (requests_per_sec, units_per_min)
+        self._buckets = {}  # type: Dict[str, List[TokenBucket]]
+        self._retry_times = {}  # type: Dict[str, float]  # auth_token -> time from which a rejected call may be retried.
+        self.worker_share = 1.0
+
+    def _create_buckets(self, requests_per_sec: Optional[float], units_per_min: Optional[int], now: float) -> List[TokenBucket]:
+        buckets = []  # type: List[TokenBucket]
+
+        # A limit of 0 (or less) gives an empty bucket that's never refilled i.e. the token's calls are always rejected.
+        if requests_per_sec is not None:
+            rate = max(requests_per_sec * self.worker_share, 0.0)
+            buckets.append(TokenBucket(max(rate, 1.0) if rate > 0.0 else 0.0, rate, now))  # Allow a burst of one second's requests.
+
+        if units_per_min is not None:
+            rate = max(units_per_min * self.worker_share / 60.0, 0.0)
+            buckets.append(TokenBucket(max(rate * 60.0, 1.0) if rate > 0.0 else 0.0, rate, now))
+
+        return buckets
+
+    def set_limits(self, auth_token: str,
+                   requests_per_sec: Optional[float],
+                   units_per_min: Optional[int]) -> None:
+        """ Set the rate limits of an auth token. 'None' for no limit. The token's buckets are kept if unchanged. """
+        limits = (requests_per_sec, units_per_min)
+
+        with self._lock:
+            if self._limits.get(auth_token) == limits:
+                return
+
+            if (requests_per_sec is None) and (units_per_min is None):
+                self._forget(auth_token)
+            else:
+                self._limits[auth_token] = limits
+                self._buckets[auth_token] = self._create_buckets(requests_per_sec, units_per_min, time.time())
+
+    def configure_worker_share(self, worker_share: float) -> None:
+        """ Set the share of the rate limits enforced by this process e.g. 1/(number of worker processes). """
+        with self._lock:
+            if worker_share == self.worker_share:
+                return
+
+            self.worker_share = worker_share
+            now = time.time()
+
+            for auth_token, (requests_per_sec, units_per_min) in self._limits.items():
+                self._buckets[auth_token] = self._create_buckets(requests_per_sec, units_per_min, now)
+
+    def _forget(self, auth_token: str) -> None:
+        self._limits.pop(auth_token, None)
+        self._buckets.pop(auth_token, None)
+        self._retry_times.pop(auth_token, None)
+
+    def forget(self, auth_token: str) -> None:
+        """ Remove the rate limits of an auth token e.g. when the token is removed. """
+        with self._lock:
+            self._forget(auth_token)
+
+    def tracked_tokens(self) -> List[str]:
+        with self._lock:
+            return list(self._limits.keys())
+
+    def acquire(self, auth_token: str, units: int) -> float:
+        """
+        Admit a call of units if the token's buckets allow it.
+
+        :return: 0.0 if the call was admitted, else the time (in seconds) after which the call may be retried.
+        """
+        with self._lock:
+            buckets = self._buckets.get(auth_token)
+
+            if not buckets:
+                return 0.0
+
+            now = time.time()
+            wait_time = 0.0
+
+            for bucket, amount in zip(buckets, self._amounts(auth_token, units)):
+                bucket.refill(now)
+                wait_time = max(wait_time, bucket.wait_time(amount))
+
+            if wait_time > 0.0:
+                self._retry_times[auth_token] = now + wait_time
+                return wait_time
+
+            for bucket, amount in zip(buckets, self._amounts(auth_token, units)):
+                bucket.tokens -= amount
+
+            return 0.0
+
+    def refund(self, auth_token: str, units: int) -> None:
+        """
+        Return the units of an admitted call that wasn't charged (e.g. rejected by the DB validation or unsuccessful) to
+        the token's units/min bucket. The call still counts towards the requests/sec limit.
+        """
+        with self._lock:
+            limits = self._limits.get(auth_token)
+
+            if (limits is None) or (limits[1] is None):
+                return
+
+            bucket = self._buckets[auth_token][-1]  # The units/min bucket is the last one; see _create_buckets(...).
+            bucket.tokens = min(bucket.capacity, bucket.tokens + units)
+
+    def _amounts(self, auth_token: str, units: int) -> List[float]:
+        """ The amount a call of units takes from each of the token's buckets. """
+        requests_per_sec, units_per_min = self._limits[auth_token]
+        amounts = []  # type: List[float]
+
+        if requests_per_sec is not None:
+            amounts.append(1.0)
+        if units_per_min is not None:
+            amounts.append(float(units))
+
+        return amounts
+
+    def status(self, auth_token: str) -> Optional[RateLimitStatus]:
+        """ The state of the token's most depleted bucket. None if the token has no rate limits. """
+        with self._lock:
+            buckets = self._buckets.get(auth_token)
+
+            if not buckets:
+                return None
+
+            now = time.time()
+
+            for bucket in buckets:
+                bucket.refill(now)
+
+            bucket = min(buckets, key=lambda b: b.fill())
+
+            return RateLimitStatus(limit=int(bucket.capacity),
+                                   remaining=max(int(bucket.tokens), 0),
+                                   reset=bucket.reset_time(),
+                                   retry_after=max(self._retry_times.get(auth_token, now) - now, 0.0))
@@ -0,0 +1,403 @@
+import os
+import time
+import fcntl
+import mmap
+import struct
+import hashlib
+import threading
+from typing import Dict, List, Tuple, Optional, Any  # noqa # pylint: disable=unused-import
+
+from tackle.db_models import TOKEN_DIGEST_SIZE
+
+# File layout: A header followed by num_slots fixed size slots of an open addressing (linear probing) hash table. A key is
+# kept within MAX_PROBES slots of its home slot. Slots without units to flush are freed (tombstoned) when idle (see
+# sweep(...)) or evicted when a new key finds no free slot in its probe window; their tokens are then reloaded from the DB.
+_HEADER = struct.Struct('<8sQ')  # magic, num_slots
+_MAGIC = b'TACKLE02'
+
+# Slot: key hash (0 if empty, 1 if freed), key length, key, 4 x int64 fields, float64 time. The keys hold the token
+# digests (see db_models.token_digest), never the tokens themselves.
+KEY_SIZE = 128
+_SLOT = struct.Struct(f'<QH{KEY_SIZE}sqqqqd')
+SLOT_SIZE = 192  # _SLOT.size rounded up.
+
+_EMPTY = 0
+_TOMBSTONE = 1
+
+# The max number of slots probed for a key.
+MAX_PROBES = 32
+
+# Token slots: f0 = call count, f1 = call count limit (-1 for none), f2 = units not yet flushed to the DB, t = load time.
+# Breakdown slots: f0 = units pending for the next flush, t = last update time.
+_TOKEN_PREFIX = b'T'
+_BREAKDOWN_PREFIX = b'B'
+
+DigestCallCountKey = Tuple[bytes, Optional[str]]  # (key_digest, endpoint)
+
+
+class SharedCounterStore(object):
+    """
+    Call count and call count limit store shared by the processes (e.g. pre-forked gunicorn workers) of a host through an
+    mmap'd file. Updates of a slot are atomic across processes (a POSIX record lock on the slot) and across the threads of
+    a process (a process local lock). Claiming and freeing slots is serialised by a lock on the header. Units charged to a
+    token are held as pending per (key_digest, endpoint) until they are taken by the (elected) flusher and written to the
+    DB. The tokens are identified by their digests.
+    """
+
+    def __init__(self, path: str, num_slots: int = 16384) -> None:
+        """
+        :param path: The path of the shared file. All processes using the same path share the counters.
+        :param num_slots: The number of slots; used if the file doesn't exist yet. Each token uses one slot plus one per
+                          endpoint it is charged to.
+        """
+        self.path = path
+        self._thread_lock = threading.Lock()  # POSIX record locks don't exclude the threads of the same process.
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER.size, 0)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+
+            if len(header) == _HEADER.size and header[:len(_MAGIC)] == _MAGIC:
+                self.num_slots = _HEADER.unpack(header)[1]
+            else:
+                # New file or the layout of an older version: Start from zeroed (empty) slots.
+                self.num_slots = num_slots
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, SLOT_SIZE + num_slots * SLOT_SIZE)  # The first slot sized block is the header.
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, num_slots), 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER.size, 0)
+
+        self._mmap = mmap.mmap(self._fd, SLOT_SIZE + self.num_slots * SLOT_SIZE)
+
+        self._flusher_fd = None  # type: Optional[int]
+        self._flusher_pid = None  # type: Optional[int]
+
+    def close(self) -> None:
+        self._mmap.close()
+        os.close(self._fd)
+
+        if self._flusher_fd is not None:
+            os.close(self._flusher_fd)
+            self._flusher_fd = None
+
+    # =============================
+    # Slot access. The caller holds self._thread_lock.
+    def _offset(self, slot: int) -> int:
+        return SLOT_SIZE + slot * SLOT_SIZE
+
+    def _lock_slot(self, slot: int) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT_SIZE, self._offset(slot))
+
+    def _unlock_slot(self, slot: int) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE, self._offset(slot))
+
+    def _lock_claims(self) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER.size, 0)
+
+    def _unlock_claims(self) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER.size, 0)
+
+    def _read_slot(self, slot: int) -> tuple:
+        return _SLOT.unpack_from(self._mmap, self._offset(slot))
+
+    def _write_fields(self, slot: int, key_hash: int, key: bytes, f0: int, f1: int, f2: int, f3: int, t: float) -> None:
+        _SLOT.pack_into(self._mmap, self._offset(slot), key_hash, len(key), key, f0, f1, f2, f3, t)
+
+    def _free_slot(self, slot: int) -> None:
+        self._write_fields(slot, _TOMBSTONE, b'', 0, -1, 0, 0, 0.0)
+
+    @staticmethod
+    def _key_hash(key: bytes) -> int:
+        key_hash = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+        return key_hash if key_hash > _TOMBSTONE else key_hash + 2
+
+    def _probe_slots(self, key_hash: int) -> List[int]:
+        start_slot = key_hash % self.num_slots
+        return [(start_slot + probe) % self.num_slots for probe in range(min(MAX_PROBES, self.num_slots))]
+
+    @staticmethod
+    def _is_reclaimable(key: bytes, f0: int, f2: int) -> bool:
+        """ True if freeing the slot loses nothing: A token slot without unflushed units or an empty breakdown slot. """
+        return (f2 == 0) if key[:1] == _TOKEN_PREFIX else (f0 == 0)
+
+    def _find_slot(self, key: bytes, key_hash: int) -> int:
+        """ The slot of the key without taking any lock. Verify under the slot's lock. -1 if not found. """
+        for slot in self._probe_slots(key_hash):
+            slot_hash, key_len, slot_key = self._read_slot(slot)[:3]
+
+            if slot_hash == key_hash and slot_key[:key_len] == key:
+                return slot
+            elif slot_hash == _EMPTY:
+                return -1
+
+        return -1
+
+    def _find_and_lock_slot(self, key: bytes, create: bool) -> int:
+        """
+        Find (or claim if create) the slot of a key and lock it. The lookup of an existing (or missing) key locks at most
+        the one slot found; only claiming a slot takes the claim lock.
+
+        :return: The locked slot. -1 if not found (or no slot could be claimed).
+        """
+        if len(key) > KEY_SIZE:
+            return -1
+
+        key_hash = self._key_hash(key)
+
+        for _ in range(3):
+            slot = self._find_slot(key, key_hash)
+
+            if slot < 0:
+                break
+
+            self._lock_slot(slot)
+            slot_hash, key_len, slot_key = self._read_slot(slot)[:3]
+
+            if slot_hash == key_hash and slot_key[:key_len] == key:
+                return slot
+
+            self._unlock_slot(slot)  # Freed in the meantime; look again.
+
+        return self._claim_and_lock_slot(key, key_hash) if create else -1
+
+    def _claim_and_lock_slot(self, key: bytes, key_hash: int) -> int:
+        """
+        Find or claim the slot of a key under the claim lock and lock it. Claims the first free slot of the probe window,
+        else evicts the least recently loaded/updated reclaimable slot of the window.
+
+        :return: The locked slot. -1 if the probe window holds no free or reclaimable slot.
+        """
+        self._lock_claims()
+        try:
+            free_slot = -1
+            reclaimable = []  # type: List[Tuple[float, int]]  # (time, slot)
+
+            for slot in self._probe_slots(key_hash):
+                slot_hash, key_len, slot_key, f0, _, f2, _, t = self._read_slot(slot)
+
+                if slot_hash == key_hash and slot_key[:key_len] == key:
+                    self._lock_slot(slot)  # Claimed by another thread or process since the lookup.
+                    return slot
+                elif slot_hash in (_EMPTY, _TOMBSTONE):
+                    if free_slot < 0:
+                        free_slot = slot
+                    if slot_hash == _EMPTY:
+                        break
+                elif self._is_reclaimable(slot_key[:key_len], f0, f2):
+                    reclaimable.append((t, slot))
+
+            candidates = [free_slot] if free_slot >= 0 else [slot for _, slot in sorted(reclaimable)]
+
+            for slot in candidates:
+                self._lock_slot(slot)
+                slot_hash, key_len, slot_key, f0, _, f2, _, _ = self._read_slot(slot)
+
+                # Only claims and frees (under the claim lock) change a slot's key, but units may have been added since.
+                if slot_hash in (_EMPTY, _TOMBSTONE) or self._is_reclaimable(slot_key[:key_len], f0, f2):
+                    self._write_fields(slot, key_hash, key, 0, -1, 0, 0, 0.0)
+                    return slot
+
+                self._unlock_slot(slot)
+
+            return -1
+        finally:
+            self._unlock_claims()
+
+    @staticmethod
+    def _token_key(key_digest: bytes) -> bytes:
+        return _TOKEN_PREFIX + key_digest
+
+    @staticmethod
+    def _breakdown_key(key_digest: bytes, endpoint: Optional[str]) -> bytes:
+        return _BREAKDOWN_PREFIX + key_digest + (endpoint or '').encode('utf-8')
+
+    def _update_slot(self, key: bytes, create: bool, update_fn) -> Any:
+        """ Atomically apply update_fn(fields) -> (new fields, result) to the slot of the key. None if no slot. """
+        with self._thread_lock:
+            slot = self._find_and_lock_slot(key, create)
+
+            if slot < 0:
+                return None
+
+            try:
+                key_hash, _, _, f0, f1, f2, f3, t = self._read_slot(slot)
+                fields, result = update_fn((f0, f1, f2, f3, t))
+
+                if fields is not None:
+                    self._write_fields(slot, key_hash, key, *fields)
+
+                return result
+            finally:
+                self._unlock_slot(slot)
+
+    # =============================
+    def load_token(self, key_digest: bytes, db_call_count: int, call_count_limit: Optional[int], load_time: float) -> bool:
+        """
+        Set the call count of a token from the DB. The units not yet flushed to the DB are added to db_call_count.
+
+        :return: False if the store can't hold the token (no slot could be claimed).
+        """
+        def update(fields):
+            unflushed = fields[2]
+            return (db_call_count + unflushed, -1 if call_count_limit is None else call_count_limit, unflushed, 0,
+                    load_time), True
+
+        return self._update_slot(self._token_key(key_digest), True, update) is not None
+
+    def reserve(self, key_digest: bytes, units: int, min_load_time: float) -> Tuple[Optional[bool], int, Optional[int]]:
+        """
+        Atomically check that call_count + units <= call_count_limit and, if so, charge the units to the token's count.
+
+        :param min_load_time: Records loaded before this time are treated as stale.
+        :return: (reserved, call_count, call_count_limit). reserved is None if the token isn't loaded or is stale.
+        """
+        def update(fields):
+            call_count, call_count_limit, unflushed, f3, load_time = fields
+
+            if load_time <= 0.0 or load_time < min_load_time:
+                return None, (None, 0, None)
+
+            limit = None if call_count_limit < 0 else call_count_limit
+
+            if (limit is None) or (call_count + units <= limit):
+                return (call_count + units, call_count_limit, unflushed + units, f3, load_time), \
+                       (True, call_count + units, limit)
+            else:
+                return None, (False, call_count, limit)
+
+        result = self._update_slot(self._token_key(key_digest), False, update)
+        return (None, 0, None) if result is None else result
+
+    def charge(self, key_digest: bytes, units: int) -> bool:
+        """ Charge the units to the token's count without a limit check. Negative units release a reservation. """
+        def update(fields):
+            call_count, call_count_limit, unflushed, f3, load_time = fields
+            return (call_count + units, call_count_limit, unflushed + units, f3, load_time), True
+
+        return self._update_slot(self._token_key(key_digest), True, update) is not None
+
+    def add_pending(self, key_digest: bytes, endpoint: Optional[str], units: int) -> bool:
+        """ Add units to the pending (to be flushed) units of the token and endpoint. False if the store can't hold them. """
+        update_time = time.time()
+
+        def update(fields):
+            pending, f1, f2, f3, _ = fields
+            return (pending + units, f1, f2, f3, update_time), True
+
+        return self._update_slot(self._breakdown_key(key_digest, endpoint), True, update) is not None
+
+    def invalidate(self, key_digest: bytes, discard_pending: bool = False) -> None:
+        """ Mark the token's record as stale so that it is reloaded from the DB. Optionally drop its pending units. """
+        def update_token(fields):
+            call_count, call_count_limit, unflushed, f3, load_time = fields
+            return (call_count, call_count_limit, 0 if discard_pending else unflushed, f3, 0.0), None
+
+        self._update_slot(self._token_key(key_digest), False, update_token)
+
+        if discard_pending:
+            prefix = self._breakdown_key(key_digest, None)
+            for key in self._keys(_BREAKDOWN_PREFIX):
+                if key.startswith(prefix):
+                    self._update_slot(key, False, lambda fields: ((0,) + tuple(fields[1:]), None))
+
+    def _keys(self, prefix: bytes) -> List[bytes]:
+        """ The keys (with the given type prefix) of all claimed slots. """
+        keys = []  # type: List[bytes]
+
+        with self._thread_lock:
+            for slot in range(self.num_slots):
+                slot_hash, key_len, key = self._read_slot(slot)[:3]
+
+                if slot_hash > _TOMBSTONE and key[:1] == prefix:
+                    keys.append(key[:key_len])
+
+        return keys
+
+    def take_pending(self) -> Dict[DigestCallCountKey, int]:
+        """ Take the pending units of all (key_digest, endpoint) keys e.g. to write them to the DB. """
+        pending = {}  # type: Dict[DigestCallCountKey, int]
+
+        def update(fields):
+            return (0,) + tuple(fields[1:]), fields[0]
+
+        for key in self._keys(_BREAKDOWN_PREFIX):
+            units = self._update_slot(key, False, update)
+
+            if units:
+                key_digest, endpoint = key[1:1 + TOKEN_DIGEST_SIZE], key[1 + TOKEN_DIGEST_SIZE:].decode('utf-8')
+                pending[(key_digest, endpoint or None)] = units
+
+        return pending
+
+    def complete_flush(self, flushed: Dict[DigestCallCountKey, int], success: bool) -> None:
+        """ Mark taken units as written to the DB or, if the write failed, return them to the pending units. """
+        token_units = {}  # type: Dict[bytes, int]
+
+        for (key_digest, endpoint), units in flushed.items():
+            if success:
+                token_units[key_digest] = token_units.get(key_digest, 0) + units
+            else:
+                self.add_pending(key_digest, endpoint, units)
+
+        def update(units):
+            return lambda fields: ((fields[0], fields[1], max(fields[2] - units, 0), fields[3], fields[4]), None)
+
+        for key_digest, units in token_units.items():
+            self._update_slot(self._token_key(key_digest), False, update(units))
+
+    def sweep(self, max_idle: float) -> int:
+        """
+        Free the slots that hold no units to flush and haven't been loaded/updated for max_idle seconds e.g. of removed
+        tokens or of a previous deployment. Their tokens are reloaded from the DB when used again.
+
+        :return: The number of slots freed.
+        """
+        min_time = time.time() - max_idle
+        freed = 0
+
+        with self._thread_lock:
+            self._lock_claims()
+            try:
+                for slot in range(self.num_slots):
+                    slot_hash, key_len, key, f0, _, f2, _, t = self._read_slot(slot)
+
+                    if slot_hash <= _TOMBSTONE or t >= min_time or not self._is_reclaimable(key[:key_len], f0, f2):
+                        continue
+
+                    self._lock_slot(slot)
+                    try:
+                        slot_hash, key_len, key, f0, _, f2, _, t = self._read_slot(slot)
+
+                        if slot_hash > _TOMBSTONE and t < min_time and self._is_reclaimable(key[:key_len], f0, f2):
+                            self._free_slot(slot)
+                            freed += 1
+                    finally:
+                        self._unlock_slot(slot)
+            finally:
+                self._unlock_claims()
+
+        return freed
+
+    def try_become_flusher(self) -> bool:
+        """
+        Try to become (or confirm being) the single flusher process of the store. The election lock is held until the
+        process exits, after which another process takes over.
+        """
+        with self._thread_lock:
+            if self._flusher_pid != os.getpid():  # Opened per process; flock locks are shared with forked children.
+                self._flusher_fd = os.open(self.path + '.flusher', os.O_RDWR | os.O_CREAT, 0o600)
+                self._flusher_pid = os.getpid()
+
+                try:
+                    fcntl.flock(self._flusher_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return True
+                except OSError:
+                    os.close(self._flusher_fd)
+                    self._flusher_pid = None
+                    self._flusher_fd = None
+                    return False
+
+            return True
@@ -0,0 +1,109 @@
+import time
+import pickle
+import importlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple, Optional, Callable, Any  # noqa # pylint: disable=unused-import
+
+from tackle import __pickle_protocol_version__
+from tackle.concurrency_utils import UtilisationTracker
+
+# The functions that may be run by the worker processes by key ('module:qualname'). The decorated module level name of
+# a wrapper function refers to its decorated version, so the workers look up the undecorated function here instead. A
+# worker registers the functions of a module when it imports the module.
+_registered_functions = {}  # type: Dict[str, Callable]
+
+
+def register_function(f: Callable) -> str:
+    """ Register a module level function to be run by the worker processes. Returns its key. """
+    key = f.__module__ + ':' + f.__qualname__
+    _registered_functions[key] = f
+    return key
+
+
+def _run_registered_function(key: str, payload: bytes) -> Tuple[float, float, bytes]:
+    """
+    Run a registered function in a worker process.
+
+    :param payload: The pickled (args, kwargs).
+    :return: (start time, end time, the pickled result)
+    """
+    start_time = time.time()
+
+    f = _registered_functions.get(key)
+
+    if f is None:
+        importlib.import_module(key.split(':', 1)[0])  # Registers the module's functions.
+        f = _registered_functions[key]
+
+    args, kwargs = pickle.loads(payload)
+    result = f(*args, **kwargs)
+
+    return start_time, time.time(), pickle.dumps(result, protocol=__pickle_protocol_version__)
+
+
+class WorkerPool(object):
+    """
+    Pool of persistent worker processes that run CPU bound (registered) functions outside of the web process and its GIL.
+    An optional initializer is run once per worker process e.g. to load an engine or model. The arguments and results are
+    pickled with tackle's pickle protocol. The utilisation of the workers is tracked over a sliding window.
+    """
+
+    def __init__(self, name: str,
+                 max_workers: int,
+                 initializer: Optional[Callable] = None,
+                 initargs: tuple = (),
+                 mp_context=None,
+                 window: float = 60.0) -> None:
+        """
+        :param name: The name of the pool e.g. 'engine'.
+        :param max_workers: The number of worker processes.
+        :param initializer: Optional function called at the start of each worker process.
+        :param mp_context: Optional multiprocessing context e.g. multiprocessing.get_context('spawn').
+        :param window: The length (in seconds) of the sliding window of the utilisation.
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.tracker = UtilisationTracker(window=window, capacity=max_workers)
+
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                                             initializer=initializer, initargs=initargs)
+        self._pending = 0  # The calls submitted and not yet completed.
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        """ The number of calls waiting for a worker. """
+        return max(self._pending - self.max_workers, 0)
+
+    def utilisation(self) -> float:
+        """ The average fraction of the workers busy over the window. """
+        return self.tracker.snapshot()[2]
+
+    def call(self, f: Callable, args: tuple, kwargs: Dict[str, Any]) -> Tuple[Any, float]:
+        """
+        Run f(*args, **kwargs) in a worker process and wait for the result. Exceptions raised by f are re-raised.
+
+        :param f: A function registered with register_function(...).
+        :return: (the result, the time (in seconds) the call waited for a worker)
+        """
+        payload = pickle.dumps((args, kwargs), protocol=__pickle_protocol_version__)
+
+        with self._lock:
+            self._pending += 1
+
+        submit_time = time.time()
+
+        try:
+            start_time, end_time, result = self._executor.submit(_run_registered_function,
+                                                                 f.__module__ + ':' + f.__qualname__, payload).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+        self.tracker.record(start_time, end_time)
+
+        return pickle.loads(result), max(start_time - submit_time, 0.0)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
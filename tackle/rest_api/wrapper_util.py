@@ -1,27 +1,67 @@
 # import psutil
+import os
+import json
 import time
+import uuid
+import atexit
+import asyncio
+import socket
+import tempfile
 import threading
-from typing import List, Dict, Tuple, Any, Optional, Union
+from typing import List, Dict, Tuple, Any, Optional, Union, Callable, Iterable, Iterator, NamedTuple
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 # from inspect import getfullargspec
 # from datetime import datetime
 import logging
 
 from sqlalchemy.orm import load_only
+from sqlalchemy import case, func, literal, or_, select, tuple_
+from flask import current_app, has_app_context, has_request_context, request
 
 from tackle.db_models import APIKeyData
 from tackle.db_models import AdminAPIKeyData
 from tackle.db_models import APICallCountBreakdownData
+from tackle.db_models import APICallCountShardData
+from tackle.db_models import RateLimitWorkerData
+from tackle.db_models import APIJobData
+from tackle.db_models import token_digest
 
 from tackle.flask_utils import db
 from tackle.flask_utils import get_log_filename  # noqa # pylint: disable=unused-import
 
+from tackle.cache_utils import TTLCache, BloomFilter
+from tackle.concurrency_utils import ConcurrencyPolicy, ExclusivePolicy, UtilisationTracker, PeriodicTask
+from tackle.concurrency_utils import SemaphorePolicy, ReadPolicy, WritePolicy, NO_LOCK  # noqa # pylint: disable=unused-import
+from tackle.db_utils import upsert_rows, chunked
+
+from tackle.rest_api.call_count_accumulator import CallCountAccumulator, CallCountKey
+from tackle.rest_api.rate_limiter import RateLimiter
+from tackle.rest_api.shared_counter_store import SharedCounterStore, DigestCallCountKey
+from tackle.rest_api.worker_pool import WorkerPool, register_function
+
 from tackle.prometheus_utils import promths_exec_id
 from tackle.prometheus_utils import promths_wrapper_idle_fraction_gauge
-from tackle.prometheus_utils import promths_request_latency_gauge
-from tackle.prometheus_utils import promths_call_count_gauge_unauthrsd
+from tackle.prometheus_utils import promths_call_count_counter_unauthrsd
 from tackle.prometheus_utils import promths_call_count_gauge_authrsd
-from tackle.prometheus_utils import promths_http_response_gauge
+from tackle.prometheus_utils import promths_http_response_counter
+from tackle.prometheus_utils import promths_call_units_counter
+from tackle.prometheus_utils import promths_call_units_histogrm
+from tackle.prometheus_utils import observe_request_latency
+from tackle.prometheus_utils import bounded_labels, exception_label
+from tackle.prometheus_utils import promths_auth_desc_limiter, promths_caller_name_limiter
+from tackle.prometheus_utils import promths_lock_wait_histogrm
+from tackle.prometheus_utils import export_utilisation_tracker
+from tackle.prometheus_utils import set_gauge_function
+from tackle.prometheus_utils import promths_auth_token_cache_counter
+from tackle.prometheus_utils import promths_auth_token_cache_hit_ratio_gauge
+from tackle.prometheus_utils import promths_auth_token_cache_staleness_gauge
+from tackle.prometheus_utils import promths_early_rejection_counter
+from tackle.prometheus_utils import promths_token_filter_size_gauge
+from tackle.prometheus_utils import promths_token_filter_fp_rate_gauge
+from tackle.prometheus_utils import promths_worker_pool_queue_depth_gauge
+from tackle.prometheus_utils import promths_worker_pool_utilisation_gauge
+from tackle.prometheus_utils import promths_worker_pool_wait_histogrm
 
 JSONType = Union[str, int, float, bool, None, Dict[str, Any], List[Any]]
 
@@ -33,41 +73,101 @@ JSONType = Union[str, int, float, bool, None, Dict[str, Any], List[Any]]
 __default_auth_tokens_configured = False
 
 
-# Lock for access to the single tackle instance defined in wrapper_util. Note: The lock is meant to protect against
-# multi-threaded access and doesn't impact pre-forked multi-process execution!
-
-__wrapper_lock = threading.Lock()
+# Default concurrency policy of lock_decorator: One process wide lock for access to the single tackle instance defined
+# in wrapper_util. Note: The policies are meant to protect against multi-threaded access and don't impact pre-forked
+# multi-process execution!
+default_concurrency_policy = ExclusivePolicy('wrapper')  # type: ConcurrencyPolicy
 
 
 # =============================
-# Cache of API call count and call count limit tuples (call_count, call_count_limit)
-auth_token_call_cache = {}  # type: Dict[str, Tuple[int,Optional[int]]]
-auth_token_desc_cache = {}  # type: Dict[str, str]
-
-last_operation_start_time = 0.0
-last_operation_end_time = 0.0
-
-
-def lock_decorator(f):
+# Cache of API call count and call count limit tuples (call_count, call_count_limit) and of the token descriptions.
+# The caches are bounded (LRU) and, if a TTL is configured, also used to validate tokens without a DB round trip.
+# See configure_auth_token_cache(...).
+auth_token_call_cache = TTLCache(max_size=10000)  # type: TTLCache  # str -> Tuple[int,Optional[int]]
+auth_token_desc_cache = TTLCache(max_size=10000)  # type: TTLCache  # str -> str
+
+# Optional warm store of the token records, preloaded from the DB and kept in sync by a delta refresher. The DB only
+# holds the token digests, so the records are keyed by digest and copied to the above caches on first use of a token.
+# See preload_auth_token_cache(...) and enable_auth_token_cache_refresh(...).
+# digest -> (call_count, call_count_limit, desc, rate_limit_per_sec, units_limit_per_min)
+_warm_token_records = {}  # type: Dict[bytes, tuple]
+_warm_token_keys = {}  # type: Dict[bytes, str]  # digest -> auth token, of the warm records copied to the caches.
+_warm_token_details = {"synced_at": 0.0, "full_synced_at": 0.0, "refresh_interval": 0.0}  # type: Dict
+_warm_token_lock = threading.Lock()
+auth_token_cache_refresher = None  # type: Optional[PeriodicTask]
+
+# Lookups of the auth token cache by result ('hit', 'warm_hit' or 'miss') when validating from the cache.
+_auth_token_cache_lookups = {"hit": 0, "warm_hit": 0, "miss": 0}  # type: Dict[str, int]
+
+# Optional negative cache of the digests of the auth tokens recently found not to exist and optional Bloom filter of the
+# digests of all valid tokens. Both reject unknown tokens without a DB round trip. See
+# configure_negative_auth_token_cache(...) and enable_valid_token_filter(...).
+invalid_auth_token_cache = None  # type: Optional[TTLCache]  # digest -> True
+valid_token_filter = None  # type: Optional[BloomFilter]
+valid_token_filter_refresher = None  # type: Optional[PeriodicTask]
+_valid_token_filter_details = {"synced_at": 0.0, "full_synced_at": 0.0}  # type: Dict
+
+# Optional write-behind accumulator of call counts. See enable_call_count_write_behind(...).
+call_count_accumulator = None  # type: Optional[CallCountAccumulator]
+
+# In-process rate limiter of the per token requests/sec and units/min limits. Optionally reconciled with the other worker
+# processes through the DB. See enable_rate_limit_reconciliation(...).
+rate_limiter = RateLimiter()
+rate_limit_reconciler = None  # type: Optional[PeriodicTask]
+
+# Optional call count store shared by the worker processes of a host. See enable_shared_counter_store(...).
+shared_counter_store = None  # type: Optional[SharedCounterStore]
+shared_counter_flusher = None  # type: Optional[PeriodicTask]
+_shared_counter_details = {"max_age": 5.0, "max_idle": 3600.0}  # type: Dict
+
+# Optional sharded layout of the call count rows. See enable_sharded_call_counts(...).
+_sharded_counter_details = {"num_shards": 0}  # type: Dict  # 0 when the sharded layout is disabled.
+call_count_compactor = None  # type: Optional[PeriodicTask]
+
+# Optional pools of worker processes that run the CPU bound wrapper functions decorated with offload_decorator. See
+# create_worker_pool(...).
+worker_pools = {}  # type: Dict[str, WorkerPool]
+
+# Background executor of the wrapper calls queued as jobs and the periodic cleanup of the expired jobs. See job_decorator,
+# configure_jobs(...) and enable_job_cleanup(...).
+_job_details = {"executor": None, "max_workers": 4, "max_pending": 1000, "pending": 0,
+                "result_ttl": 3600.0, "max_duration": 86400.0}  # type: Dict
+_job_lock = threading.Lock()
+job_cleaner = None  # type: Optional[PeriodicTask]
+
+# Utilisation (in-flight requests, concurrency, saturation & idle fraction) of the service wrapper layer. Configure the
+# sliding window and capacity with wrapper_utilisation_tracker.configure(...).
+wrapper_utilisation_tracker = UtilisationTracker()
+export_utilisation_tracker(wrapper_utilisation_tracker, 'wrapper', promths_wrapper_idle_fraction_gauge)
+
+
+def lock_decorator(f: Optional[Callable] = None,
+                   policy: Optional[ConcurrencyPolicy] = None):
     """
-    Decorator to protect access to the wrapper_util trope instance and its wrapper functions
-    using __trope_engine_wrapper_lock. NOTE: This lock is meant to queue concurrent access to the service wrapper.
+    Decorator to control concurrent access to the wrapper_util tackle instance and its wrapper functions. By default
+    (@lock_decorator) a single process wide lock queues all concurrent access to the service wrapper. A concurrency policy
+    may be given per wrapper function e.g. @lock_decorator(policy=SemaphorePolicy('engine', 4)), ReadPolicy('model'),
+    WritePolicy('model') or NO_LOCK for re-entrant functions. The time spent waiting for the policy is sent to prometheus.
+
+    :param f: The wrapper function when used as @lock_decorator without arguments.
+    :param policy: The concurrency policy. 'None' for the default_concurrency_policy.
     """
+    if f is None:
+        return lambda _f: lock_decorator(_f, policy=policy)
 
     @wraps(f)
     def decorated_f(*args, **kwargs):
-        # pre_lock_time = time.time()
+        active_policy = default_concurrency_policy if policy is None else policy
 
         # Optional param to not acquire a lock if you already might have one AND know what you are doing.
         acquire_lock: bool = kwargs.get('lock_decorator_acquire_lock', True)
 
         if acquire_lock is not False:
-            __wrapper_lock.acquire()
-            # start_time = time.time()
-            # logging.info(f"lock_decorator_nlpe: __nlpe_wrapper_lock acquired in {start_time - pre_lock_time}s")
-        # else:
-        # start_time = time.time()
-        # logging.info(f"lock_decorator_nlpe: __nlpe_wrapper_lock not requested!")
+            pre_lock_time = time.time()
+            active_policy.acquire()
+            promths_lock_wait_histogrm.labels(exec_id=promths_exec_id,
+                                              policy=active_policy.label,
+                                              endpoint=f.__name__).observe(time.time() - pre_lock_time)  # pylint: disable=no-member
 
         try:
             response_code, response_json = f(*args, **kwargs)
@@ -76,18 +176,13 @@ def lock_decorator(f):
 
             logging.exception(f"lock_decorator_trope: Uncaught exception: {e}! caller_name = {caller_name}")
 
-            promths_http_response_gauge.labels(exec_id=promths_exec_id,
-                                               auth_desc=f"[Uncaught exception: {str(e)}]",
-                                               caller_name=caller_name,
-                                               endpoint=f.__name__, status=500).inc()  # pylint: disable=no-member
+            promths_http_response_counter.labels(exec_id=promths_exec_id,
+                                                 auth_desc=exception_label(e),
+                                                 endpoint=f.__name__, status=500).inc()  # pylint: disable=no-member
             raise  # re-raise the uncaught exception.
         finally:  # call release when try block is finished or before uncaught exceptions raised.
             if acquire_lock is not False:
-                __wrapper_lock.release()
-
-            # end_time = time.time()
-            # logging.info(f"lock_decorator_nlpe: __nlpe_wrapper_lock duration = {round(end_time - start_time, 4)}s  "
-            #              f"end_time = {datetime.now()}")
+                active_policy.release()
 
         return response_code, response_json
 
@@ -100,432 +195,2434 @@ def auth_decorator(f):
     to log info on the wrapper layer functions.
     """
 
-    # ToDo: Is this decorator thread safe??? Not currently at least due to how last_operation_end_time is used.
-
     @wraps(f)
     def decorated_f(*args, **kwargs):
-        global last_operation_start_time
-        global last_operation_end_time
+        span = wrapper_utilisation_tracker.start()
+
+        try:
+            return _auth_and_call(f, args, kwargs)
+        finally:
+            wrapper_utilisation_tracker.end(span)
 
-        current_time = time.time()
+    return decorated_f
 
-        if last_operation_end_time != 0.0:
-            idle_time = round(current_time - last_operation_end_time, 4)
-            total_time = round(current_time - last_operation_start_time, 4)
-            promths_wrapper_idle_fraction_gauge.labels(exec_id=promths_exec_id).set(idle_time / total_time)
 
-        last_operation_start_time = current_time
+def admin_auth_decorator(f):
+    """
+    Decorator to check that a valid admin auth token was provided to an admin wrapper function. Admin calls aren't
+    charged call units or rate limited.
+    """
 
-        # === Find auth_token amongst the named parameters ===
+    @wraps(f)
+    def decorated_f(*args, **kwargs):
         auth_token = kwargs.get('auth_token')
-        # ====================================================
-        caller_name = kwargs.get('caller_name')
-
-        # if 'image' in f.__name__:
-        #     logging.info(f"rest_wrapper_request: {f.__name__ } <- [arguments not shown] (caller_name={caller_name})")
-        # else:
-        #     logging.info(f"rest_wrapper_request: {f.__name__} <- {str(args)} {str(kwargs)}")
-
-        # === Check that an auth token was provided ===
-        if auth_token is None:
-            promths_call_count_gauge_unauthrsd.labels(exec_id=promths_exec_id,
-                                                      auth_desc="None",
-                                                      caller_name=caller_name).inc()  # pylint: disable=no-member
-            logging.info(f"auth_decorator: None: No authorisation token provided!")
-            last_operation_end_time = time.time()
-            return 403, {"error_detail": "No authorisation token provided!"}  # Bad/Malformed request.
-        # =============================================
-
-        auth_desc = auth_token_desc_cache.get(auth_token, "[Not in cache!]")
-
-        # === Check that the auth token is valid ===
-        # First DB access for the request ...
-        if not is_auth_token_valid(auth_token):  # Note: Also updates the local call count cache!
-            logging.info(f"auth_decorator: {auth_token}: Invalid authorisation token or API rate limit exceeded!")
-            promths_call_count_gauge_unauthrsd.labels(exec_id=promths_exec_id,
-                                                      auth_desc=auth_desc,
-                                                      caller_name=caller_name).inc()  # pylint: disable=no-member
-            last_operation_end_time = time.time()
-            return 403, {"error_detail": "Invalid authorisation token provided or API rate limit exceeded!"}
-        # ==========================================
-
-        # === Update desc. to latest cached value after update in is_auth_token_valid ^ ===
-        auth_desc = auth_token_desc_cache.get(auth_token, "[Not in cache!]")
-        # =================================================================================
-
-        start_time = time.time()
-
-        # === Call the wrapper layer function ===
+
+        if (auth_token is None) or (not is_admin_auth_token_valid(auth_token)):
+            logging.info(f"admin_auth_decorator: {f.__name__}: Invalid admin authorisation token!")
+            promths_http_response_counter.labels(exec_id=promths_exec_id, auth_desc="admin",
+                                                 endpoint=f.__name__, status=403).inc()  # pylint: disable=no-member
+            return 403, {"error_detail": "Invalid admin authorisation token provided!"}
+
         response_code, response_json = f(*args, **kwargs)
-        # =======================================
 
-        call_duration = round(time.time() - start_time, 4)
+        promths_http_response_counter.labels(exec_id=promths_exec_id, auth_desc="admin",
+                                             endpoint=f.__name__, status=response_code).inc()  # pylint: disable=no-member
+        return response_code, response_json
 
-        # logging.info(f"rest_wrapper_response: {f.__name__} -> {str((response_code, response_json))} "
-        #              f"in {call_duration} seconds.")
+    return decorated_f
 
-        promths_http_response_gauge.labels(exec_id=promths_exec_id,
-                                           auth_desc=auth_desc,
-                                           caller_name=caller_name,
-                                           endpoint=f.__name__, status=response_code).inc()  # pylint: disable=no-member
 
-        if 200 <= response_code <= 299:
-            # The API call was successful - Update call count & log/monitor.
+# The state of an authorised call between the pre-call and the post-call phases of _auth_and_call.
+AuthCallState = NamedTuple('AuthCallState', [('auth_desc', str),
+                                             ('call_units', int),
+                                             ('reserve_units', bool)])  # True if the units were reserved before the call.
 
-            text = kwargs.get('text')
 
-            # === Count one call unit per 100 chars of text ===
-            if text is None:
-                call_units = 1
-            else:
-                call_units = int(len(text) / 100 + 1)
-            # =================================================
+def _auth_and_call(f, args, kwargs) -> Tuple[int, JSONType]:
+    """ Check the auth token, call the wrapper layer function and update the call count. See auth_decorator. """
+    rejection, state = _auth_before_call(f.__name__, kwargs)
 
-            increment_auth_token_call_count(auth_token, call_units,  # Count one API call per call unit.
-                                            f.__name__)
+    if rejection is not None:
+        return rejection
 
-            # promths_request_histogrm.labels(endpoint=f.__name__).observe(call_duration)  # pylint: disable=no-member
-            promths_request_latency_gauge.labels(exec_id=promths_exec_id,
-                                                 auth_desc=auth_desc,
-                                                 caller_name=caller_name,
-                                                 endpoint=f.__name__).set(call_duration)  # pylint: disable=no-member
+    assert state is not None
+    start_time = time.time()
 
-            call_count, call_count_limit = auth_token_call_cache.get(auth_token, (0, None))
-            # promths_call_units_histogrm.labels(endpoint=f.__name__).observe(call_units)  # pylint: disable=no-member
-            promths_call_count_gauge_authrsd.labels(exec_id=promths_exec_id,
-                                                    auth_desc=auth_desc,
-                                                    caller_name=caller_name).set(call_count)  # pylint: disable=no-member
+    # === Call the wrapper layer function ===
+    try:
+        response_code, response_json = f(*args, **kwargs)
+    except Exception:
+        _auth_call_failed(f.__name__, kwargs, state)
+        raise
+    # =======================================
 
-            logging.info(f"cached_call_count = {auth_token_call_cache.get(auth_token)}, "
-                         f"cached_desc = {auth_desc}, caller_name = {caller_name}")
+    _auth_after_call(f.__name__, kwargs, state, response_code, time.time() - start_time)
 
-        last_operation_end_time = time.time()
+    return response_code, response_json
 
-        return response_code, response_json
 
-    return decorated_f
+def _auth_before_call(endpoint: str, kwargs,
+                      allow_reserve: bool = True) -> Tuple[Optional[Tuple[int, JSONType]], Optional[AuthCallState]]:
+    """
+    The pre-call phase of _auth_and_call: Check the auth token and its rate limits and validate the token (or reserve the
+    call units). Blocking (DB access).
 
+    :param allow_reserve: False to only validate the token and charge the call units after the call e.g. for jobs.
 
-def add_auth_token(auth_token: str, desc: Optional[str],
-                   call_count_limit: Optional[int] = None,
-                   call_count_limit_relative: bool = False) -> bool:
+    :return: (rejection, state). rejection is the (response_code, response_json) if the call is rejected, else None.
     """
-    Add or update an auth token to the DB. Local cache will be updated during next API request in is_auth_token_valid(...)!
+    # === Find auth_token amongst the named parameters ===
+    auth_token = kwargs.get('auth_token')
+    # ====================================================
+
+    # if 'image' in endpoint:
+    #     logging.info(f"rest_wrapper_request: {endpoint} <- [arguments not shown] (caller_name={caller_name})")
+    # else:
+    #     logging.info(f"rest_wrapper_request: {endpoint} <- {str(args)} {str(kwargs)}")
+
+    # === Check that an auth token was provided ===
+    if auth_token is None:
+        promths_call_count_counter_unauthrsd.labels(exec_id=promths_exec_id,
+                                                    auth_desc="None").inc()  # pylint: disable=no-member
+        logging.info(f"auth_decorator: None: No authorisation token provided!")
+        return (403, {"error_detail": "No authorisation token provided!"}), None  # Bad/Malformed request.
+    # =============================================
+
+    # === Reject tokens known to be invalid without a DB round trip ===
+    rejection_reason = _early_rejection_reason(auth_token)
+
+    if rejection_reason is not None:
+        promths_early_rejection_counter.labels(exec_id=promths_exec_id, reason=rejection_reason).inc()  # pylint: disable=no-member
+        promths_call_count_counter_unauthrsd.labels(exec_id=promths_exec_id,
+                                                    auth_desc="Invalid").inc()  # pylint: disable=no-member
+        logging.info("auth_decorator: %s: Invalid authorisation token (%s)!", auth_token, rejection_reason)
+        return (403, {"error_detail": "Invalid authorisation token provided or API rate limit exceeded!"}), None
+    # =================================================================
+
+    auth_desc = auth_token_desc_cache.get(auth_token, "[Not in cache!]")
+
+    call_units = _call_units(kwargs)
+
+    # === Check the rate limits of the auth token (no DB access) ===
+    retry_after = rate_limiter.acquire(auth_token, call_units)
+
+    if retry_after > 0.0:
+        logging.info("auth_decorator: %s: API rate limit exceeded! Retry after %.3f seconds.", auth_token, retry_after)
+        bounded_labels(promths_http_response_counter, {'auth_desc': promths_auth_desc_limiter},
+                       exec_id=promths_exec_id,
+                       auth_desc=auth_desc,
+                       endpoint=endpoint, status=429).inc()
+        return (429, {"error_detail": "API rate limit exceeded!", "retry_after": retry_after}), None
+    # ==============================================================
+
+    # The call units are reserved atomically with the validation (one DB transaction or the shared counter store) unless
+    # the cached validation or the write-behind of call counts is enabled. The reservation is released again if the call doesn't succeed.
+    reserve_units = allow_reserve and ((shared_counter_store is not None) or
+                                       ((call_count_accumulator is None) and (auth_token_call_cache.ttl is None)))
+
+    # === Check that the auth token is valid ===
+    # First DB access for the request ...
+    if reserve_units:
+        valid = reserve_auth_token_units(auth_token, call_units, endpoint)  # Note: Also updates the local caches!
+    else:
+        valid = is_auth_token_valid(auth_token)  # Note: Also updates the local call count cache!
 
-    :param auth_token: The auth token to add/update.
-    :param desc: The description to apply to the token. 'None' to leave existing description unchanged.
-    :param call_count_limit: The call count limit to place on the token. 'None' to make unlimited.
-    :param call_count_limit_relative: If True then the limit will be relative to the current count. Default is False!
-    :return: True/False indicating success of operation.
+    if not valid:
+        rate_limiter.refund(auth_token, call_units)
+        logging.info("auth_decorator: %s: Invalid authorisation token or API rate limit exceeded!", auth_token)
+        bounded_labels(promths_call_count_counter_unauthrsd, {'auth_desc': promths_auth_desc_limiter},
+                       exec_id=promths_exec_id,
+                       auth_desc=auth_desc).inc()
+        return (403, {"error_detail": "Invalid authorisation token provided or API rate limit exceeded!"}), None
+    # ==========================================
+
+    # === Update desc. to latest cached value after update in is_auth_token_valid ^ ===
+    auth_desc = auth_token_desc_cache.get(auth_token, "[Not in cache!]")
+    # =================================================================================
+
+    return None, AuthCallState(auth_desc=auth_desc, call_units=call_units, reserve_units=reserve_units)
+
+
+def _auth_call_failed(endpoint: str, kwargs, state: AuthCallState) -> None:
     """
-    try:
-        query = db.session.query(APIKeyData)
-        instance = query.get(ident=auth_token)
+    Release the reserved call units (if any) of a call that raised an exception. Blocking (DB access). Doesn't raise so
+    that the caller re-raises the exception of the call and not of the release.
+    """
+    rate_limiter.refund(kwargs.get('auth_token'), state.call_units)
 
-        if instance:
-            if desc is not None:
-                instance.desc = desc
+    if state.reserve_units:
+        try:
+            release_auth_token_units(kwargs.get('auth_token'), state.call_units, endpoint)
+        except Exception as e:
+            logging.exception("auth_decorator: %s: Failed to release the reserved call units of %s: %s!",
+                              kwargs.get('auth_token'), endpoint, e)
 
-            # Initialise the call_count if None.
-            if instance.call_count is None:
-                instance.call_count = 0
 
-            if (call_count_limit is None) or (call_count_limit_relative is False):
-                instance.call_count_limit = call_count_limit
-            else:
-                instance.call_count_limit = instance.call_count + call_count_limit
-        else:
-            instance = APIKeyData(auth_token, str(desc), 0, call_count_limit)
-            db.session.add(instance)
+def request_charges() -> List[Tuple[str, int]]:
+    """ The (endpoint, call units) of the successful wrapper calls charged during the current flask request. """
+    return list(request.environ.get('tackle.charges', ())) if has_request_context() else []
 
-        db.session.commit()
-        return True
-    except Exception:
-        db.session.rollback()
-        raise
-    finally:
-        db.session.close()
 
+def _record_request_charge(endpoint: str, call_units: int) -> None:
+    if has_request_context():
+        request.environ.setdefault('tackle.charges', []).append((endpoint, call_units))
 
-def remove_auth_token(auth_token: str) -> bool:
-    """
-    Removes an auth token.
 
-    :param auth_token: The auth token to remove.
-    :return: True/False indicating success of operation.
+def _auth_after_call(endpoint: str, kwargs, state: AuthCallState, response_code: int, call_duration: float) -> None:
     """
-    try:
-        query = db.session.query(APIKeyData)
-        instance = query.get(ident=auth_token)
+    The post-call phase of _auth_and_call: Charge the call units of a successful call (or release the reserved units of an
+    unsuccessful one) and log/monitor the call. Blocking (DB access).
+    """
+    auth_token = kwargs.get('auth_token')
+    caller_name = kwargs.get('caller_name')
+    auth_desc = state.auth_desc
+    call_units = state.call_units
 
-        if instance:
-            db.session.delete(instance)
-            db.session.commit()
-            success = True
-        else:
-            success = False
+    # logging.info(f"rest_wrapper_response: {endpoint} -> {str((response_code, response_json))} "
+    #              f"in {call_duration} seconds.")
 
-        # Remove breakdown call counts for this auth token.
-        query = db.session.query(APICallCountBreakdownData)
-        rows = query.filter_by(auth_key=auth_token).all()
+    observe_request_latency(endpoint, call_duration)
 
-        if rows:
-            for row in rows:
-                db.session.delete(row)
-            db.session.commit()
+    bounded_labels(promths_http_response_counter, {'auth_desc': promths_auth_desc_limiter},
+                   exec_id=promths_exec_id,
+                   auth_desc=auth_desc,
+                   endpoint=endpoint, status=response_code).inc()
 
-        return success
-    except Exception:
-        db.session.rollback()
-        raise
-    finally:
-        db.session.close()
+    if 200 <= response_code <= 299:
+        # The API call was successful - Update call count & log/monitor.
 
+        if not state.reserve_units:
+            increment_auth_token_call_count(auth_token, call_units,  # Count one API call per call unit.
+                                            endpoint)
+
+        _record_request_charge(endpoint, call_units)
+
+        bounded_labels(promths_call_units_counter, {'auth_desc': promths_auth_desc_limiter},
+                       exec_id=promths_exec_id,
+                       auth_desc=auth_desc,
+                       endpoint=endpoint).inc(call_units)
+        promths_call_units_histogrm.labels(exec_id=promths_exec_id,
+                                           endpoint=endpoint).observe(call_units)  # pylint: disable=no-member
+
+        call_count, call_count_limit = auth_token_call_cache.get(auth_token, (0, None))
+        bounded_labels(promths_call_count_gauge_authrsd, {'auth_desc': promths_auth_desc_limiter,
+                                                          'caller_name': promths_caller_name_limiter},
+                       exec_id=promths_exec_id,
+                       auth_desc=auth_desc,
+                       caller_name=caller_name).set(call_count)
+
+        logging.info("cached_call_count = %s, cached_desc = %s, caller_name = %s",
+                     auth_token_call_cache.get(auth_token), auth_desc, caller_name)
+    else:
+        rate_limiter.refund(auth_token, call_units)
 
-def load_auth_token_list() -> List[str]:
-    """
-    Get the list of auth tokens stored in the DB.
+        if state.reserve_units:
+            release_auth_token_units(auth_token, call_units, endpoint)
 
-    :return: List[str]
+
+def _in_app_context(fn: Callable) -> Callable:
+    """
+    Wrap fn to run within the app context of the current app e.g. as the task of a background thread. Call within the app
+    context. An app context already pushed (e.g. of a test) is used as is.
     """
-    query = db.session.query(APIKeyData)
-    query = query.options(load_only("auth_key"))
+    app = current_app._get_current_object()  # type: ignore[attr-defined]  # pylint: disable=protected-access
 
-    api_key_object_list = query.all()
-    auth_token_list = []
+    def fn_in_app_context(*args, **kwargs):
+        if has_app_context():
+            return fn(*args, **kwargs)
 
-    for instance in api_key_object_list:
-        auth_token_list.append(instance.auth_key)
+        with app.app_context():
+            return fn(*args, **kwargs)
+
+    return fn_in_app_context
 
-    db.session.close()
 
-    return auth_token_list
+# =============================
+# Async (ASGI) wrappers. The DB driver and SQLAlchemy version in use are blocking, so the blocking auth and call count
+# work of the async wrappers runs in a bounded thread pool (within the app context) while the event loop serves the other
+# requests. See configure_async_executor(...) and asgi_utils.create_asgi_app(...).
+_async_executor_details = {"executor": None, "app": None}  # type: Dict
 
+# Bounds of the back-off (in seconds) of async_lock_decorator while polling a concurrency policy.
+_ASYNC_LOCK_MIN_WAIT = 0.0005
+_ASYNC_LOCK_MAX_WAIT = 0.02
 
-def get_auth_token_details(auth_token: str) -> Optional[Dict]:
+
+def configure_async_executor(max_workers: int = 16,
+                             app=None) -> ThreadPoolExecutor:
     """
-    Gets the desc, call_count and call_count_limit of an auth token.
+    Configure the bounded thread pool of the blocking work (DB access) of the async wrappers.
 
-    :param auth_token: The auth token to get the details of.
-    :return: None if auth token not found, else {desc, call_count, call_count_limit}
+    :param max_workers: The max number of concurrent blocking calls e.g. the size of the DB connection pool.
+    :param app: The flask app in whose app context the blocking calls run. 'None' for the current app.
     """
-    query = db.session.query(APIKeyData)
-    instance = query.get(ident=auth_token)
+    app = current_app._get_current_object() if app is None else app  # type: ignore[attr-defined]  # pylint: disable=protected-access
+    previous_executor = _async_executor_details["executor"]
 
-    auth_token_details = None  # type: Optional[Dict]
+    _async_executor_details["executor"] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tackle_async')
+    _async_executor_details["app"] = app
 
-    if instance:
-        desc = instance.desc
-        call_count = instance.call_count
-        call_count_limit = instance.call_count_limit
+    if previous_executor is not None:
+        previous_executor.shutdown(wait=False)
 
-        if call_count is None:
-            call_count = 0
+    return _async_executor_details["executor"]
 
-        auth_token_details = {"desc": desc,
-                              "call_count": call_count,
-                              "call_count_limit": call_count_limit}
 
-        # Get call count breakdown.
-        query = db.session.query(APICallCountBreakdownData)
-        rows = query.filter_by(auth_key=auth_token).all()
+def shutdown_async_executor(wait: bool = True):
+    """ Shut down the thread pool of the async wrappers e.g. at the ASGI lifespan shutdown. """
+    executor = _async_executor_details["executor"]
+    _async_executor_details["executor"] = None
+    _async_executor_details["app"] = None
 
-        if rows:
-            breakdown_dict = {}
-            for row in rows:
-                breakdown_dict[row.endpoint] = row.call_count
-            auth_token_details['call_count_breakdown'] = breakdown_dict
+    if executor is not None:
+        executor.shutdown(wait=wait)
 
-    db.session.close()
-    return auth_token_details
 
+async def run_in_executor(fn: Callable, *args, **kwargs):
+    """ Await fn(*args, **kwargs) run in the bounded thread pool (within the app context). See configure_async_executor. """
+    executor = _async_executor_details["executor"]
+    app = _async_executor_details["app"]
 
-def add_admin_auth_token(auth_token: str, desc: str) -> bool:
-    """ Add or update an admin auth_token to the DB. """
-    try:
-        query = db.session.query(AdminAPIKeyData)
-        instance = query.get(ident=auth_token)
+    if executor is None:
+        raise RuntimeError("wrapper_util.run_in_executor: No async executor! Call configure_async_executor(...) first.")
 
-        if instance:
-            instance.desc = desc
-        else:
-            instance = AdminAPIKeyData(auth_token, desc)
-            db.session.add(instance)
+    def call_in_app_context():
+        with app.app_context():
+            return fn(*args, **kwargs)
 
-        db.session.commit()
-        return True
-    except Exception:
-        db.session.rollback()
-        raise
-    finally:
-        db.session.close()
+    return await asyncio.get_running_loop().run_in_executor(executor, call_in_app_context)
 
 
-def remove_admin_auth_token(auth_token: str) -> bool:
+def async_lock_decorator(f: Optional[Callable] = None,
+                         policy: Optional[ConcurrencyPolicy] = None):
     """
-    Removes an admin auth token.
+    Async version of lock_decorator for async wrapper functions. The policy is polled (with back-off) from the event loop
+    instead of blocking a thread, so async and sync wrappers may share a policy. Waiting async writers of a WritePolicy
+    don't block new readers.
 
-    :param auth_token: The auth token to remove.
-    :return: True/False indicating success of operation.
+    :param f: The async wrapper function when used as @async_lock_decorator without arguments.
+    :param policy: The concurrency policy. 'None' for the default_concurrency_policy.
     """
-    try:
-        query = db.session.query(AdminAPIKeyData)
-        instance = query.get(ident=auth_token)
+    if f is None:
+        return lambda _f: async_lock_decorator(_f, policy=policy)
 
-        if instance:
-            db.session.delete(instance)
-            db.session.commit()
-            success = True
-        else:
-            success = False
+    @wraps(f)
+    async def decorated_f(*args, **kwargs):
+        active_policy = default_concurrency_policy if policy is None else policy
+        acquire_lock: bool = kwargs.get('lock_decorator_acquire_lock', True)
 
-        return success
-    except Exception:
-        db.session.rollback()
-        raise
-    finally:
-        db.session.close()
+        if acquire_lock is not False:
+            pre_lock_time = time.time()
+            wait_time = _ASYNC_LOCK_MIN_WAIT
 
+            while not active_policy.acquire(blocking=False):
+                await asyncio.sleep(wait_time)
+                wait_time = min(wait_time * 2.0, _ASYNC_LOCK_MAX_WAIT)
 
-def load_admin_auth_token_list() -> List[str]:
-    """
-    Get the list of adminauth tokens stored in the DB.
+            promths_lock_wait_histogrm.labels(exec_id=promths_exec_id,
+                                              policy=active_policy.label,
+                                              endpoint=f.__name__).observe(time.time() - pre_lock_time)  # pylint: disable=no-member
 
-    :return: List[str]
-    """
-    query = db.session.query(AdminAPIKeyData)
-    query = query.options(load_only("auth_key"))
+        try:
+            response_code, response_json = await f(*args, **kwargs)
+        except Exception as e:
+            caller_name = kwargs.get('caller_name')
 
-    api_key_object_list = query.all()
-    auth_token_list = []
+            logging.exception(f"async_lock_decorator: Uncaught exception: {e}! caller_name = {caller_name}")
 
-    for instance in api_key_object_list:
-        auth_token_list.append(instance.auth_key)
+            promths_http_response_counter.labels(exec_id=promths_exec_id,
+                                                 auth_desc=exception_label(e),
+                                                 endpoint=f.__name__, status=500).inc()  # pylint: disable=no-member
+            raise  # re-raise the uncaught exception.
+        finally:
+            if acquire_lock is not False:
+                active_policy.release()
 
-    db.session.close()
+        return response_code, response_json
 
-    return auth_token_list
+    return decorated_f
 
 
-def add_default_auth_tokens():
-    """ Add some known auth tokens to the DB for ease of dev and use. """
-    # add_admin_auth_token('...', "Admin & Testing.")
-    # add_auth_token('...', "Admin & Testing.")
-    pass
+def async_auth_decorator(f):
+    """
+    Async version of auth_decorator for async wrapper functions. The auth token checks and call count updates run in the
+    bounded thread pool and the wrapper function itself on the event loop.
+    """
 
+    @wraps(f)
+    async def decorated_f(*args, **kwargs):
+        span = wrapper_utilisation_tracker.start()
 
-def is_auth_token_valid(auth_token: str) -> bool:
-    """
-    Checks if the auth token is a valid token and that its rate limit has not been exceeded. Also
-    updates the local call count and API key desc caches with the info from the DB.
+        try:
+            return await _async_auth_and_call(f, args, kwargs)
+        finally:
+            wrapper_utilisation_tracker.end(span)
 
-    :param auth_token: The auth token.
-    :return: True only if the token is a valid token and its rate limit has not been exceeded.
-    """
+    return decorated_f
 
-    global __default_auth_tokens_configured
+
+async def _async_auth_and_call(f, args, kwargs) -> Tuple[int, JSONType]:
+    """ Async version of _auth_and_call. """
+    rejection, state = await run_in_executor(_auth_before_call, f.__name__, kwargs)
+
+    if rejection is not None:
+        return rejection
+
+    assert state is not None
+    start_time = time.time()
 
     try:
-        # Check if the default tokens have been initialised.
-        if not __default_auth_tokens_configured:
-            add_default_auth_tokens()
-            __default_auth_tokens_configured = True
+        response_code, response_json = await f(*args, **kwargs)
+    except BaseException:
+        # Also when the call is cancelled e.g. as the client disconnected. The release runs to completion in the executor
+        # even if the task is cancelled again while awaiting it.
+        await run_in_executor(_auth_call_failed, f.__name__, kwargs, state)
+        raise
 
-        query = db.session.query(APIKeyData)
-        # query = query.options(load_only("auth_key", "desc", "call_count", "call_count_limit"))
+    await run_in_executor(_auth_after_call, f.__name__, kwargs, state, response_code, time.time() - start_time)
 
-        instance = query.get(ident=auth_token)
+    return response_code, response_json
 
-        # 1 - Initialise call_count if None.
-        if instance and instance.call_count is None:
-            # Token valid, but call_count not assigned yet.
-            instance.call_count = 0
-            db.session.commit()
 
-        # 2 - Update the local call count cache which is updated and used later to build response headers, etc.
-        if instance:
-            auth_token_call_cache[auth_token] = (instance.call_count, instance.call_count_limit)
-            auth_token_desc_cache[auth_token] = instance.desc
-        else:
-            auth_token_call_cache.pop(auth_token, None)
-            auth_token_desc_cache.pop(auth_token, None)
+async def async_is_auth_token_valid(auth_token: str) -> bool:
+    """ Async version of is_auth_token_valid. """
+    return await run_in_executor(is_auth_token_valid, auth_token)
 
-        # 3 - Check that token is valid and rate limit (if any) not exceeded.
-        if instance and \
-                ((instance.call_count_limit is None) or
-                 (instance.call_count < instance.call_count_limit)):
-            # Token valid AND (no rate limit OR rate limit not exceeded).
-            valid = True
-        else:
-            valid = False
 
-        return valid
-    except Exception:
-        db.session.rollback()
-        raise
-    finally:
-        db.session.close()
+async def async_reserve_auth_token_units(auth_token: str, units: int,
+                                         endpoint: Optional[str] = None) -> bool:
+    """ Async version of reserve_auth_token_units. """
+    return await run_in_executor(reserve_auth_token_units, auth_token, units, endpoint)
 
 
-def increment_auth_token_call_count(auth_token: str, units: int,
-                                    endpoint: Optional[str] = None):
+async def async_release_auth_token_units(auth_token: str, units: int,
+                                         endpoint: Optional[str] = None):
+    """ Async version of release_auth_token_units. """
+    await run_in_executor(release_auth_token_units, auth_token, units, endpoint)
+
+
+async def async_increment_auth_token_call_count(auth_token: str, units: int,
+                                                endpoint: Optional[str] = None):
+    """ Async version of increment_auth_token_call_count. """
+    await run_in_executor(increment_auth_token_call_count, auth_token, units, endpoint)
+
+
+async def async_get_auth_token_details(auth_token: str) -> Optional[Dict]:
+    """ Async version of get_auth_token_details. """
+    return await run_in_executor(get_auth_token_details, auth_token)
+
+
+# =============================
+# Offload of CPU bound wrapper functions to pools of worker processes. The auth checks and call accounting of
+# auth_decorator stay in the web process; only the undecorated wrapper function runs in a worker.
+def offload_decorator(f: Optional[Callable] = None,
+                      pool: str = 'default'):
     """
-    Increments the call count for the auth token - increments the DB and the local cache.
+    Decorator to run a CPU bound (module level) wrapper function in a pool of worker processes created with
+    create_worker_pool(...). Place it below @auth_decorator e.g.:
 
-    :param auth_token: The auth token.
-    :param units: The number of units of use.
-    :param endpoint: The endpoint to allocate the call count to.
+        @wrapper_util.lock_decorator(policy=wrapper_util.SemaphorePolicy('engine', 8))
+        @wrapper_util.auth_decorator
+        @wrapper_util.offload_decorator(pool='engine')
+        def analyse(auth_token: str, caller_name: Optional[str], text: str) -> Tuple[int, JSONType]:
+
+    The arguments and the result must be picklable. The function runs in-process if no pool of the name was created.
+
+    :param f: The wrapper function when used as @offload_decorator without arguments.
+    :param pool: The name of the worker pool.
     """
-    try:
-        # Atomic update of call_count in DB.
-        query = db.session.query(APIKeyData)
-        query.filter_by(auth_key=auth_token).update({'call_count': APIKeyData.call_count + units})
-        db.session.commit()
+    if f is None:
+        return lambda _f: offload_decorator(_f, pool=pool)
 
-        # Update of the local call cache.
-        cached_call_count_tuple = auth_token_call_cache.get(auth_token)
-        if cached_call_count_tuple is not None:
-            auth_token_call_cache[auth_token] = (cached_call_count_tuple[0] + units, cached_call_count_tuple[1])
+    register_function(f)
 
-        if endpoint is not None:
-            # Atomic update of call count breakdown in DB.
-            query = db.session.query(APICallCountBreakdownData)
-            row_count = \
-                query.filter_by(auth_key=auth_token,
-                                endpoint=str(endpoint)
-                                ).update({'call_count': APICallCountBreakdownData.call_count + units})
+    @wraps(f)
+    def decorated_f(*args, **kwargs):
+        worker_pool = worker_pools.get(pool)
 
-            if row_count == 0:
-                # Add the key,endpoint row if not yet present.
-                instance = APICallCountBreakdownData(auth_token, endpoint, units)
-                db.session.add(instance)
+        if worker_pool is None:
+            return f(*args, **kwargs)
 
-            db.session.commit()
+        result, wait_time = worker_pool.call(f, args, kwargs)
+        promths_worker_pool_wait_histogrm.labels(exec_id=promths_exec_id, pool=pool).observe(wait_time)  # pylint: disable=no-member
 
-    except Exception:
-        db.session.rollback()
-        raise
-    finally:
-        db.session.close()
+        return result
 
+    return decorated_f
 
-def is_admin_auth_token_valid(auth_token: str) -> bool:
-    global __default_auth_tokens_configured
 
-    # Check if the default tokens have been initialised.
-    if not __default_auth_tokens_configured:
-        add_default_auth_tokens()
-        __default_auth_tokens_configured = True
+def _worker_pool_queue_depth(name: str) -> float:
+    worker_pool = worker_pools.get(name)
+    return 0.0 if worker_pool is None else worker_pool.queue_depth
 
-    query = db.session.query(AdminAPIKeyData)
-    query = query.options(load_only("auth_key"))
 
-    instance = query.get(ident=auth_token)
+def _worker_pool_utilisation(name: str) -> float:
+    worker_pool = worker_pools.get(name)
+    return 0.0 if worker_pool is None else worker_pool.utilisation()
 
-    if instance:
-        valid = True
+
+def create_worker_pool(name: str = 'default',
+                       max_workers: Optional[int] = None,
+                       initializer: Optional[Callable] = None,
+                       initargs: tuple = (),
+                       mp_context=None) -> WorkerPool:
+    """
+    Create (or replace) the pool of worker processes of the wrapper functions decorated with offload_decorator(pool=name).
+    The pool's queue depth, utilisation and queue wait time are sent to prometheus.
+
+    :param max_workers: The number of worker processes. 'None' for the number of CPUs.
+    :param initializer: Optional function called at the start of each worker process e.g. to load the engine once per
+                        worker.
+    :param mp_context: Optional multiprocessing context. Use multiprocessing.get_context('spawn') if the workers mustn't
+                       inherit the web process's state (e.g. its DB connections or threads).
+    """
+    previous_pool = worker_pools.get(name)
+    worker_pools[name] = WorkerPool(name, max_workers or os.cpu_count() or 1,
+                                    initializer=initializer, initargs=initargs, mp_context=mp_context)
+
+    if previous_pool is not None:
+        previous_pool.shutdown(wait=False)
     else:
-        valid = False
+        set_gauge_function(promths_worker_pool_queue_depth_gauge.labels(exec_id=promths_exec_id, pool=name),
+                           lambda: _worker_pool_queue_depth(name))
+        set_gauge_function(promths_worker_pool_utilisation_gauge.labels(exec_id=promths_exec_id, pool=name),
+                           lambda: _worker_pool_utilisation(name))
 
-    db.session.close()
-    return valid
+    logging.info("wrapper_util.create_worker_pool: Created worker pool %s of %d processes.", name,
+                 worker_pools[name].max_workers)
+    return worker_pools[name]
+
+
+def shutdown_worker_pools(wait: bool = True):
+    """ Shut down the worker pools. The decorated wrapper functions then run in-process again. """
+    for name in list(worker_pools.keys()):
+        worker_pools.pop(name).shutdown(wait=wait)
+
+
+def _call_units(kwargs) -> int:
+    """
+    The call units of a wrapper function call: The call_units argument (if any) e.g. to charge a cached response like the
+    call it was cached from, else one call unit per 100 chars of text (if any), else one.
+    """
+    call_units = kwargs.get('call_units')
+
+    if call_units is not None:
+        return call_units
+
+    text = kwargs.get('text')
+
+    if text is None:
+        return 1
+    else:
+        return int(len(text) / 100 + 1)
+
+
+def configure_auth_token_cache(max_size: int = 10000,
+                               ttl: Optional[float] = None) -> None:
+    """
+    Configure the local auth token caches.
+
+    :param max_size: The max number of auth tokens to cache. The least recently used tokens are evicted first.
+    :param ttl: The staleness window (in seconds) of a cached token record. Within this window is_auth_token_valid(...)
+                validates the token from the cache without a DB round trip, so a revocation or a call count update made
+                by another process may take up to ttl seconds to take effect. 'None' (the default) to always validate
+                against the DB.
+    """
+    auth_token_call_cache.configure(max_size, ttl)
+    auth_token_desc_cache.configure(max_size, ttl)
+
+
+def invalidate_auth_token_cache(auth_token: Optional[str] = None) -> None:
+    """
+    Remove an auth token from the local caches so that its next validation goes to the DB.
+
+    :param auth_token: The auth token to invalidate. 'None' to invalidate all auth tokens.
+    """
+    if auth_token is None:
+        auth_token_call_cache.clear()
+        auth_token_desc_cache.clear()
+
+        with _warm_token_lock:
+            _warm_token_records.clear()
+            _warm_token_keys.clear()
+
+        if invalid_auth_token_cache is not None:
+            invalid_auth_token_cache.clear()
+    else:
+        auth_token_call_cache.pop(auth_token, None)
+        auth_token_desc_cache.pop(auth_token, None)
+
+        with _warm_token_lock:
+            _warm_token_records.pop(token_digest(auth_token), None)
+            _warm_token_keys.pop(token_digest(auth_token), None)
+
+        if invalid_auth_token_cache is not None:
+            invalid_auth_token_cache.pop(token_digest(auth_token), None)
+
+
+def _count_cache_lookup(result: str) -> None:
+    with _warm_token_lock:
+        _auth_token_cache_lookups[result] += 1
+
+    promths_auth_token_cache_counter.labels(exec_id=promths_exec_id, result=result).inc()  # pylint: disable=no-member
+
+
+def _auth_token_cache_hit_ratio() -> float:
+    with _warm_token_lock:
+        num_lookups = sum(_auth_token_cache_lookups.values())
+        return 0.0 if num_lookups == 0 else 1.0 - _auth_token_cache_lookups["miss"] / num_lookups
+
+
+def _auth_token_cache_staleness() -> float:
+    synced_at = _warm_token_details["synced_at"]
+    return 0.0 if synced_at <= 0.0 else time.time() - synced_at
+
+
+set_gauge_function(promths_auth_token_cache_hit_ratio_gauge.labels(exec_id=promths_exec_id), _auth_token_cache_hit_ratio)
+set_gauge_function(promths_auth_token_cache_staleness_gauge.labels(exec_id=promths_exec_id), _auth_token_cache_staleness)
+
+
+def _warm_record_rows(query) -> Iterator[Tuple[bytes, tuple]]:
+    """ Stream the (digest, warm record) rows of a query of the warm record columns through a server-side cursor. """
+    for row in query.execution_options(stream_results=True).yield_per(1000):
+        yield row[0], tuple(row[1:])
+
+
+def _warm_record_query():
+    return db.session.query(APIKeyData.key_digest, _call_count_column(), APIKeyData.call_count_limit, APIKeyData.desc,
+                            APIKeyData.rate_limit_per_sec, APIKeyData.units_limit_per_min)
+
+
+def preload_auth_token_cache() -> int:
+    """
+    Load the records of all the auth tokens in one streamed query into the warm store so that the first request of each
+    token is validated without a DB round trip. Used while validating from the cache i.e. with a TTL configured (see
+    configure_auth_token_cache(...)). Without a refresher (see enable_auth_token_cache_refresh(...)) the warm records
+    are used for up to TTL seconds after the preload. Tokens removed since the previous preload are dropped.
+
+    :return: The number of token records loaded.
+    """
+    sync_time = time.time()
+
+    try:
+        records = dict(_warm_record_rows(_warm_record_query()))
+    finally:
+        db.session.close()
+
+    with _warm_token_lock:
+        _warm_token_records.clear()
+        _warm_token_records.update(records)
+
+        for digest in [digest for digest in _warm_token_keys if digest not in records]:
+            auth_token = _warm_token_keys.pop(digest)
+            auth_token_call_cache.pop(auth_token, None)
+            auth_token_desc_cache.pop(auth_token, None)
+
+    _warm_token_details["synced_at"] = sync_time
+    _warm_token_details["full_synced_at"] = sync_time
+
+    logging.info(f"wrapper_util.preload_auth_token_cache: {len(records)} auth token records loaded.")
+    return len(records)
+
+
+def refresh_auth_token_cache(overlap: float = 5.0) -> int:
+    """
+    Pull the records of the auth tokens changed (APIKeyData.updated_at) since the last sync into the warm store. The
+    cached copies of the changed tokens are invalidated so that their next request uses the fresh record. Removed tokens
+    are only dropped by a full preload_auth_token_cache(...).
+
+    :param overlap: Rows changed up to overlap seconds before the last sync are read again to allow for clock skew
+                    between the hosts and for transactions still in flight at the last sync.
+    :return: The number of token records refreshed.
+    """
+    sync_time = time.time()
+
+    try:
+        query = _warm_record_query().filter(APIKeyData.updated_at >= _warm_token_details["synced_at"] - overlap)
+        records = dict(_warm_record_rows(query))
+    finally:
+        db.session.close()
+
+    with _warm_token_lock:
+        _warm_token_records.update(records)
+
+        for digest in records:
+            auth_token = _warm_token_keys.pop(digest, None)
+
+            if auth_token is not None:
+                auth_token_call_cache.pop(auth_token, None)
+                auth_token_desc_cache.pop(auth_token, None)
+
+    _warm_token_details["synced_at"] = sync_time
+    return len(records)
+
+
+def _get_warm_token_record(auth_token: str) -> Optional[tuple]:
+    """ The warm record of the token if in the warm store and synced within the staleness window, else None. """
+    if (not _warm_token_records) or \
+            (_auth_token_cache_staleness() >= auth_token_call_cache.ttl + _warm_token_details["refresh_interval"]):
+        return None
+
+    digest = token_digest(auth_token)
+
+    with _warm_token_lock:
+        record = _warm_token_records.get(digest)
+
+        if record is not None:
+            _warm_token_keys[digest] = auth_token
+
+    return record
+
+
+def enable_auth_token_cache_refresh(interval: float = 5.0,
+                                    full_sync_interval: float = 600.0) -> PeriodicTask:
+    """
+    Start a background refresher of the warm auth token records: Every interval seconds the records changed since the
+    last sync are pulled from the DB and every full_sync_interval seconds all the records are reloaded (which also drops
+    the removed tokens). Call once per worker process, within the app context e.g. after create_flask_app.
+
+    :return: The periodic refresh task.
+    """
+    global auth_token_cache_refresher
+
+    def sync():
+        if time.time() - _warm_token_details["full_synced_at"] >= full_sync_interval:
+            preload_auth_token_cache()
+        else:
+            refresh_auth_token_cache(overlap=max(interval, 5.0))
+
+    sync_in_app_context = _in_app_context(sync)
+
+    disable_auth_token_cache_refresh()
+
+    _warm_token_details["refresh_interval"] = interval
+
+    auth_token_cache_refresher = PeriodicTask(sync_in_app_context, interval, "tackle_auth_token_cache_refresher")
+    auth_token_cache_refresher.start()
+
+    return auth_token_cache_refresher
+
+
+def disable_auth_token_cache_refresh():
+    """ Stop the background refresher of the warm auth token records (if started). """
+    global auth_token_cache_refresher
+
+    if auth_token_cache_refresher is not None:
+        auth_token_cache_refresher.stop()
+        auth_token_cache_refresher = None
+
+    _warm_token_details["refresh_interval"] = 0.0
+
+
+def configure_negative_auth_token_cache(max_size: int = 10000,
+                                        ttl: Optional[float] = 5.0) -> None:
+    """
+    Configure the negative cache of the auth tokens found not to exist in the DB. Requests with such a token (e.g. from
+    scanners or misconfigured clients) are then rejected without a DB round trip for ttl seconds. A token added by
+    another process may therefore be rejected for up to ttl seconds.
+
+    :param max_size: The max number of invalid tokens to cache. The least recently used tokens are evicted first.
+    :param ttl: The time (in seconds) a token is remembered as invalid. 'None' to disable the negative cache.
+    """
+    global invalid_auth_token_cache
+
+    if ttl is None:
+        invalid_auth_token_cache = None
+    elif invalid_auth_token_cache is None:
+        invalid_auth_token_cache = TTLCache(max_size=max_size, ttl=ttl)
+    else:
+        invalid_auth_token_cache.configure(max_size, ttl)
+
+
+def _remember_invalid_auth_token(auth_token: str) -> None:
+    """ Record an auth token found not to exist in the DB in the negative cache (if enabled). """
+    if invalid_auth_token_cache is not None:
+        invalid_auth_token_cache[token_digest(auth_token)] = True
+
+
+def _early_rejection_reason(auth_token: str) -> Optional[str]:
+    """ The reason ('negative_cache' or 'filter') to reject the auth token without a DB round trip, else None. """
+    if (invalid_auth_token_cache is None) and (valid_token_filter is None):
+        return None
+
+    digest = token_digest(auth_token)
+
+    if (invalid_auth_token_cache is not None) and (digest in invalid_auth_token_cache):
+        return 'negative_cache'
+
+    bloom_filter = valid_token_filter
+    if (bloom_filter is not None) and (digest not in bloom_filter):
+        return 'filter'
+
+    return None
+
+
+def _auth_token_exists(auth_token: str) -> bool:
+    """ Executed within the caller's transaction. """
+    return db.session.query(APIKeyData.token_id).filter_by(key_digest=token_digest(auth_token)).first() is not None
+
+
+def build_valid_token_filter(false_positive_rate: float = 0.001,
+                             headroom: float = 0.25) -> BloomFilter:
+    """
+    Build a Bloom filter of the digests of all the auth tokens in the DB with one streamed query.
+
+    :param false_positive_rate: The target rate at which unknown tokens pass the filter (and are then looked up in the DB).
+    :param headroom: The fraction of extra capacity for the tokens added before the next rebuild.
+    """
+    try:
+        num_tokens = db.session.query(func.count(APIKeyData.token_id)).scalar()
+        bloom_filter = BloomFilter(capacity=int(max(num_tokens, 1000) * (1.0 + headroom)),
+                                   false_positive_rate=false_positive_rate)
+
+        query = db.session.query(APIKeyData.key_digest).execution_options(stream_results=True)
+
+        for row in query.yield_per(1000):
+            bloom_filter.add(row[0])
+    finally:
+        db.session.close()
+
+    return bloom_filter
+
+
+def _add_to_valid_token_filter(auth_token: str) -> None:
+    bloom_filter = valid_token_filter
+    if bloom_filter is not None:
+        bloom_filter.add(token_digest(auth_token))
+
+
+def _refresh_valid_token_filter(overlap: float) -> int:
+    """ Add the digests of the tokens added or changed (APIKeyData.updated_at) since the last sync to the filter. """
+    bloom_filter = valid_token_filter
+    sync_time = time.time()
+
+    if bloom_filter is None:
+        return 0
+
+    try:
+        query = db.session.query(APIKeyData.key_digest). \
+            filter(APIKeyData.updated_at >= _valid_token_filter_details["synced_at"] - overlap)
+        digests = [row[0] for row in query]
+    finally:
+        db.session.close()
+
+    for digest in digests:
+        bloom_filter.add(digest)
+
+    _valid_token_filter_details["synced_at"] = sync_time
+    return len(digests)
+
+
+def enable_valid_token_filter(false_positive_rate: float = 0.001,
+                              refresh_interval: float = 5.0,
+                              rebuild_interval: float = 600.0) -> PeriodicTask:
+    """
+    Reject the auth tokens not in a Bloom filter of all the valid token digests without a DB round trip. The tokens added
+    by other processes are added to the filter every refresh_interval seconds (and may be rejected until then); the
+    filter is rebuilt (dropping the removed tokens and resizing it) every rebuild_interval seconds. Call once per worker
+    process, within the app context e.g. after create_flask_app.
+
+    :param false_positive_rate: The target rate at which unknown tokens pass the filter (and are then looked up in the DB).
+    :return: The periodic refresh task.
+    """
+    global valid_token_filter_refresher
+
+    def rebuild():
+        global valid_token_filter
+
+        sync_time = time.time()
+        valid_token_filter = build_valid_token_filter(false_positive_rate)
+        _valid_token_filter_details["synced_at"] = sync_time
+        _valid_token_filter_details["full_synced_at"] = sync_time
+
+    def sync():
+        if time.time() - _valid_token_filter_details["full_synced_at"] >= rebuild_interval:
+            rebuild()
+        else:
+            _refresh_valid_token_filter(overlap=max(refresh_interval, 5.0))
+
+    sync_in_app_context = _in_app_context(sync)
+
+    disable_valid_token_filter()
+    rebuild()
+
+    valid_token_filter_refresher = PeriodicTask(sync_in_app_context, refresh_interval, "tackle_valid_token_filter_refresher")
+    valid_token_filter_refresher.start()
+
+    return valid_token_filter_refresher
+
+
+def disable_valid_token_filter():
+    """ Stop rejecting the auth tokens by the filter of the valid tokens (if enabled). """
+    global valid_token_filter
+    global valid_token_filter_refresher
+
+    if valid_token_filter_refresher is not None:
+        valid_token_filter_refresher.stop()
+        valid_token_filter_refresher = None
+
+    valid_token_filter = None
+
+
+set_gauge_function(promths_token_filter_size_gauge.labels(exec_id=promths_exec_id),
+                   lambda: 0 if valid_token_filter is None else valid_token_filter.size_bytes)
+set_gauge_function(promths_token_filter_fp_rate_gauge.labels(exec_id=promths_exec_id),
+                   lambda: 0.0 if valid_token_filter is None else valid_token_filter.false_positive_rate)
+
+
+def _allocate_token_ids(count: int) -> List[int]:
+    """
+    Allocate count compact token ids. On PostgreSQL the ids are taken from the api_key_token_id_seq sequence, so that
+    concurrent adds never share an id. SQLite has no sequences; the ids follow MAX(token_id) within the caller's
+    transaction and, as SQLite serialises its writers, a concurrent add fails on the unique constraint instead.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = select([APIKeyData.__table__.c.token_id.default.next_value()]). \
+            select_from(func.generate_series(1, count).alias())
+        return [token_id for token_id, in db.session.execute(query)]
+    else:
+        first_token_id = db.session.query(func.coalesce(func.max(APIKeyData.token_id), 0)).scalar() + 1
+        return list(range(first_token_id, first_token_id + count))
+
+
+class _KeepLimit(object):
+    """ The type of KEEP_LIMIT. """
+
+
+# The default of the rate limits of add_auth_token(...): Leaves the limit of an existing token unchanged (and a new
+# token without the limit).
+KEEP_LIMIT = _KeepLimit()
+
+
+def add_auth_token(auth_token: str, desc: Optional[str],
+                   call_count_limit: Optional[int] = None,
+                   call_count_limit_relative: bool = False,
+                   rate_limit_per_sec: Union[float, None, _KeepLimit] = KEEP_LIMIT,
+                   units_limit_per_min: Union[int, None, _KeepLimit] = KEEP_LIMIT) -> bool:
+    """
+    Add or update an auth token to the DB. Local cache will be updated during next API request in is_auth_token_valid(...)!
+
+    :param auth_token: The auth token to add/update.
+    :param desc: The description to apply to the token. 'None' to leave existing description unchanged.
+    :param call_count_limit: The call count limit to place on the token. 'None' to make unlimited.
+    :param call_count_limit_relative: If True then the limit will be relative to the current count. Default is False!
+    :param rate_limit_per_sec: The max number of requests per second. 'None' for no limit. KEEP_LIMIT (the default) to
+                               leave the limit of an existing token unchanged.
+    :param units_limit_per_min: The max number of call units per minute. 'None' for no limit. KEEP_LIMIT (the default)
+                                to leave the limit of an existing token unchanged.
+    :return: True/False indicating success of operation.
+    """
+    try:
+        query = db.session.query(APIKeyData)
+        instance = query.get(ident=token_digest(auth_token))
+
+        if instance:
+            if desc is not None:
+                instance.desc = desc
+
+            # Initialise the call_count if None.
+            if instance.call_count is None:
+                instance.call_count = 0
+
+            if (call_count_limit is None) or (call_count_limit_relative is False):
+                instance.call_count_limit = call_count_limit
+            else:
+                instance.call_count_limit = instance.call_count + call_count_limit
+
+            if not isinstance(rate_limit_per_sec, _KeepLimit):
+                instance.rate_limit_per_sec = rate_limit_per_sec
+            if not isinstance(units_limit_per_min, _KeepLimit):
+                instance.units_limit_per_min = units_limit_per_min
+        else:
+            instance = APIKeyData(token_digest(auth_token), _allocate_token_ids(1)[0],
+                                  str(desc), 0, call_count_limit,
+                                  None if isinstance(rate_limit_per_sec, _KeepLimit) else rate_limit_per_sec,
+                                  None if isinstance(units_limit_per_min, _KeepLimit) else units_limit_per_min)
+            db.session.add(instance)
+
+        instance.updated_at = time.time()
+        limits = (instance.rate_limit_per_sec, instance.units_limit_per_min)
+
+        db.session.commit()
+        invalidate_auth_token_cache(auth_token)
+        _add_to_valid_token_filter(auth_token)
+        rate_limiter.set_limits(auth_token, *limits)
+
+        if shared_counter_store is not None:
+            shared_counter_store.invalidate(token_digest(auth_token))  # Reload the limit.
+        return True
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def remove_auth_token(auth_token: str) -> bool:
+    """
+    Removes an auth token.
+
+    :param auth_token: The auth token to remove.
+    :return: True/False indicating success of operation.
+    """
+    try:
+        query = db.session.query(APIKeyData)
+        instance = query.get(ident=token_digest(auth_token))
+
+        if instance:
+            # Remove breakdown call counts for this auth token.
+            query = db.session.query(APICallCountBreakdownData)
+            query.filter_by(token_id=instance.token_id).delete(synchronize_session=False)
+
+            query = db.session.query(APICallCountShardData)
+            query.filter_by(token_id=instance.token_id).delete(synchronize_session=False)
+
+            db.session.delete(instance)
+            db.session.commit()
+            success = True
+        else:
+            success = False
+
+        if call_count_accumulator is not None:
+            call_count_accumulator.discard(auth_token)
+
+        invalidate_auth_token_cache(auth_token)
+        rate_limiter.forget(auth_token)
+
+        if shared_counter_store is not None:
+            shared_counter_store.invalidate(token_digest(auth_token), discard_pending=True)
+        return success
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def add_auth_tokens_bulk(auth_tokens: Iterable[Tuple[str, Optional[str]]],
+                         call_count_limit: Optional[int] = None,
+                         rate_limit_per_sec: Optional[float] = None,
+                         units_limit_per_min: Optional[int] = None,
+                         update_existing: bool = True,
+                         chunk_size: int = 1000,
+                         progress_callback: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Add or update many auth tokens with the same limits. Each chunk of tokens is written with one multi-row
+    INSERT ... ON CONFLICT in its own transaction, so a failure leaves the previous chunks committed.
+
+    :param auth_tokens: Iterable (e.g. a generator over a file) of (auth_token, desc) tuples. A desc of 'None' leaves
+                        the description of an existing token unchanged.
+    :param call_count_limit: The call count limit to place on the tokens. 'None' to make unlimited.
+    :param rate_limit_per_sec: The max number of requests per second. 'None' for no limit.
+    :param units_limit_per_min: The max number of call units per minute. 'None' for no limit.
+    :param update_existing: If True the desc and limits of existing tokens are updated, else existing tokens are left
+                            unchanged. The call counts of existing tokens are always kept.
+    :param chunk_size: The number of tokens per transaction.
+    :param progress_callback: Called with the number of tokens processed so far after each committed chunk.
+    :return: The number of tokens processed.
+    """
+    num_processed = 0
+
+    for chunk in chunked(auth_tokens, chunk_size):
+        rows_by_digest = {}  # type: Dict[bytes, Dict]  # Deduplicates; a multi-row upsert may not touch a row twice.
+
+        for auth_token, desc in chunk:
+            rows_by_digest[token_digest(auth_token)] = {'key_digest': token_digest(auth_token),
+                                                        'desc': desc,
+                                                        'call_count': 0,
+                                                        'call_count_limit': call_count_limit,
+                                                        'rate_limit_per_sec': rate_limit_per_sec,
+                                                        'units_limit_per_min': units_limit_per_min,
+                                                        'updated_at': time.time()}
+
+        try:
+            # The ids of the rows that turn out to be updates are left unused.
+            for row, token_id in zip(rows_by_digest.values(), _allocate_token_ids(len(rows_by_digest))):
+                row['token_id'] = token_id
+
+            update_columns = ['call_count_limit', 'rate_limit_per_sec', 'units_limit_per_min', 'updated_at'] \
+                if update_existing else []
+
+            # The rows without a desc keep the desc of an existing token, so they're upserted without it.
+            upsert_rows(APIKeyData, [row for row in rows_by_digest.values() if row['desc'] is not None],
+                        index_elements=['key_digest'],
+                        update_columns=(['desc'] + update_columns) if update_existing else [])
+            upsert_rows(APIKeyData, [row for row in rows_by_digest.values() if row['desc'] is None],
+                        index_elements=['key_digest'],
+                        update_columns=update_columns)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.close()
+
+        for auth_token, _ in chunk:
+            invalidate_auth_token_cache(auth_token)
+            _add_to_valid_token_filter(auth_token)
+
+            if update_existing:
+                rate_limiter.set_limits(auth_token, rate_limit_per_sec, units_limit_per_min)
+            else:
+                rate_limiter.forget(auth_token)  # Reloaded on the token's next reservation.
+
+            if shared_counter_store is not None:
+                shared_counter_store.invalidate(token_digest(auth_token))  # Reload the limit.
+
+        num_processed += len(chunk)
+        logging.info(f"wrapper_util.add_auth_tokens_bulk: {num_processed} auth tokens processed.")
+
+        if progress_callback is not None:
+            progress_callback(num_processed)
+
+    return num_processed
+
+
+def remove_auth_tokens_bulk(auth_tokens: Iterable[str],
+                            chunk_size: int = 1000,
+                            progress_callback: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Remove many auth tokens e.g. all the tokens of a tenant. The tokens and their call count rows are deleted per chunk
+    with set based DELETE ... WHERE ... IN (...) statements in one transaction per chunk.
+
+    :param auth_tokens: Iterable (e.g. a generator over a file) of the auth tokens to remove.
+    :param chunk_size: The number of tokens per transaction.
+    :param progress_callback: Called with the number of tokens processed so far after each committed chunk.
+    :return: The number of tokens removed. Tokens that don't exist are skipped.
+    """
+    num_processed = 0
+    num_removed = 0
+
+    for chunk in chunked(auth_tokens, chunk_size):
+        digests = list({token_digest(auth_token) for auth_token in chunk})
+
+        try:
+            token_ids = select([APIKeyData.token_id]).where(APIKeyData.key_digest.in_(digests))
+
+            query = db.session.query(APICallCountBreakdownData)
+            query.filter(APICallCountBreakdownData.token_id.in_(token_ids)).delete(synchronize_session=False)
+
+            query = db.session.query(APICallCountShardData)
+            query.filter(APICallCountShardData.token_id.in_(token_ids)).delete(synchronize_session=False)
+
+            query = db.session.query(APIKeyData)
+            num_removed += query.filter(APIKeyData.key_digest.in_(digests)).delete(synchronize_session=False)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.close()
+
+        for auth_token in chunk:
+            if call_count_accumulator is not None:
+                call_count_accumulator.discard(auth_token)
+
+            invalidate_auth_token_cache(auth_token)
+            rate_limiter.forget(auth_token)
+
+            if shared_counter_store is not None:
+                shared_counter_store.invalidate(token_digest(auth_token), discard_pending=True)
+
+        num_processed += len(chunk)
+        logging.info(f"wrapper_util.remove_auth_tokens_bulk: {num_processed} auth tokens processed.")
+
+        if progress_callback is not None:
+            progress_callback(num_processed)
+
+    return num_removed
+
+
+# Lightweight row of the token listings: (hex token digest, token id, desc, call count, call count limit).
+AuthTokenRow = Tuple[str, int, Optional[str], int, Optional[int]]
+
+
+def _auth_token_columns(model) -> list:
+    """ The columns of the AuthTokenRow listing of APIKeyData (or of the hex digest & desc of AdminAPIKeyData). """
+    if model is APIKeyData:
+        return [APIKeyData.key_digest, APIKeyData.token_id, APIKeyData.desc, _call_count_column(),
+                APIKeyData.call_count_limit]
+    else:
+        return [model.key_digest, model.desc]
+
+
+def _load_key_page(model, page_size: int, after: Optional[str]) -> Tuple[List[tuple], Optional[str]]:
+    """ One keyset page (ordered by key digest) of the token rows of model. See load_auth_token_page(...). """
+    try:
+        query = db.session.query(*_auth_token_columns(model))
+
+        if after is not None:
+            query = query.filter(model.key_digest > bytes.fromhex(after))
+
+        rows = [(row[0].hex(),) + tuple(row[1:]) for row in query.order_by(model.key_digest).limit(page_size)]
+    finally:
+        db.session.close()
+
+    return rows, (rows[-1][0] if len(rows) == page_size else None)
+
+
+def _iter_key_rows(model, batch_size: int) -> Iterator[tuple]:
+    """
+    Stream the token rows of model through a server-side cursor. See iter_auth_token_list(...). The rows are read on a
+    dedicated connection, so the stream neither holds nor is ended by the scoped session of the calling thread.
+    """
+    connection = db.engine.connect()
+
+    try:
+        result = connection.execution_options(stream_results=True).execute(select(_auth_token_columns(model)))
+
+        while True:
+            rows = result.fetchmany(batch_size)
+
+            if not rows:
+                return
+
+            for row in rows:
+                yield (row[0].hex(),) + tuple(row[1:])
+    finally:
+        connection.close()
+
+
+def load_auth_token_page(page_size: int = 1000,
+                         after: Optional[str] = None) -> Tuple[List[AuthTokenRow], Optional[str]]:
+    """
+    Get a page of the auth token rows ordered by token digest. Keyset pagination: Each page is one indexed range query
+    that only reads page_size rows, however deep into the table the page is.
+
+    :param page_size: The max number of rows in the page.
+    :param after: The hex token digest after which the page starts; the cursor returned with the previous page. 'None' for
+                  the first page.
+    :return: ([(hex token digest, token id, desc, call count, call count limit)], the cursor of the next page or None if
+             this is the last page).
+    """
+    return _load_key_page(APIKeyData, page_size, after)
+
+
+def load_admin_auth_token_page(page_size: int = 1000,
+                               after: Optional[str] = None) -> Tuple[List[Tuple[str, Optional[str]]], Optional[str]]:
+    """ As load_auth_token_page(...), but of the (hex token digest, desc) rows of the admin auth tokens. """
+    return _load_key_page(AdminAPIKeyData, page_size, after)
+
+
+def iter_auth_token_list(batch_size: int = 1000) -> Iterator[AuthTokenRow]:
+    """
+    Stream the auth token rows with constant memory: The rows are read in batches of batch_size through a server-side
+    cursor (on DBs that support it) as lightweight tuples instead of ORM instances. A DB connection is held until the
+    generator is exhausted or closed.
+
+    :return: Iterator of (hex token digest, token id, desc, call count, call count limit) tuples.
+    """
+    return _iter_key_rows(APIKeyData, batch_size)
+
+
+def iter_admin_auth_token_list(batch_size: int = 1000) -> Iterator[Tuple[str, Optional[str]]]:
+    """ As iter_auth_token_list(...), but of the (hex token digest, desc) rows of the admin auth tokens. """
+    return _iter_key_rows(AdminAPIKeyData, batch_size)
+
+
+def load_auth_token_list() -> List[str]:
+    """
+    Get the list of the auth tokens stored in the DB. Only the token digests are stored, so these are listed. See
+    iter_auth_token_list(...) and load_auth_token_page(...) to list large token tables.
+
+    :return: List[str] of hex token digests.
+    """
+    return [row[0] for row in iter_auth_token_list()]
+
+
+def get_auth_token_details(auth_token: str) -> Optional[Dict]:
+    """
+    Gets the desc, call_count and call_count_limit of an auth token.
+
+    :param auth_token: The auth token to get the details of.
+    :return: None if auth token not found, else {desc, call_count, call_count_limit}
+    """
+    return get_auth_token_details_many([auth_token])[auth_token]
+
+
+def get_auth_token_details_many(auth_tokens: Iterable[str],
+                                chunk_size: int = 1000) -> Dict[str, Optional[Dict]]:
+    """
+    Gets the details of many auth tokens with two set based queries per chunk of tokens (the token rows and the call
+    count breakdowns), loaded as column tuples without constructing ORM instances.
+
+    :param auth_tokens: The auth tokens to get the details of.
+    :param chunk_size: The max number of tokens per query.
+    :return: Dict of auth token -> None if the auth token wasn't found, else the details as from get_auth_token_details.
+    """
+    details_dict = {}  # type: Dict[str, Optional[Dict]]
+
+    try:
+        for chunk in chunked(auth_tokens, chunk_size):
+            tokens_by_digest = {token_digest(auth_token): auth_token for auth_token in chunk}
+
+            query = db.session.query(APIKeyData.key_digest, APIKeyData.token_id, APIKeyData.desc,
+                                     func.coalesce(APIKeyData.call_count, 0), APIKeyData.call_count_limit,
+                                     APIKeyData.rate_limit_per_sec, APIKeyData.units_limit_per_min)
+            rows = query.filter(APIKeyData.key_digest.in_(list(tokens_by_digest.keys()))).all()
+
+            details_by_id = {}  # type: Dict[int, Dict]
+
+            for auth_token in chunk:
+                details_dict[auth_token] = None
+
+            for key_digest, token_id, desc, call_count, call_count_limit, rate_limit_per_sec, units_limit_per_min in rows:
+                details_by_id[token_id] = {"token_id": token_id,
+                                           "desc": desc,
+                                           "call_count": call_count,
+                                           "call_count_limit": call_count_limit,
+                                           "rate_limit_per_sec": rate_limit_per_sec,
+                                           "units_limit_per_min": units_limit_per_min}
+                details_dict[tokens_by_digest[key_digest]] = details_by_id[token_id]
+
+            if not details_by_id:
+                continue
+
+            # The call count breakdowns plus the increments not yet folded in by the compaction of the sharded call counts.
+            breakdown_query = select([literal(False), APICallCountBreakdownData.token_id, APICallCountBreakdownData.endpoint,
+                                      APICallCountBreakdownData.call_count]). \
+                where(APICallCountBreakdownData.token_id.in_(list(details_by_id.keys())))
+            shard_query = select([literal(True), APICallCountShardData.token_id, APICallCountShardData.endpoint,
+                                  func.sum(APICallCountShardData.call_count)]). \
+                where(APICallCountShardData.token_id.in_(list(details_by_id.keys()))). \
+                group_by(APICallCountShardData.token_id, APICallCountShardData.endpoint)
+
+            for is_shard, token_id, endpoint, call_count in db.session.execute(breakdown_query.union_all(shard_query)):
+                auth_token_details = details_by_id[token_id]
+
+                if is_shard:
+                    auth_token_details['call_count'] += call_count
+
+                if endpoint:
+                    breakdown_dict = auth_token_details.setdefault('call_count_breakdown', {})
+                    breakdown_dict[endpoint] = breakdown_dict.get(endpoint, 0) + call_count
+    finally:
+        db.session.close()
+
+    return details_dict
+
+
+def add_admin_auth_token(auth_token: str, desc: str) -> bool:
+    """ Add or update an admin auth_token to the DB. """
+    try:
+        query = db.session.query(AdminAPIKeyData)
+        instance = query.get(ident=token_digest(auth_token))
+
+        if instance:
+            instance.desc = desc
+        else:
+            instance = AdminAPIKeyData(token_digest(auth_token), desc)
+            db.session.add(instance)
+
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def remove_admin_auth_token(auth_token: str) -> bool:
+    """
+    Removes an admin auth token.
+
+    :param auth_token: The auth token to remove.
+    :return: True/False indicating success of operation.
+    """
+    try:
+        query = db.session.query(AdminAPIKeyData)
+        instance = query.get(ident=token_digest(auth_token))
+
+        if instance:
+            db.session.delete(instance)
+            db.session.commit()
+            success = True
+        else:
+            success = False
+
+        return success
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def load_admin_auth_token_list() -> List[str]:
+    """
+    Get the list of adminauth tokens stored in the DB. Only the token digests are stored, so these are listed.
+
+    :return: List[str] of hex token digests.
+    """
+    return [row[0] for row in iter_admin_auth_token_list()]
+
+
+def add_default_auth_tokens():
+    """ Add some known auth tokens to the DB for ease of dev and use. """
+    # add_admin_auth_token('...', "Admin & Testing.")
+    # add_auth_token('...', "Admin & Testing.")
+    pass
+
+
+def is_auth_token_valid(auth_token: str) -> bool:
+    """
+    Checks if the auth token is a valid token and that its rate limit has not been exceeded. Also
+    updates the local call count and API key desc caches with the info from the DB.
+
+    :param auth_token: The auth token.
+    :return: True only if the token is a valid token and its rate limit has not been exceeded.
+    """
+
+    global __default_auth_tokens_configured
+
+    try:
+        # Check if the default tokens have been initialised.
+        if not __default_auth_tokens_configured:
+            add_default_auth_tokens()
+            __default_auth_tokens_configured = True
+
+        # 0 - Validate from the local cache if a TTL (staleness window) is configured and the token record is cached.
+        if auth_token_call_cache.ttl is not None:
+            cached_call_count_tuple = auth_token_call_cache.get(auth_token)
+
+            if cached_call_count_tuple is not None:
+                _count_cache_lookup("hit")
+                return (cached_call_count_tuple[1] is None) or (cached_call_count_tuple[0] < cached_call_count_tuple[1])
+
+            warm_record = _get_warm_token_record(auth_token)
+
+            if warm_record is not None:
+                _count_cache_lookup("warm_hit")
+                call_count, call_count_limit, desc, rate_limit_per_sec, units_limit_per_min = warm_record
+
+                if call_count_accumulator is not None:
+                    call_count += call_count_accumulator.pending_units(auth_token)
+
+                auth_token_call_cache[auth_token] = (call_count, call_count_limit)
+                auth_token_desc_cache[auth_token] = desc
+                rate_limiter.set_limits(auth_token, rate_limit_per_sec, units_limit_per_min)
+
+                return (call_count_limit is None) or (call_count < call_count_limit)
+
+            _count_cache_lookup("miss")
+
+        query = db.session.query(APIKeyData)
+        # query = query.options(load_only("key_digest", "desc", "call_count", "call_count_limit"))
+
+        instance = query.get(ident=token_digest(auth_token))
+
+        # 1 - Initialise call_count if None.
+        if instance and instance.call_count is None:
+            # Token valid, but call_count not assigned yet.
+            instance.call_count = 0
+            db.session.commit()
+
+        # 2 - Update the local call count cache which is updated and used later to build response headers, etc.
+        if instance:
+            call_count = instance.call_count
+
+            if _sharded_counter_details["num_shards"] > 0:
+                call_count += _shard_call_count(instance.token_id)
+
+            if call_count_accumulator is not None:
+                # Include the units accumulated locally, but not yet written to the DB.
+                call_count += call_count_accumulator.pending_units(auth_token)
+
+            auth_token_call_cache[auth_token] = (call_count, instance.call_count_limit)
+            auth_token_desc_cache[auth_token] = instance.desc
+            rate_limiter.set_limits(auth_token, instance.rate_limit_per_sec, instance.units_limit_per_min)
+        else:
+            call_count = 0
+            auth_token_call_cache.pop(auth_token, None)
+            auth_token_desc_cache.pop(auth_token, None)
+            rate_limiter.forget(auth_token)
+            _remember_invalid_auth_token(auth_token)
+
+        # 3 - Check that token is valid and rate limit (if any) not exceeded.
+        if instance and \
+                ((instance.call_count_limit is None) or
+                 (call_count < instance.call_count_limit)):
+            # Token valid AND (no rate limit OR rate limit not exceeded).
+            valid = True
+        else:
+            valid = False
+
+        return valid
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def _update_cached_call_count(auth_token: str, units: int):
+    """ Add units to the locally cached call count. The age of the cached record is NOT reset. """
+    cached_call_count_tuple = auth_token_call_cache.get(auth_token)
+    if cached_call_count_tuple is not None:
+        auth_token_call_cache.update_value(auth_token, (cached_call_count_tuple[0] + units, cached_call_count_tuple[1]))
+
+
+def _shard_index() -> int:
+    """ The shard of the calling worker thread. Spreads the concurrent increments of a hot token over its shard rows. """
+    return hash((os.getpid(), threading.get_ident())) % _sharded_counter_details["num_shards"]
+
+
+def _add_to_shards(token_id: int, endpoint: Optional[str], units: int):
+    """ Add units to the calling thread's shard row of the token and endpoint. Executed within the caller's transaction. """
+    upsert_rows(APICallCountShardData,
+                [{'token_id': token_id, 'endpoint': '' if endpoint is None else str(endpoint),
+                  'shard': _shard_index(), 'call_count': units}],
+                index_elements=['token_id', 'endpoint', 'shard'],
+                increment_columns=['call_count'])
+
+
+def _shard_call_count(token_id: int) -> int:
+    """ The sum of the shard rows of a token (over all endpoints). """
+    query = db.session.query(func.coalesce(func.sum(APICallCountShardData.call_count), 0))
+    return query.filter_by(token_id=token_id).scalar()
+
+
+def _call_count_column():
+    """ Column expression of a token's call count. Includes the sum of its shard rows if the sharded layout is enabled. """
+    if _sharded_counter_details["num_shards"] > 0:
+        shard_sum = select([func.coalesce(func.sum(APICallCountShardData.call_count), 0)]). \
+            where(APICallCountShardData.token_id == APIKeyData.token_id).as_scalar()
+
+        return func.coalesce(APIKeyData.call_count, 0) + shard_sum
+    else:
+        return func.coalesce(APIKeyData.call_count, 0)
+
+
+def _reserve_sharded_units(auth_token: str, units: int, endpoint: Optional[str]) -> bool:
+    """
+    Reserve units in a shard row of the token: One read of the token row plus the sum of its shards, then an upsert of the
+    calling thread's shard row. The token row itself isn't locked, so concurrent reservations may overshoot the call
+    count limit by up to the number of concurrent requests.
+
+    :return: True/False as for reserve_auth_token_units(...).
+    """
+    try:
+        query = db.session.query(APIKeyData.token_id, _call_count_column(), APIKeyData.call_count_limit, APIKeyData.desc,
+                                 APIKeyData.rate_limit_per_sec, APIKeyData.units_limit_per_min)
+        row = query.filter_by(key_digest=token_digest(auth_token)).first()
+
+        if row is None:
+            auth_token_call_cache.pop(auth_token, None)
+            auth_token_desc_cache.pop(auth_token, None)
+            rate_limiter.forget(auth_token)
+            _remember_invalid_auth_token(auth_token)
+            return False
+
+        token_id, call_count, call_count_limit = row[0], row[1], row[2]
+
+        auth_token_desc_cache[auth_token] = row[3]
+        rate_limiter.set_limits(auth_token, row[4], row[5])
+
+        if (call_count_limit is not None) and (call_count + units > call_count_limit):
+            auth_token_call_cache[auth_token] = (call_count, call_count_limit)
+            return False
+
+        _add_to_shards(token_id, endpoint, units)
+        db.session.commit()
+
+        auth_token_call_cache[auth_token] = (call_count + units, call_count_limit)
+        return True
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def _reserve_shared_units(store: SharedCounterStore, auth_token: str, units: int,
+                          endpoint: Optional[str]) -> Optional[bool]:
+    """
+    Reserve units in the shared counter store. The token record is (re)loaded from the DB when missing or older than the
+    max_age of the store; otherwise no DB access is needed.
+
+    :return: True/False as for reserve_auth_token_units(...). None if the store can't hold the token.
+    """
+    key_digest = token_digest(auth_token)
+    reserved, call_count, call_count_limit = store.reserve(key_digest, units,
+                                                           time.time() - _shared_counter_details["max_age"])
+
+    if reserved is None:
+        load_time = time.time()
+
+        try:
+            query = db.session.query(_call_count_column(), APIKeyData.call_count_limit, APIKeyData.desc,
+                                     APIKeyData.rate_limit_per_sec, APIKeyData.units_limit_per_min)
+            row = query.filter_by(key_digest=key_digest).first()
+        finally:
+            db.session.close()
+
+        if row is None:
+            auth_token_call_cache.pop(auth_token, None)
+            auth_token_desc_cache.pop(auth_token, None)
+            rate_limiter.forget(auth_token)
+            _remember_invalid_auth_token(auth_token)
+            return False
+
+        auth_token_desc_cache[auth_token] = row[2]
+        rate_limiter.set_limits(auth_token, row[3], row[4])
+
+        if not store.load_token(key_digest, row[0] or 0, row[1], load_time):
+            return None
+
+        reserved, call_count, call_count_limit = store.reserve(key_digest, units, load_time)
+
+        if reserved is None:
+            return None  # Invalidated in the meantime.
+
+    if reserved and not store.add_pending(key_digest, None if endpoint is None else str(endpoint), units):
+        store.charge(key_digest, -units)  # Undo; the store can't hold the endpoint.
+        return None
+
+    auth_token_call_cache[auth_token] = (call_count, call_count_limit)
+
+    return reserved
+
+
+def reserve_auth_token_units(auth_token: str, units: int,
+                             endpoint: Optional[str] = None) -> bool:
+    """
+    Validates the auth token and charges the units to it in one DB transaction: A conditional UPDATE that only increments
+    the call count if call_count + units <= call_count_limit (or if the token is unlimited). Concurrent requests can
+    therefore not all pass the limit check. Also updates the local call count and API key desc caches.
+
+    :param auth_token: The auth token.
+    :param units: The number of units of use to reserve.
+    :param endpoint: The endpoint to allocate the call count to.
+    :return: True only if the token is valid and the units were reserved within its rate limit.
+    """
+    global __default_auth_tokens_configured
+
+    # Check if the default tokens have been initialised.
+    if not __default_auth_tokens_configured:
+        add_default_auth_tokens()
+        __default_auth_tokens_configured = True
+
+    if shared_counter_store is not None:
+        reserved = _reserve_shared_units(shared_counter_store, auth_token, units, endpoint)
+
+        if reserved is not None:
+            return reserved
+        # else the shared counter store can't hold the token; fall back to the DB.
+
+    if _sharded_counter_details["num_shards"] > 0:
+        return _reserve_sharded_units(auth_token, units, endpoint)
+
+    try:
+        table = APIKeyData.__table__
+        call_count = func.coalesce(table.c.call_count, 0)  # Also initialises a call_count of None.
+
+        stmt = table.update(). \
+            where(table.c.key_digest == token_digest(auth_token)). \
+            where(or_(table.c.call_count_limit.is_(None), call_count + units <= table.c.call_count_limit)). \
+            values(call_count=call_count + units)
+
+        returned_columns = [table.c.call_count, table.c.call_count_limit, table.c.desc,
+                            table.c.rate_limit_per_sec, table.c.units_limit_per_min, table.c.token_id]
+
+        if db.session.get_bind().dialect.name == 'postgresql':
+            row = db.session.execute(stmt.returning(*returned_columns)).first()
+        elif db.session.execute(stmt).rowcount == 1:
+            # No UPDATE ... RETURNING; read the row back within the same transaction.
+            row = db.session.execute(select(returned_columns).where(table.c.key_digest == token_digest(auth_token))).first()
+        else:
+            row = None
+
+        # The conditional UPDATE doesn't tell an invalid token from an exceeded limit.
+        if (row is None) and (invalid_auth_token_cache is not None) and (not _auth_token_exists(auth_token)):
+            _remember_invalid_auth_token(auth_token)
+
+        if (row is not None) and (endpoint is not None):
+            upsert_rows(APICallCountBreakdownData,
+                        [{'token_id': row[5], 'endpoint': str(endpoint), 'call_count': units}],
+                        index_elements=['token_id', 'endpoint'],
+                        increment_columns=['call_count'])
+
+        db.session.commit()
+
+        # Update the local call count cache which is used later to build response headers, etc.
+        if row is not None:
+            auth_token_call_cache[auth_token] = (row[0], row[1])
+            auth_token_desc_cache[auth_token] = row[2]
+            rate_limiter.set_limits(auth_token, row[3], row[4])
+            return True
+        else:
+            auth_token_call_cache.pop(auth_token, None)  # Invalid token or rate limit exceeded.
+            return False
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def _add_to_token_shards(auth_token: str, endpoint: Optional[str], units: int):
+    """ Add units to the calling thread's shard row of the auth token and endpoint and update the local cache. """
+    try:
+        token_id = db.session.query(APIKeyData.token_id).filter_by(key_digest=token_digest(auth_token)).scalar()
+
+        if token_id is not None:
+            _add_to_shards(token_id, endpoint, units)
+            db.session.commit()
+
+        _update_cached_call_count(auth_token, units)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def release_auth_token_units(auth_token: str, units: int,
+                             endpoint: Optional[str] = None):
+    """
+    Releases units reserved with reserve_auth_token_units(...) e.g. when the call didn't succeed.
+
+    :param auth_token: The auth token.
+    :param units: The number of units of use to release.
+    :param endpoint: The endpoint the units were allocated to.
+    """
+    if (shared_counter_store is not None) and \
+            shared_counter_store.add_pending(token_digest(auth_token), None if endpoint is None else str(endpoint), -units):
+        shared_counter_store.charge(token_digest(auth_token), -units)
+        _update_cached_call_count(auth_token, -units)
+        return
+
+    if _sharded_counter_details["num_shards"] > 0:
+        _add_to_token_shards(auth_token, endpoint, -units)
+        return
+
+    try:
+        query = db.session.query(APIKeyData)
+        query.filter_by(key_digest=token_digest(auth_token)).update({'call_count': APIKeyData.call_count - units},
+                                                                    synchronize_session=False)
+
+        if endpoint is not None:
+            token_id = select([APIKeyData.token_id]).where(APIKeyData.key_digest == token_digest(auth_token)).as_scalar()
+
+            query = db.session.query(APICallCountBreakdownData)
+            query.filter(APICallCountBreakdownData.token_id == token_id,
+                         APICallCountBreakdownData.endpoint == str(endpoint)). \
+                update({'call_count': APICallCountBreakdownData.call_count - units}, synchronize_session=False)
+
+        db.session.commit()
+
+        _update_cached_call_count(auth_token, -units)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def increment_auth_token_call_count(auth_token: str, units: int,
+                                    endpoint: Optional[str] = None):
+    """
+    Increments the call count for the auth token - increments the DB and the local cache.
+
+    :param auth_token: The auth token.
+    :param units: The number of units of use.
+    :param endpoint: The endpoint to allocate the call count to.
+    """
+    if (shared_counter_store is not None) and \
+            shared_counter_store.add_pending(token_digest(auth_token), None if endpoint is None else str(endpoint), units):
+        # Shared counter store: Charge the shared count now; the elected flusher writes the units to the DB.
+        shared_counter_store.charge(token_digest(auth_token), units)
+        _update_cached_call_count(auth_token, units)
+        return
+
+    if call_count_accumulator is not None:
+        # Write-behind: Update the local call cache now and accumulate the DB update for the next flush.
+        _update_cached_call_count(auth_token, units)
+
+        call_count_accumulator.add(auth_token, None if endpoint is None else str(endpoint), units)
+        return
+
+    if _sharded_counter_details["num_shards"] > 0:
+        _add_to_token_shards(auth_token, endpoint, units)
+        return
+
+    try:
+        # Atomic update of call_count in DB.
+        query = db.session.query(APIKeyData)
+        query.filter_by(key_digest=token_digest(auth_token)).update({'call_count': APIKeyData.call_count + units})
+        db.session.commit()
+
+        # Update of the local call cache. Note: The age of the cached record is NOT reset; it is still refreshed from the DB.
+        _update_cached_call_count(auth_token, units)
+
+        if endpoint is not None:
+            token_id = db.session.query(APIKeyData.token_id).filter_by(key_digest=token_digest(auth_token)).scalar()
+
+            if token_id is not None:
+                # Atomic update of call count breakdown in DB. Adds the key,endpoint row if not yet present.
+                upsert_rows(APICallCountBreakdownData, [{'token_id': token_id, 'endpoint': str(endpoint), 'call_count': units}],
+                            index_elements=['token_id', 'endpoint'],
+                            increment_columns=['call_count'])
+                db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def _write_call_counts(pending: Dict[CallCountKey, int]):
+    """
+    Write an aggregate of (auth_token, endpoint) -> units to the DB in one transaction. See _write_digest_call_counts(...).
+    """
+    digest_pending = {}  # type: Dict[DigestCallCountKey, int]
+
+    for (auth_token, endpoint), units in pending.items():
+        key = (token_digest(auth_token), endpoint)
+        digest_pending[key] = digest_pending.get(key, 0) + units
+
+    _write_digest_call_counts(digest_pending)
+
+
+def _write_digest_call_counts(pending: Dict[DigestCallCountKey, int]):
+    """
+    Write an aggregate of (key_digest, endpoint) -> units to the DB in one transaction: One UPDATE of the APIKeyData
+    call counts and one multi-row UPSERT of the APICallCountBreakdownData call counts. With the sharded layout enabled,
+    one multi-row UPSERT of the calling thread's shard rows instead.
+    """
+    digest_units = {}  # type: Dict[bytes, int]
+
+    for (digest, endpoint), units in pending.items():
+        digest_units[digest] = digest_units.get(digest, 0) + units
+
+    try:
+        # The breakdown rows are keyed by token id. Tokens removed in the meantime have no id and are skipped.
+        query = db.session.query(APIKeyData.key_digest, APIKeyData.token_id)
+        token_ids = dict(query.filter(APIKeyData.key_digest.in_(list(digest_units.keys()))).all())
+
+        if _sharded_counter_details["num_shards"] > 0:
+            shard = _shard_index()
+            shard_rows = [{'token_id': token_ids[digest], 'endpoint': endpoint or '', 'shard': shard, 'call_count': units}
+                          for (digest, endpoint), units in pending.items() if digest in token_ids]
+
+            upsert_rows(APICallCountShardData, shard_rows,
+                        index_elements=['token_id', 'endpoint', 'shard'],
+                        increment_columns=['call_count'])
+            db.session.commit()
+            return
+
+        query = db.session.query(APIKeyData)
+        query.filter(APIKeyData.key_digest.in_(list(digest_units.keys()))). \
+            update({'call_count': APIKeyData.call_count + case(digest_units, value=APIKeyData.key_digest)},
+                   synchronize_session=False)
+
+        breakdown_rows = []  # type: List[Dict]
+
+        for (digest, endpoint), units in pending.items():
+            token_id = token_ids.get(digest)
+
+            if (endpoint is not None) and (token_id is not None):
+                breakdown_rows.append({'token_id': token_id, 'endpoint': endpoint, 'call_count': units})
+
+        upsert_rows(APICallCountBreakdownData, breakdown_rows,
+                    index_elements=['token_id', 'endpoint'],
+                    increment_columns=['call_count'])
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def enable_call_count_write_behind(max_pending: int = 1000,
+                                   max_delay: float = 5.0) -> CallCountAccumulator:
+    """
+    Enable write-behind of the call counts: increment_auth_token_call_count(...) accumulates the units in memory and these
+    are written to the DB in bulk when max_pending (auth_token, endpoint) keys are pending or every max_delay seconds.
+    The remaining units are flushed at process exit. Must be called within the app context e.g. after create_flask_app.
+
+    :param max_pending: The number of pending (auth_token, endpoint) keys that triggers a flush.
+    :param max_delay: The max time (in seconds) that call counts are held in memory.
+    :return: The call count accumulator.
+    """
+    global call_count_accumulator
+
+    flush_in_app_context = _in_app_context(_write_call_counts)
+
+    disable_call_count_write_behind()
+
+    call_count_accumulator = CallCountAccumulator(flush_in_app_context, max_pending, max_delay)
+    call_count_accumulator.start()
+
+    return call_count_accumulator
+
+
+def disable_call_count_write_behind():
+    """ Stop the write-behind of call counts (if enabled) and flush the accumulated call counts to the DB. """
+    global call_count_accumulator
+
+    if call_count_accumulator is not None:
+        accumulator = call_count_accumulator
+        call_count_accumulator = None  # New call counts go straight to the DB from here on.
+
+        accumulator.stop()
+        accumulator.flush()
+
+
+def flush_call_counts() -> int:
+    """
+    Flush the call counts accumulated by the write-behind (if enabled) to the DB.
+
+    :return: The number of (auth_token, endpoint) keys flushed.
+    """
+    if call_count_accumulator is not None:
+        return call_count_accumulator.flush()
+    else:
+        return 0
+
+
+# Guaranteed flush of the accumulated call counts on shutdown.
+atexit.register(disable_call_count_write_behind)
+
+
+def compact_call_count_shards(batch_size: int = 1000) -> int:
+    """
+    Fold the shard rows of the sharded call count layout into the APIKeyData and APICallCountBreakdownData rows: Per
+    transaction a batch of shard rows is locked (skipping rows locked by a concurrent compaction), added to the token
+    and breakdown rows and deleted.
+
+    :param batch_size: The max number of shard rows folded per transaction.
+    :return: The number of shard rows folded.
+    """
+    num_folded = 0
+
+    while True:
+        try:
+            query = db.session.query(APICallCountShardData).with_for_update(skip_locked=True)
+            shard_rows = query.limit(batch_size).all()
+
+            if not shard_rows:
+                break
+
+            token_units = {}  # type: Dict[int, int]
+            breakdown_units = {}  # type: Dict[Tuple[int, str], int]
+
+            for row in shard_rows:
+                token_units[row.token_id] = token_units.get(row.token_id, 0) + row.call_count
+
+                if row.endpoint:
+                    key = (row.token_id, row.endpoint)
+                    breakdown_units[key] = breakdown_units.get(key, 0) + row.call_count
+
+            query = db.session.query(APIKeyData)
+            query.filter(APIKeyData.token_id.in_(list(token_units.keys()))). \
+                update({'call_count': func.coalesce(APIKeyData.call_count, 0) + case(token_units, value=APIKeyData.token_id)},
+                       synchronize_session=False)
+
+            upsert_rows(APICallCountBreakdownData,
+                        [{'token_id': token_id, 'endpoint': endpoint, 'call_count': units}
+                         for (token_id, endpoint), units in breakdown_units.items()],
+                        index_elements=['token_id', 'endpoint'],
+                        increment_columns=['call_count'])
+
+            query = db.session.query(APICallCountShardData)
+            query.filter(tuple_(APICallCountShardData.token_id, APICallCountShardData.endpoint, APICallCountShardData.shard).
+                         in_([(row.token_id, row.endpoint, row.shard) for row in shard_rows])). \
+                delete(synchronize_session=False)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.close()
+
+        num_folded += len(shard_rows)
+
+        if len(shard_rows) < batch_size:
+            break
+
+    return num_folded
+
+
+def enable_sharded_call_counts(num_shards: int = 8,
+                               compaction_interval: float = 60.0) -> PeriodicTask:
+    """
+    Enable the sharded call count layout: The call count increments of a token go to one of num_shards shard rows per
+    endpoint (chosen by worker thread) instead of all serialising on the token's row lock. Reads sum the shards and the
+    shards are folded back into the token and breakdown rows every compaction_interval seconds. Note that the call count
+    limit may then be overshot by up to the number of concurrent requests of the token. Call once per worker process,
+    within the app context e.g. after create_flask_app.
+
+    :param num_shards: The number of shard rows per token and endpoint. Should be >= the number of concurrent workers.
+    :param compaction_interval: The time (in seconds) between compactions.
+    :return: The periodic compaction task.
+    """
+    global call_count_compactor
+
+    compact_in_app_context = _in_app_context(compact_call_count_shards)
+
+    disable_sharded_call_counts()
+
+    _sharded_counter_details["num_shards"] = num_shards
+
+    call_count_compactor = PeriodicTask(compact_in_app_context, compaction_interval, "tackle_call_count_compactor")
+    call_count_compactor.start()
+
+    return call_count_compactor
+
+
+def disable_sharded_call_counts():
+    """ Stop the sharded call count layout (if enabled) and fold the remaining shards into the token and breakdown rows. """
+    global call_count_compactor
+
+    if call_count_compactor is not None:
+        call_count_compactor.stop()
+        _sharded_counter_details["num_shards"] = 0
+
+        call_count_compactor.run()
+        call_count_compactor = None
+
+
+def _get_worker_id() -> str:
+    """ The id of this worker process. Evaluated per call since pre-forked workers inherit the module state. """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _reconcile_rate_limits(interval: float):
+    """
+    Reconcile the local rate limiter through the DB: Record this worker's heartbeat, divide the rate limits equally
+    between the live workers and reload the limits of the tracked auth tokens (e.g. after an update by another process).
+    """
+    current_time = time.time()
+    tracked_tokens = rate_limiter.tracked_tokens()
+
+    try:
+        upsert_rows(RateLimitWorkerData, [{'worker_id': _get_worker_id(), 'last_seen': current_time}],
+                    index_elements=['worker_id'],
+                    update_columns=['last_seen'])
+
+        # Workers that missed three heartbeats are considered gone.
+        query = db.session.query(RateLimitWorkerData)
+        query.filter(RateLimitWorkerData.last_seen < current_time - 3.0 * interval).delete(synchronize_session=False)
+
+        num_workers = db.session.query(RateLimitWorkerData).count()
+
+        if tracked_tokens:
+            digest_tokens = {token_digest(auth_token): auth_token for auth_token in tracked_tokens}
+
+            query = db.session.query(APIKeyData.key_digest, APIKeyData.rate_limit_per_sec, APIKeyData.units_limit_per_min)
+            query = query.filter(APIKeyData.key_digest.in_(list(digest_tokens.keys())))
+            token_limits = {digest_tokens[row[0]]: (row[1], row[2]) for row in query}
+        else:
+            token_limits = {}
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+    rate_limiter.configure_worker_share(1.0 / max(num_workers, 1))
+
+    for auth_token in tracked_tokens:
+        requests_per_sec, units_per_min = token_limits.get(auth_token, (None, None))  # Removed tokens have no limits.
+        rate_limiter.set_limits(auth_token, requests_per_sec, units_per_min)
+
+
+def enable_rate_limit_reconciliation(interval: float = 10.0) -> PeriodicTask:
+    """
+    Enable the periodic reconciliation of the rate limits through the DB so that the worker processes (e.g. pre-forked
+    gunicorn workers) each enforce an equal share of every token's rate limits. Call once per worker process, within the
+    app context e.g. after create_flask_app. The rate_limit_worker_data table must exist.
+
+    :param interval: The time (in seconds) between reconciliations. A worker that misses three is considered gone.
+    :return: The periodic reconciliation task.
+    """
+    global rate_limit_reconciler
+
+    reconcile_in_app_context = _in_app_context(lambda: _reconcile_rate_limits(interval))
+
+    disable_rate_limit_reconciliation()
+
+    rate_limit_reconciler = PeriodicTask(reconcile_in_app_context, interval, "tackle_rate_limit_reconciler")
+    rate_limit_reconciler.run()
+    rate_limit_reconciler.start()
+
+    return rate_limit_reconciler
+
+
+def disable_rate_limit_reconciliation():
+    """ Stop the reconciliation of the rate limits (if enabled) and enforce the full limits in this process again. """
+    global rate_limit_reconciler
+
+    if rate_limit_reconciler is not None:
+        rate_limit_reconciler.stop()
+        rate_limit_reconciler = None
+
+        try:
+            query = db.session.query(RateLimitWorkerData)
+            query.filter_by(worker_id=_get_worker_id()).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.close()
+
+        rate_limiter.configure_worker_share(1.0)
+
+
+def _flush_shared_counts(elect: bool = True) -> int:
+    """
+    Write the pending units of the shared counter store to the DB if this process is the elected flusher.
+
+    :param elect: Only flush if elected. False to flush regardless e.g. at shutdown.
+    :return: The number of (auth_token, endpoint) keys flushed.
+    """
+    store = shared_counter_store
+
+    if (store is None) or (elect and not store.try_become_flusher()):
+        return 0
+
+    pending = store.take_pending()
+
+    if pending:
+        try:
+            _write_digest_call_counts(pending)
+        except Exception:
+            store.complete_flush(pending, success=False)
+            raise
+
+        store.complete_flush(pending, success=True)
+
+    # Free the slots of idle tokens e.g. removed ones or those of a previous deployment.
+    store.sweep(_shared_counter_details["max_idle"])
+
+    return len(pending)
+
+
+def enable_shared_counter_store(path: Optional[str] = None,
+                                num_slots: int = 16384,
+                                max_age: float = 5.0,
+                                flush_interval: float = 5.0,
+                                max_idle: float = 3600.0) -> SharedCounterStore:
+    """
+    Enable the call count store shared by the worker processes (e.g. pre-forked gunicorn workers) of a host through an
+    mmap'd file. Tokens are validated and charged in the shared store; a token's record is only read from the DB when it
+    is older than max_age. One elected worker writes the accumulated units to the DB every flush_interval seconds. Call
+    once per worker process, within the app context e.g. after create_flask_app.
+
+    :param path: The path of the shared file. 'None' for a file in the temp dir.
+    :param num_slots: The number of slots of a new file. Each token uses one slot plus one per endpoint it is charged to.
+    :param max_age: The max age (in seconds) of a token record before it is reloaded e.g. to pick up call counts from
+                    other hosts and changed limits.
+    :param flush_interval: The time (in seconds) between flushes of the accumulated units to the DB.
+    :param max_idle: The time (in seconds) after which the slots of unused tokens are freed. Slots are also evicted (and
+                     their tokens reloaded from the DB) when the store is full.
+    :return: The shared counter store.
+    """
+    global shared_counter_store, shared_counter_flusher
+
+    flush_in_app_context = _in_app_context(_flush_shared_counts)
+
+    disable_shared_counter_store()
+
+    shared_counter_store = SharedCounterStore(path or os.path.join(tempfile.gettempdir(), 'tackle_shared_counters'),
+                                              num_slots)
+    _shared_counter_details["max_age"] = max_age
+    _shared_counter_details["max_idle"] = max_idle
+    _shared_counter_details["flush_fn"] = flush_in_app_context
+
+    shared_counter_flusher = PeriodicTask(flush_in_app_context, flush_interval, "tackle_shared_counter_flusher")
+    shared_counter_flusher.start()
+
+    return shared_counter_store
+
+
+def disable_shared_counter_store():
+    """ Stop using the shared counter store (if enabled) after flushing its pending units to the DB. """
+    global shared_counter_store, shared_counter_flusher
+
+    if shared_counter_store is not None:
+        if shared_counter_flusher is not None:
+            shared_counter_flusher.stop()
+            shared_counter_flusher = None
+
+        try:
+            _shared_counter_details["flush_fn"](elect=False)
+        finally:
+            shared_counter_store.close()
+            shared_counter_store = None
+
+
+# Flush the units of the shared counter store on shutdown.
+atexit.register(disable_shared_counter_store)
+
+
+def is_admin_auth_token_valid(auth_token: str) -> bool:
+    global __default_auth_tokens_configured
+
+    # Check if the default tokens have been initialised.
+    if not __default_auth_tokens_configured:
+        add_default_auth_tokens()
+        __default_auth_tokens_configured = True
+
+    query = db.session.query(AdminAPIKeyData)
+    query = query.options(load_only("key_digest"))
+
+    instance = query.get(ident=token_digest(auth_token))
+
+    if instance:
+        valid = True
+    else:
+        valid = False
+
+    db.session.close()
+    return valid
+
+
+# =============================
+# Jobs: Long running wrapper calls queued to a background executor. The job state is kept in the DB so that any worker
+# process can serve the polls of a job, but the queue is local to the process that accepted the job.
+def configure_jobs(max_workers: int = 4,
+                   max_pending: int = 1000,
+                   result_ttl: float = 3600.0,
+                   max_duration: float = 86400.0):
+    """
+    Configure the background executor of the wrapper functions decorated with job_decorator.
+
+    :param max_workers: The max number of jobs run concurrently.
+    :param max_pending: The max number of jobs queued or running in this process. More are rejected with a 503.
+    :param result_ttl: The time (in seconds) a completed job's status and result are kept for.
+    :param max_duration: The time (in seconds) after which the record of a job that hasn't completed (e.g. its process
+                         exited) is deleted.
+    """
+    with _job_lock:
+        previous_executor = _job_details["executor"]
+
+        _job_details.update({"executor": None, "max_workers": max_workers, "max_pending": max_pending,
+                             "result_ttl": result_ttl, "max_duration": max_duration})
+
+    if previous_executor is not None:
+        previous_executor.shutdown(wait=False)
+
+
+def _job_executor() -> ThreadPoolExecutor:
+    with _job_lock:
+        if _job_details["executor"] is None:
+            _job_details["executor"] = ThreadPoolExecutor(max_workers=_job_details["max_workers"], thread_name_prefix='tackle_job')
+
+        return _job_details["executor"]
+
+
+def job_decorator(f: Optional[Callable] = None,
+                  policy: Optional[ConcurrencyPolicy] = None):
+    """
+    Decorator to run a long running wrapper function as a job; use it in place of @auth_decorator and @lock_decorator.
+    The auth token and its rate limits are checked and the call is queued to a background executor, returning
+    (202, {"job_id": ..., "status": "queued"}) right away. The job's status and result are polled with get_job(...) e.g.
+    GET /jobs/{job_id}. The call units are charged with increment_auth_token_call_count(...) once the job succeeds, so
+    concurrent jobs of a token may overshoot its call count limit. See configure_jobs(...).
+
+    :param f: The wrapper function when used as @job_decorator without arguments.
+    :param policy: The concurrency policy the job acquires before it runs (see lock_decorator). 'None' for the
+                   default_concurrency_policy.
+    """
+    if f is None:
+        return lambda _f: job_decorator(_f, policy=policy)
+
+    locked_f = lock_decorator(f, policy=policy)
+
+    @wraps(f)
+    def decorated_f(*args, **kwargs):
+        # A pending slot is taken before the job is checked, so that concurrent requests can't overshoot max_pending.
+        with _job_lock:
+            slot_taken = _job_details["pending"] < _job_details["max_pending"]
+
+            if slot_taken:
+                _job_details["pending"] += 1
+
+        if not slot_taken:
+            logging.info("job_decorator: %s: Too many pending jobs!", f.__name__)
+            bounded_labels(promths_http_response_counter, {'auth_desc': promths_auth_desc_limiter},
+                           exec_id=promths_exec_id,
+                           auth_desc=auth_token_desc_cache.get(kwargs.get('auth_token'), "[Not in cache!]"),
+                           endpoint=f.__name__, status=503).inc()
+            return 503, {"error_detail": "Too many pending jobs! Please retry later."}
+
+        state = None  # type: Optional[AuthCallState]
+
+        try:
+            rejection, state = _auth_before_call(f.__name__, kwargs, allow_reserve=False)
+
+            if rejection is not None:
+                with _job_lock:
+                    _job_details["pending"] -= 1
+                return rejection
+
+            assert state is not None
+            job_id = uuid.uuid4().hex
+            _create_job(job_id, kwargs['auth_token'], f.__name__)
+
+            app = current_app._get_current_object()  # type: ignore[attr-defined]  # pylint: disable=protected-access
+            _job_executor().submit(_run_job, app, job_id, f.__name__, locked_f, args, kwargs, state)
+        except Exception:
+            if state is not None:
+                _auth_call_failed(f.__name__, kwargs, state)
+
+            with _job_lock:
+                _job_details["pending"] -= 1
+            raise
+
+        logging.info("job_decorator: %s: Queued job %s.", f.__name__, job_id)
+        return 202, {"job_id": job_id, "status": "queued"}
+
+    return decorated_f
+
+
+def _run_job(app, job_id: str, endpoint: str, f: Callable, args, kwargs, state: AuthCallState):
+    """ Run a queued job in the background executor and record its result. Charges the call units if it succeeds. """
+    try:
+        with app.app_context():
+            _update_job(job_id, 'running')
+            start_time = time.time()
+
+            try:
+                response_code, response_json = f(*args, **kwargs)
+            except Exception:  # Logged and counted by lock_decorator.
+                _auth_call_failed(endpoint, kwargs, state)
+                _update_job(job_id, 'failed', 500, json.dumps({"error_detail": "Internal server error!"}))
+                return
+
+            # Encoded before the call units are charged, so that a result that can't be stored isn't charged.
+            try:
+                result = json.dumps(response_json)
+            except (TypeError, ValueError) as e:
+                logging.exception(f"wrapper_util._run_job: Failed to encode the result of job {job_id}: {e}!")
+                _auth_call_failed(endpoint, kwargs, state)
+                _update_job(job_id, 'failed', 500, json.dumps({"error_detail": "Internal server error!"}))
+                return
+
+            _auth_after_call(endpoint, kwargs, state, response_code, time.time() - start_time)
+
+            _update_job(job_id, 'succeeded' if 200 <= response_code <= 299 else 'failed', response_code, result)
+    except Exception as e:
+        logging.exception(f"wrapper_util._run_job: Failed to run job {job_id}: {e}!")
+    finally:
+        with _job_lock:
+            _job_details["pending"] -= 1
+
+
+def _create_job(job_id: str, auth_token: str, endpoint: str):
+    now = time.time()
+
+    try:
+        db.session.add(APIJobData(job_id, token_digest(auth_token), endpoint, 'queued',
+                                  now, now + _job_details["max_duration"]))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def _update_job(job_id: str, status: str,
+                response_code: Optional[int] = None,
+                result: Optional[str] = None):
+    """
+    Update the status of a job. The completed jobs (with a response code) are kept for the result TTL.
+
+    :param result: The JSON encoded response of a completed job.
+    """
+    now = time.time()
+    values = {'status': status, 'updated_at': now}  # type: Dict[str, Any]
+
+    if response_code is not None:
+        values.update({'response_code': response_code,
+                       'result': result,
+                       'expires_at': now + _job_details["result_ttl"]})
+
+    try:
+        db.session.query(APIJobData).filter_by(job_id=job_id).update(values, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def get_job(auth_token: str, job_id: str) -> Optional[Dict]:
+    """
+    The status (and, once completed, the response code and result) of a job.
+
+    :return: None if the job wasn't found, has expired or wasn't queued by the auth token.
+    """
+    try:
+        job = db.session.query(APIJobData).get(job_id)
+
+        if (job is None) or (job.key_digest != token_digest(auth_token)) or (job.expires_at <= time.time()):
+            return None
+
+        return {'job_id': job.job_id,
+                'endpoint': job.endpoint,
+                'status': job.status,
+                'response_code': job.response_code,
+                'result': None if job.result is None else json.loads(job.result),
+                'created_at': job.created_at,
+                'updated_at': job.updated_at}
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def delete_expired_jobs() -> int:
+    """ Delete the records of the expired jobs. Returns the number of jobs deleted. """
+    try:
+        num_deleted = db.session.query(APIJobData).filter(APIJobData.expires_at <= time.time()).delete(synchronize_session=False)
+        db.session.commit()
+        return num_deleted
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def enable_job_cleanup(interval: float = 60.0) -> PeriodicTask:
+    """
+    Periodically delete the records of the expired jobs. Call within the app context e.g. after create_flask_app. One
+    process doing the cleanup is enough, but more don't conflict.
+
+    :param interval: The time (in seconds) between cleanups.
+    :return: The periodic cleanup task.
+    """
+    global job_cleaner
+
+    cleanup_in_app_context = _in_app_context(delete_expired_jobs)
+
+    disable_job_cleanup()
+
+    job_cleaner = PeriodicTask(cleanup_in_app_context, interval, "tackle_job_cleaner")
+    job_cleaner.start()
+
+    return job_cleaner
+
+
+def disable_job_cleanup():
+    """ Stop the periodic cleanup of the expired jobs (if enabled). """
+    global job_cleaner
+
+    if job_cleaner is not None:
+        job_cleaner.stop()
+        job_cleaner = None
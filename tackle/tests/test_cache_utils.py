@@ -0,0 +1,69 @@
+import unittest
+import time
+
+from tackle.cache_utils import TTLCache, BloomFilter
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(max_size=2)
+
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)  # 'a' is now the most recently used entry.
+
+        cache['c'] = 3
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache['a'], 1)
+        self.assertEqual(cache['c'], 3)
+
+    def test_ttl_eviction(self):
+        cache = TTLCache(max_size=10, ttl=0.05)
+
+        cache['a'] = 1
+        self.assertEqual(cache.get('a'), 1)
+
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_update_value_keeps_age(self):
+        cache = TTLCache(max_size=10, ttl=0.1)
+
+        cache['a'] = (1, None)
+        time.sleep(0.06)
+        self.assertTrue(cache.update_value('a', (2, None)))
+        self.assertEqual(cache.get('a'), (2, None))
+
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'))  # Expired relative to when it was originally set.
+        self.assertFalse(cache.update_value('a', (3, None)))
+
+    def test_configure_shrinks(self):
+        cache = TTLCache(max_size=10)
+
+        for i in range(10):
+            cache[i] = i
+
+        cache.configure(max_size=3, ttl=None)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.pop(9), 9)
+        self.assertIsNone(cache.pop(0))
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_membership(self):
+        bloom_filter = BloomFilter(capacity=1000, false_positive_rate=0.01)
+
+        for i in range(1000):
+            bloom_filter.add(f"valid_{i}".encode())
+
+        # No false negatives.
+        self.assertTrue(all(f"valid_{i}".encode() in bloom_filter for i in range(1000)))
+
+        # About false_positive_rate false positives at capacity.
+        num_false_positives = sum(f"invalid_{i}".encode() in bloom_filter for i in range(10000))
+        self.assertLess(num_false_positives, 300)
+        self.assertAlmostEqual(bloom_filter.false_positive_rate, 0.01, delta=0.005)
+        self.assertEqual(bloom_filter.count, 1000)
@@ -0,0 +1,81 @@
+import time
+import threading
+import unittest
+from typing import Dict, List  # noqa # pylint: disable=unused-import
+
+from tackle.rest_api.call_count_accumulator import CallCountAccumulator, CallCountKey  # noqa # pylint: disable=unused-import
+
+
+class TestCallCountAccumulator(unittest.TestCase):
+    def test_flush_on_max_pending(self):
+        flushed = []  # type: List[Dict[CallCountKey, int]]
+        flushed_event = threading.Event()
+
+        def flush(pending):
+            flushed.append(pending)
+            flushed_event.set()
+
+        accumulator = CallCountAccumulator(flush, max_pending=2, max_delay=60.0)
+        accumulator.start()
+
+        try:
+            accumulator.add('token_a', 'get_details', 1)
+            accumulator.add('token_a', 'get_details', 2)
+            self.assertEqual(flushed, [])
+            self.assertEqual(accumulator.pending_units('token_a'), 3)
+
+            # Signals the flush thread; the caller doesn't flush.
+            accumulator.add('token_a', 'get_status', 1)
+            self.assertTrue(flushed_event.wait(5.0))
+            self.assertEqual(flushed, [{('token_a', 'get_details'): 3, ('token_a', 'get_status'): 1}])
+            self.assertEqual(accumulator.pending_units('token_a'), 0)
+        finally:
+            accumulator.stop()
+
+    def test_add_never_raises(self):
+        def failing_flush(pending):
+            raise RuntimeError("DB down!")
+
+        accumulator = CallCountAccumulator(failing_flush, max_pending=1, max_delay=60.0)
+        accumulator.start()
+
+        try:
+            accumulator.add('token_a', None, 2)
+            accumulator.add('token_a', None, 3)
+            time.sleep(0.1)
+            self.assertEqual(accumulator.pending_units('token_a'), 5)
+        finally:
+            accumulator.stop()
+
+    def test_failed_flush_keeps_units(self):
+        def failing_flush(pending):
+            raise RuntimeError("DB down!")
+
+        accumulator = CallCountAccumulator(failing_flush, max_pending=100, max_delay=60.0)
+        accumulator.add('token_a', None, 5)
+
+        with self.assertRaises(RuntimeError):
+            accumulator.flush()
+
+        self.assertEqual(accumulator.pending_units('token_a'), 5)
+
+        accumulator.discard('token_a')
+        self.assertEqual(accumulator.pending_units('token_a'), 0)
+        self.assertEqual(accumulator.flush(), 0)
+
+    def test_discard_during_flush(self):
+        def discarding_flush(pending):
+            accumulator.discard('token_a')
+            self.assertEqual(accumulator.pending_units('token_a'), 0)
+            raise RuntimeError("DB down!")
+
+        accumulator = CallCountAccumulator(discarding_flush, max_pending=100, max_delay=60.0)
+        accumulator.add('token_a', None, 5)
+        accumulator.add('token_b', None, 1)
+
+        with self.assertRaises(RuntimeError):
+            accumulator.flush()
+
+        # The units of the discarded token aren't returned to pending.
+        self.assertEqual(accumulator.pending_units('token_a'), 0)
+        self.assertEqual(accumulator.pending_units('token_b'), 1)
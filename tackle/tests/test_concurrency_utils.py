@@ -0,0 +1,68 @@
+import unittest
+import threading
+import time
+
+from tackle.concurrency_utils import SemaphorePolicy, ReadPolicy, WritePolicy, ExclusivePolicy
+from tackle.concurrency_utils import UtilisationTracker
+
+
+class TestConcurrencyPolicies(unittest.TestCase):
+    @staticmethod
+    def _max_concurrency(policies, num_threads: int = 6) -> int:
+        """ Run num_threads calls (cycling through policies) and return the max number of calls active at once. """
+        state = {'active': 0, 'max_active': 0}
+        state_lock = threading.Lock()
+
+        def call(policy):
+            policy.acquire()
+            try:
+                with state_lock:
+                    state['active'] += 1
+                    state['max_active'] = max(state['max_active'], state['active'])
+                time.sleep(0.05)
+                with state_lock:
+                    state['active'] -= 1
+            finally:
+                policy.release()
+
+        threads = [threading.Thread(target=call, args=(policies[i % len(policies)],)) for i in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return state['max_active']
+
+    def test_semaphore_limit(self):
+        self.assertEqual(self._max_concurrency([SemaphorePolicy('test_semaphore', 2)]), 2)
+
+        with self.assertRaises(ValueError):
+            SemaphorePolicy('test_semaphore', 3)
+
+    def test_exclusive_shared_by_name(self):
+        self.assertEqual(self._max_concurrency([ExclusivePolicy('test_exclusive'), ExclusivePolicy('test_exclusive')]), 1)
+
+    def test_read_write(self):
+        self.assertEqual(self._max_concurrency([ReadPolicy('test_rw')]), 6)
+        self.assertEqual(self._max_concurrency([WritePolicy('test_rw')]), 1)
+
+
+class TestUtilisationTracker(unittest.TestCase):
+    def test_overlapping_requests(self):
+        tracker = UtilisationTracker(window=60.0, capacity=2)
+
+        span_a = tracker.start()
+        span_b = tracker.start()
+        self.assertEqual(tracker.in_flight, 2)
+
+        time.sleep(0.1)
+        tracker.end(span_a)
+        tracker.end(span_b)
+        tracker.end(span_b)  # Ending a span twice is harmless.
+        time.sleep(0.1)
+
+        in_flight, concurrency, saturation, idle_fraction = tracker.snapshot()
+        self.assertEqual(in_flight, 0)
+        self.assertAlmostEqual(concurrency, 1.0, delta=0.2)  # Two requests busy for ~half the window.
+        self.assertAlmostEqual(saturation, 0.5, delta=0.1)
+        self.assertAlmostEqual(idle_fraction, 0.5, delta=0.1)
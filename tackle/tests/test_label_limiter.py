@@ -0,0 +1,35 @@
+import unittest
+import logging
+
+from prometheus_client import Counter, REGISTRY
+
+from tackle.prometheus_utils import promths_exec_id
+from tackle.prometheus_utils import LabelLimiter, OVERFLOW_LABEL_VALUE, bounded_labels, log_record_template
+
+
+class TestLabelLimiter(unittest.TestCase):
+    def test_overflow_and_eviction(self):
+        counter = Counter('tackle_test_label_limiter', 'Test.', ['desc'])
+
+        limiter = LabelLimiter('test', max_values=2, min_idle=3600.0)
+        bounded_labels(counter, {'desc': limiter}, desc='a').inc()
+        bounded_labels(counter, {'desc': limiter}, desc='b').inc()
+        bounded_labels(counter, {'desc': limiter}, desc='c').inc()
+        self.assertEqual(REGISTRY.get_sample_value('tackle_test_label_limiter_total', {'desc': OVERFLOW_LABEL_VALUE}), 1.0)
+
+        # A rejected value is counted as dropped once, not per observation.
+        dropped_labels = {'exec_id': str(promths_exec_id), 'limiter': 'test', 'reason': 'overflow'}
+        bounded_labels(counter, {'desc': limiter}, desc='c').inc()
+        self.assertEqual(REGISTRY.get_sample_value('tackle_metric_series_dropped_total', dropped_labels), 1.0)
+
+        limiter.min_idle = 0.0  # Allow eviction of the least recently used value.
+        bounded_labels(counter, {'desc': limiter}, desc='d').inc()
+        self.assertIsNone(REGISTRY.get_sample_value('tackle_test_label_limiter_total', {'desc': 'a'}))
+        self.assertEqual(REGISTRY.get_sample_value('tackle_test_label_limiter_total', {'desc': 'd'}), 1.0)
+
+    def test_log_record_template(self):
+        record = logging.LogRecord('test', logging.ERROR, 'test_module.py', 10, "Failed for %s!", ('token_a',), None)
+        self.assertEqual(log_record_template(record), "Failed for %s!")
+
+        record = logging.LogRecord('test', logging.ERROR, 'test_module.py', 10, "Failed for token_a!", None, None)
+        self.assertEqual(log_record_template(record), "test_module.None:10")
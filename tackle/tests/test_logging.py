@@ -0,0 +1,62 @@
+import unittest
+import logging
+import queue
+import io
+import sys
+
+from prometheus_client import REGISTRY
+
+from tackle.flask_utils import DroppingQueueHandler, LazyTruncatedStr, _PeekedInput
+from tackle.prometheus_utils import promths_exec_id, log_record_template
+
+
+class TestQueuedLogging(unittest.TestCase):
+    def test_drop_on_overflow(self):
+        labels = {'exec_id': str(promths_exec_id)}
+        dropped_before = REGISTRY.get_sample_value('tackle_logging_dropped_total', labels) or 0.0
+
+        log_queue = queue.Queue(maxsize=1)  # type: queue.Queue
+        handler = DroppingQueueHandler(log_queue)
+        for i in range(3):
+            handler.handle(logging.LogRecord('test', logging.INFO, 'test.py', 1, "Record %d", (i,), None))
+
+        self.assertEqual(log_queue.get_nowait().getMessage(), "Record 0")
+        self.assertEqual(REGISTRY.get_sample_value('tackle_logging_dropped_total', labels), dropped_before + 2.0)
+
+    def test_prepare_renders_message(self):
+        log_queue = queue.Queue()  # type: queue.Queue
+        handler = DroppingQueueHandler(log_queue)
+
+        details = {'count': 1}
+        handler.handle(logging.LogRecord('test', logging.INFO, 'test.py', 1, "Details %s", (details,), None))
+        details['count'] = 2  # Changed by the caller after logging.
+
+        record = log_queue.get_nowait()
+        self.assertEqual(record.getMessage(), "Details {'count': 1}")
+        self.assertEqual(log_record_template(record), "Details %s")
+
+        try:
+            raise ValueError("Failed!")
+        except ValueError:
+            handler.handle(logging.LogRecord('test', logging.ERROR, 'test.py', 1, "Failed", None, sys.exc_info()))
+
+        record = log_queue.get_nowait()
+        self.assertIsNone(record.exc_info)
+        self.assertIn("ValueError: Failed!", logging.Formatter().format(record))
+
+    def test_lazy_truncated_str(self):
+        self.assertEqual(str(LazyTruncatedStr('abc', 10)), 'abc')
+        self.assertEqual(str(LazyTruncatedStr('a' * 20, 10)), 'aaaaaaa...')
+
+
+class TestPeekedInput(unittest.TestCase):
+    def test_replays_prefix(self):
+        stream = io.BytesIO(b'line one\nline two\n')
+        peeked_input = _PeekedInput(stream.read(5), stream)
+        self.assertEqual(peeked_input.read(3), b'lin')
+        self.assertEqual(peeked_input.readline(), b'e one\n')
+        self.assertEqual(peeked_input.read(), b'line two\n')
+
+        stream = io.BytesIO(b'ab\ncd\nef')
+        peeked_input = _PeekedInput(stream.read(4), stream)
+        self.assertEqual(list(peeked_input), [b'ab\n', b'cd\n', b'ef'])
@@ -0,0 +1,49 @@
+import unittest
+
+from prometheus_client import REGISTRY
+from prometheus_client import Gauge
+
+from tackle.concurrency_utils import UtilisationTracker
+
+from tackle.prometheus_utils import promths_exec_id
+from tackle.prometheus_utils import configure_latency_buckets, observe_request_latency
+from tackle.prometheus_utils import export_utilisation_tracker
+
+
+class TestLatencyHistograms(unittest.TestCase):
+    def test_endpoint_buckets(self):
+        observe_request_latency('test_default_endpoint', 0.2)
+        configure_latency_buckets('test_slow_endpoint', 'slow')
+        observe_request_latency('test_slow_endpoint', 200.0)
+
+        labels = {'exec_id': str(promths_exec_id), 'endpoint': 'test_default_endpoint'}
+        self.assertEqual(REGISTRY.get_sample_value('tackle_request_latency_seconds_bucket', dict(labels, le='0.25')), 1.0)
+
+        labels = {'exec_id': str(promths_exec_id), 'endpoint': 'test_slow_endpoint'}
+        self.assertEqual(REGISTRY.get_sample_value('tackle_slow_request_latency_seconds_bucket', dict(labels, le='120.0')), 0.0)
+        self.assertEqual(REGISTRY.get_sample_value('tackle_slow_request_latency_seconds_bucket', dict(labels, le='300.0')), 1.0)
+        self.assertIsNone(REGISTRY.get_sample_value('tackle_request_latency_seconds_count', labels))
+
+        with self.assertRaises(ValueError):
+            configure_latency_buckets('test_slow_endpoint', 'unknown')
+
+
+class _CountingTracker(UtilisationTracker):
+    def __init__(self) -> None:
+        UtilisationTracker.__init__(self)
+        self.snapshot_count = 0
+
+    def snapshot(self):
+        self.snapshot_count += 1
+        return UtilisationTracker.snapshot(self)
+
+
+class TestUtilisationGauges(unittest.TestCase):
+    def test_one_snapshot_per_scrape(self):
+        tracker = _CountingTracker()
+        export_utilisation_tracker(tracker, 'test_layer', Gauge('tackle_test_layer_idle_fraction', 'test', ['exec_id']))
+
+        labels = {'exec_id': str(promths_exec_id)}
+        self.assertEqual(REGISTRY.get_sample_value('tackle_test_layer_idle_fraction', labels), 1.0)
+        self.assertEqual(REGISTRY.get_sample_value('tackle_concurrency', dict(labels, layer='test_layer')), 0.0)
+        self.assertEqual(tracker.snapshot_count, 1)
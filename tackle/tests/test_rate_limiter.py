@@ -0,0 +1,62 @@
+import unittest
+import time
+
+from tackle.rest_api.rate_limiter import RateLimiter, BLOCKED_RETRY_AFTER
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_requests_per_sec(self):
+        rate_limiter = RateLimiter()
+        rate_limiter.set_limits('token_a', 2.0, None)
+
+        self.assertEqual(rate_limiter.acquire('token_a', 1), 0.0)
+        self.assertEqual(rate_limiter.acquire('token_a', 1), 0.0)
+        self.assertAlmostEqual(rate_limiter.acquire('token_a', 1), 0.5, delta=0.05)
+
+        status = rate_limiter.status('token_a')
+        assert status is not None
+        self.assertEqual((status.limit, status.remaining), (2, 0))
+        self.assertAlmostEqual(status.retry_after, 0.5, delta=0.05)
+
+        time.sleep(0.55)
+        self.assertEqual(rate_limiter.acquire('token_a', 1), 0.0)
+
+        self.assertEqual(rate_limiter.acquire('token_b', 1), 0.0)  # No limits.
+        self.assertIsNone(rate_limiter.status('token_b'))
+
+    def test_zero_limits(self):
+        rate_limiter = RateLimiter()
+        rate_limiter.set_limits('token_a', 0.0, None)
+        rate_limiter.set_limits('token_b', None, 0)
+
+        # A limit of 0 rejects every call.
+        for auth_token in ('token_a', 'token_b'):
+            self.assertEqual(rate_limiter.acquire(auth_token, 1), BLOCKED_RETRY_AFTER)
+
+            status = rate_limiter.status(auth_token)
+            assert status is not None
+            self.assertEqual((status.limit, status.remaining, status.reset), (0, 0, 0.0))
+            self.assertAlmostEqual(status.retry_after, BLOCKED_RETRY_AFTER, delta=0.05)
+
+        rate_limiter.refund('token_b', 5)
+        self.assertEqual(rate_limiter.acquire('token_b', 1), BLOCKED_RETRY_AFTER)
+
+    def test_units_per_min_and_worker_share(self):
+        rate_limiter = RateLimiter()
+        rate_limiter.set_limits('token_a', None, 600)
+        rate_limiter.configure_worker_share(0.5)  # 300 units/min in this worker.
+
+        self.assertEqual(rate_limiter.acquire('token_a', 200), 0.0)
+        self.assertAlmostEqual(rate_limiter.acquire('token_a', 200), 20.0, delta=0.1)  # 100 units short at 5 units/sec.
+        status = rate_limiter.status('token_a')
+        assert status is not None
+        self.assertEqual(status.remaining, 100)
+
+        # The units of a call that isn't charged are returned.
+        rate_limiter.refund('token_a', 50)
+        status = rate_limiter.status('token_a')
+        assert status is not None
+        self.assertEqual(status.remaining, 150)
+
+        rate_limiter.set_limits('token_a', None, None)
+        self.assertIsNone(rate_limiter.status('token_a'))
@@ -0,0 +1,85 @@
+import unittest
+import gzip
+import json
+
+import flask
+from prometheus_client import REGISTRY
+
+from tackle.response_utils import FastJSONProvider, configure_compression, cllbck_compress_response
+from tackle.prometheus_utils import promths_exec_id
+
+
+class TestFastJSONProvider(unittest.TestCase):
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.json_provider = FastJSONProvider(self.app)
+        self.app.json = self.json_provider
+
+    def test_dumps(self):
+        data = {'b': [1, 2.5, None], 'a': "text", 1: True}
+
+        with self.app.app_context():
+            self.assertEqual(json.loads(flask.json.dumps(data)), {'b': [1, 2.5, None], 'a': "text", '1': True})
+            self.assertEqual(flask.json.dumps({'b': 1, 'a': 2}, sort_keys=True), '{"a":2,"b":1}')
+            self.assertEqual(flask.json.dumps({'a': 1}, indent=2), '{\n  "a": 1\n}')
+
+            # Values orjson doesn't support fall back to the stdlib json.
+            self.assertEqual(flask.json.dumps({'a': 2 ** 70}), '{"a": %d}' % 2 ** 70)
+
+            self.json_provider.compact = True
+            self.assertEqual(flask.json.dumps({'a': 1}, indent=2), '{"a":1}')
+
+    def test_loads(self):
+        with self.app.app_context():
+            self.assertEqual(flask.json.loads(b'{"a": [1, "x"]}'), {'a': [1, "x"]})
+
+            with self.assertRaises(ValueError):
+                flask.json.loads('{"a": ')
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.app.after_request(cllbck_compress_response)
+
+        @self.app.route('/large')
+        def large():
+            return flask.jsonify({'items': ['item'] * 1000})
+
+        @self.app.route('/tagged')
+        def tagged():
+            response = flask.jsonify({'items': ['item'] * 1000})
+            response.set_etag('abc')
+            return response
+
+        @self.app.route('/small')
+        def small():
+            return flask.jsonify({'items': []})
+
+    def tearDown(self):
+        configure_compression(min_size=None)
+
+    def test_gzip(self):
+        configure_compression(min_size=256, level=6)
+        client = self.app.test_client()
+
+        labels = {'exec_id': str(promths_exec_id), 'endpoint': '/large', 'encoding': 'gzip'}
+        count_before = REGISTRY.get_sample_value('tackle_compression_ratio_count', labels) or 0.0
+
+        response = client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertIn('Accept-Encoding', response.headers.get('Vary', ''))
+        self.assertEqual(json.loads(gzip.decompress(response.data)), {'items': ['item'] * 1000})
+        self.assertEqual(REGISTRY.get_sample_value('tackle_compression_ratio_count', labels), count_before + 1.0)
+
+        # Below the size threshold or not accepted by the client.
+        self.assertIsNone(client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers.get('Content-Encoding'))
+        self.assertIsNone(client.get('/large').headers.get('Content-Encoding'))
+
+        # The ETag of a compressed response is weakened.
+        self.assertEqual(client.get('/tagged', headers={'Accept-Encoding': 'gzip'}).headers.get('ETag'), 'W/"abc"')
+        self.assertEqual(client.get('/tagged').headers.get('ETag'), '"abc"')
+
+    def test_disabled(self):
+        client = self.app.test_client()
+        self.assertIsNone(client.get('/large', headers={'Accept-Encoding': 'gzip'}).headers.get('Content-Encoding'))
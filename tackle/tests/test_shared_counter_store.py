@@ -0,0 +1,87 @@
+import unittest
+import os
+import tempfile
+import multiprocessing
+
+from tackle.db_models import token_digest
+from tackle.rest_api.shared_counter_store import SharedCounterStore
+
+digest_a = token_digest('token_a')
+
+
+def _reserve_units(path: str, num_calls: int):
+    store = SharedCounterStore(path)
+
+    for _ in range(num_calls):
+        if store.reserve(digest_a, 1, 0.0)[0]:
+            store.add_pending(digest_a, 'get_details', 1)
+
+    store.close()
+
+
+class TestSharedCounterStore(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'shared_counters')
+
+    def test_reserve_and_flush(self):
+        store = SharedCounterStore(self.path, num_slots=64)
+
+        self.assertEqual(store.reserve(digest_a, 1, 0.0), (None, 0, None))  # Not loaded yet.
+        self.assertTrue(store.load_token(digest_a, 8, 10, 1.0))
+
+        self.assertEqual(store.reserve(digest_a, 2, 0.0), (True, 10, 10))
+        self.assertEqual(store.reserve(digest_a, 1, 0.0), (False, 10, 10))
+        self.assertEqual(store.reserve(digest_a, 1, 2.0), (None, 0, None))  # Stale.
+        store.add_pending(digest_a, 'get_details', 2)
+
+        pending = store.take_pending()
+        self.assertEqual(pending, {(digest_a, 'get_details'): 2})
+        self.assertEqual(store.take_pending(), {})
+
+        store.complete_flush(pending, success=False)
+        self.assertEqual(store.take_pending(), pending)
+        store.complete_flush(pending, success=True)
+
+        # The DB count now includes the flushed units.
+        self.assertTrue(store.load_token(digest_a, 10, 10, 1.0))
+        self.assertEqual(store.reserve(digest_a, 1, 0.0), (False, 10, 10))
+
+        self.assertTrue(store.try_become_flusher())
+        store.close()
+
+        # The tokens aren't stored in the file.
+        with open(self.path, 'rb') as f:
+            self.assertNotIn(b'token_a', f.read())
+
+    def test_sweep_and_eviction(self):
+        store = SharedCounterStore(self.path, num_slots=8)
+
+        # A full store evicts the slots without units to flush.
+        for i in range(20):
+            self.assertTrue(store.load_token(token_digest(f'token_{i}'), 0, None, 1.0))
+
+        self.assertTrue(store.charge(digest_a, 1))  # Unflushed units; not evictable.
+        for i in range(20):
+            self.assertTrue(store.load_token(token_digest(f'token_{i}'), 0, None, 1.0))
+        self.assertEqual(store.reserve(digest_a, 0, 0.0), (None, 0, None))  # Still held, but not loaded.
+
+        store.complete_flush({(digest_a, None): 1}, success=True)
+        self.assertEqual(store.sweep(max_idle=0.0), 8)
+        self.assertEqual(store._keys(b'T'), [])
+        self.assertEqual(store.reserve(token_digest('token_19'), 1, 0.0), (None, 0, None))  # Freed; reloaded from the DB.
+        store.close()
+
+    def test_shared_between_processes(self):
+        store = SharedCounterStore(self.path, num_slots=64)
+        store.load_token(digest_a, 0, 50, 1.0)
+
+        processes = [multiprocessing.Process(target=_reserve_units, args=(self.path, 30)) for _ in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        # No more than the limit was reserved over the processes.
+        self.assertEqual(store.reserve(digest_a, 0, 0.0), (True, 50, 50))
+        self.assertEqual(store.take_pending(), {(digest_a, 'get_details'): 50})
+        store.close()
@@ -0,0 +1,36 @@
+import unittest
+import os
+
+from tackle.rest_api.worker_pool import WorkerPool, register_function
+
+
+def _square_in_worker(x: int) -> tuple:
+    if x < 0:
+        raise ValueError("Negative!")
+
+    return x * x, os.getpid()
+
+
+register_function(_square_in_worker)
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool('test', max_workers=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_call(self):
+        (result, worker_pid), wait_time = self.pool.call(_square_in_worker, (12,), {})
+
+        self.assertEqual(result, 144)
+        self.assertNotEqual(worker_pid, os.getpid())
+        self.assertGreaterEqual(wait_time, 0.0)
+
+        with self.assertRaises(ValueError):
+            self.pool.call(_square_in_worker, (), {'x': -1})
+
+        self.assertEqual(self.pool.queue_depth, 0)
+        self.assertGreater(self.pool.tracker.snapshot()[1], 0.0)  # The workers' busy time was recorded.
+        self.assertLessEqual(self.pool.utilisation(), 1.0)